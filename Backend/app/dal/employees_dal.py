@@ -1,9 +1,14 @@
 from fastapi import HTTPException,status,File,UploadFile
-from datetime import datetime
+from datetime import datetime, timezone
 from pydantic import EmailStr
 from passlib.context import CryptContext
+from pymongo import UpdateOne
 from pymongo.errors import DuplicateKeyError
 import json 
+import copy
+import asyncio
+from collections import Counter
+from bson import ObjectId
 
 from app.models.Person import Person
 from app.models.Token import Token
@@ -12,6 +17,8 @@ from app.models.ModifiedEmployee import ModifiedEmployee
 from app.models.PurchaseOrder import PurchaseOrder
 from app.models.AccessPermission import AccessPermission
 from app.models.Person import UserCredentials
+from app.database.search_index import employee_search
+from app.database.employee_cache import employee_cache
 
 """ from models.Person import Person
 from models.Token import Token
@@ -19,11 +26,169 @@ from models.FilteredEmployee import FilteredEmployee
 from models.ModifiedEmployee import ModifiedEmployee
 from models.PurchaseOrder import PurchaseOrder
 from models.AccessPermission import AccessPermission
-from models.Person import UserCredentials """
+from models.Person import UserCredentials
+from database.search_index import employee_search
+from database.employee_cache import employee_cache """
 
 #Password Context for hashing algorithm bcrypt
 pwd_context = CryptContext(schemes=["bcrypt"],deprecated="auto")
 
+#Fields left out of the employee listings (FilteredEmployee)
+FILTERED_EMPLOYEE_PROJECTION = {
+    "user_credentials": 0,
+    "birth_date": 0,
+    "id_card_end_date": 0,
+    "contract_type": 0,
+    "visa_start_date": 0,
+    "visa_end_date": 0,
+    "profile_image_path": 0,
+    "id_card_path": 0,
+    "visa_path": 0,
+    "unilav_path": 0,
+    "next_expiry": 0,
+    "stats_keys": 0
+}
+
+#Order of the employee listings, served by the (first_name, _id) index
+EMPLOYEE_LISTING_SORT = [("first_name", 1), ("_id", 1)]
+
+#Fields the employee queries can be sorted by
+QUERY_SORT_FIELDS = ("first_name", "last_name", "fiscal_code",
+                     "contract_validity_start_date", "contract_validity_end_date")
+
+#Fields left out of the file IDs cached by get_file_id, which keeps every *_path and parent_folder_id
+FILE_ID_PROJECTION = {"purchase_order": 0, "user_credentials": 0, "next_expiry": 0, "stats_keys": 0}
+
+#Employees fetched per round trip by get_all, a few MB with their purchase orders
+LISTING_BATCH_SIZE = 500
+
+#Fields of a purchase order stored once in the purchase_orders collection. The
+#employees reference it by po_number and keep their own access permissions.
+PURCHASE_ORDER_FIELDS = ("description", "issue_date", "validity_end_date", "duvri",
+                         "requester", "locations", "subapalto")
+
+#Expiring dates of an employee, by the item name used in next_expiry. Purchase
+#orders and access permissions expire on their validity_end_date.
+EXPIRY_FIELDS = {"id_card": "id_card_end_date",
+                 "visa": "visa_end_date",
+                 "contract": "contract_validity_end_date"}
+
+#Fields needed to compute next_expiry and stats_keys
+SUMMARY_PROJECTION = {"fiscal_code": 1, "purchase_order": 1, "next_expiry": 1, "stats_keys": 1,
+                      "contract_validity_start_date": 1,
+                      **{field: 1 for field in EXPIRY_FIELDS.values()}}
+
+def start_of_today() -> datetime:
+    """
+    Returns midnight UTC of the current day, naive like the dates read from Mongo.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+
+def compute_next_expiry(doc: dict, today: datetime) -> dict | None:
+    """
+    Returns the first date of an employee expiring today or later, and the item it belongs to.
+    Args:
+        doc (dict): The employee, with its purchase orders resolved.
+        today (datetime): Dates before this one already expired and are skipped.
+
+    Returns:
+        dict | None: The date, the item (id_card, visa, contract, purchase_order or access_permission)
+        and the po_number and protocol_number of the item if any. None if nothing expires anymore.
+    """
+    candidates = [(doc.get(field), {"item": item}) for item, field in EXPIRY_FIELDS.items()]
+    for purchase_order in doc.get("purchase_order") or []:
+        if not isinstance(purchase_order, dict):
+            continue
+        po_number = purchase_order.get("po_number")
+        candidates.append((purchase_order.get("validity_end_date"), {"item": "purchase_order", "po_number": po_number}))
+        for access_permission in purchase_order.get("access_permission") or []:
+            candidates.append((access_permission.get("validity_end_date"),
+                               {"item": "access_permission",
+                                "po_number": po_number,
+                                "protocol_number": access_permission.get("protocol_number")}))
+
+    upcoming = []
+    for date, item in candidates:
+        if isinstance(date, datetime):
+            if date.tzinfo:
+                date = date.astimezone(timezone.utc).replace(tzinfo=None)
+            if date >= today:
+                upcoming.append((date, item))
+    if not upcoming:
+        return None
+
+    date, item = min(upcoming, key=lambda candidate: candidate[0])
+    return {"date": date, **item}
+
+def same_details(stored: dict, details: dict) -> bool:
+    """
+    Returns whether a purchase order read from Mongo has the given details.
+    Dates are compared as Mongo stores them, naive UTC in milliseconds.
+    Args:
+        stored (dict): The purchase order read from the purchase_orders collection.
+        details (dict): The details to be stored, see PURCHASE_ORDER_FIELDS.
+
+    Returns:
+        bool: True if every detail is the same.
+    """
+    def stored_value(value):
+        if isinstance(value, datetime):
+            if value.tzinfo:
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            return value.replace(microsecond=value.microsecond // 1000 * 1000)
+        return value
+
+    return all(stored_value(stored.get(field)) == stored_value(details.get(field)) for field in PURCHASE_ORDER_FIELDS)
+
+def stats_key(key: dict) -> tuple:
+    """
+    Returns a stats key as a hashable tuple, dict() turns it back into the same key.
+    """
+    return tuple(key.items())
+
+def compute_stats_keys(doc: dict, today: datetime) -> list[dict]:
+    """
+    Returns the compliance counters an employee adds one to. The list is stored in
+    the employee (stats_keys), so a write knows which counters to move.
+    Args:
+        doc (dict): The employee, with its purchase orders resolved.
+        today (datetime): The day the dates are compared to.
+
+    Returns:
+        list[dict]: The keys of the counters, {"counter": name} or, for the access
+        permissions, {"counter": "permits", "plant": plant, "status": status}.
+        A key appears once for every time it is counted.
+    """
+    def naive(date):
+        if isinstance(date, datetime) and date.tzinfo:
+            return date.astimezone(timezone.utc).replace(tzinfo=None)
+        return date if isinstance(date, datetime) else None
+
+    keys = []
+    start, end = naive(doc.get("contract_validity_start_date")), naive(doc.get("contract_validity_end_date"))
+    if start and end and start <= today <= end:
+        keys.append({"counter": "active_employees"})
+
+    id_card_end = naive(doc.get("id_card_end_date"))
+    if id_card_end and id_card_end < today:
+        keys.append({"counter": "expired_id_cards"})
+
+    visa_end = naive(doc.get("visa_end_date"))
+    if visa_end and (visa_end.year, visa_end.month) == (today.year, today.month):
+        keys.append({"counter": "visas_expiring_this_month"})
+
+    for purchase_order in doc.get("purchase_order") or []:
+        if not isinstance(purchase_order, dict):
+            continue
+        access_permissions = purchase_order.get("access_permission") or []
+        if not access_permissions:
+            keys.append({"counter": "purchase_orders_without_permits"})
+        for access_permission in access_permissions:
+            keys.append({"counter": "permits",
+                         "plant": access_permission.get("plant"),
+                         "status": access_permission.get("status")})
+    return keys
+
 class EmployeesDAL:
     """
     Data Acces Layer (Querys logic to database via Async Mongo DB Driver "Motor")
@@ -31,24 +196,107 @@ class EmployeesDAL:
     def __init__(self, db):
         # Collection selected "Employees"
         self._db_collection = db.employees
+        self._purchase_orders = db.purchase_orders
+        self._stats = db.stats
     """
     FIND methods
     """
+    async def resolve_purchase_orders(self, docs: list[dict], known: dict[str, dict] | None = None) -> list[dict]:
+        """
+        Completes the purchase order references of the employees with the purchase
+        orders they point to, fetched with a single query. Purchase orders still
+        embedded in the employees (not migrated yet) are used when the collection
+        doesn't have them.
+        Args:
+            docs (list[dict]): The employee documents, changed in place.
+            known (dict[str, dict] | None): Purchase orders already fetched by number, reused and filled.
+
+        Returns:
+            list[dict]: The same documents.
+        """
+        known = {} if known is None else known
+        missing = {reference.get("po_number") for doc in docs for reference in doc.get("purchase_order") or []}
+        missing -= known.keys()
+        if missing:
+            async for purchase_order in self._purchase_orders.find({"po_number": {"$in": list(missing)}},
+                                                                    projection={"_id": 0}):
+                known[purchase_order["po_number"]] = purchase_order
+
+        for doc in docs:
+            if doc.get("purchase_order"):
+                doc["purchase_order"] = [{**reference,
+                                          **known.get(reference.get("po_number"), {}),
+                                          "access_permission": reference.get("access_permission") or []}
+                                         for reference in doc["purchase_order"]]
+        return docs
+
     
     async def get_file_id(self,fiscal_code:str,name:str):
 
-        document = await self._db_collection.find_one({"fiscal_code": fiscal_code},
-                                                      projection = {"_id":1,
-                                                                    "parent_folder_id":1,
-                                                                    "profile_image_path":1,
-                                                                    "id_card_path":1,
-                                                                    "visa_path":1,
-                                                                    "unilav_path":1})
+        # Every file ID of the employee is cached, thumbnails included
+        document = employee_cache.get_files(fiscal_code)
+        if document is None:
+            version = employee_cache.version()
+            document = await self._db_collection.find_one({"fiscal_code": fiscal_code},
+                                                          projection = FILE_ID_PROJECTION)
+            if document:
+                employee_cache.put(document, version, files=True)
         
-        return document[f"{name}_path"],document["parent_folder_id"]
+        return document.get(f"{name}_path"),document["parent_folder_id"]
+
+    async def get_file_ids(self,fiscal_codes:list[str],name:str) -> dict[str,str]:
+        """
+        Returns the Drive file IDs of one document type for several employees in a single query.
+        Args:
+            fiscal_codes (list[str]): The fiscal codes of the employees.
+            name (str): The document type (profile_image, id_card, visa or unilav).
+
+        Returns:
+            dict[str,str]: The file IDs by fiscal code, employees without the document are left out.
+        """
+        file_ids = {}
+        async for doc in self._db_collection.find({"fiscal_code": {"$in": fiscal_codes}},
+                                                  projection={"_id": 0,
+                                                              "fiscal_code": 1,
+                                                              f"{name}_path": 1}):
+            if doc.get(f"{name}_path"):
+                file_ids[doc["fiscal_code"]] = doc[f"{name}_path"]
+        return file_ids
                                                                     
 
 
+    async def get_documents(self,fiscal_codes:list[str]) -> dict[str,dict[str,str]]:
+        """
+        Returns the Drive file IDs of every document of several employees in a single query.
+        Args:
+            fiscal_codes (list[str]): The fiscal codes of the employees.
+
+        Returns:
+            dict[str,dict[str,str]]: The file IDs by document name, by fiscal code.
+        """
+        names = ["profile_image", "id_card", "visa", "unilav"]
+        documents = {}
+        async for doc in self._db_collection.find({"fiscal_code": {"$in": fiscal_codes}},
+                                                  projection={"_id": 0,
+                                                              "fiscal_code": 1,
+                                                              **{f"{name}_path": 1 for name in names}}):
+            documents[doc["fiscal_code"]] = {name: doc[f"{name}_path"] for name in names
+                                             if doc.get(f"{name}_path")}
+        return documents
+
+    async def get_folder_ids(self) -> dict[str,str]:
+        """
+        Returns the Drive folder ID of every employee.
+
+        Returns:
+            dict[str,str]: The folder IDs by fiscal code.
+        """
+        return {doc["fiscal_code"]: doc.get("parent_folder_id")
+                async for doc in self._db_collection.find({},
+                                                          projection={"_id": 0,
+                                                                      "fiscal_code": 1,
+                                                                      "parent_folder_id": 1})}
+
     async def list_employees(self, fiscal_code: str) -> Person:
 
         """
@@ -60,10 +308,16 @@ class EmployeesDAL:
             Person: The Person instance.
         """
 
-        document = await self._db_collection.find_one({"fiscal_code": fiscal_code})
-        if not document:
-            raise HTTPException(status_code=404, detail="Employee not found")
-        return document
+        document = employee_cache.get(fiscal_code)
+        if document is None:
+            version = employee_cache.version()
+            document = await self._db_collection.find_one({"fiscal_code": fiscal_code})
+            if not document:
+                raise HTTPException(status_code=404, detail="Employee not found")
+            await self.resolve_purchase_orders([document])
+            employee_cache.put(document, version)
+        # The cached employee is shared, the caller gets its own copy
+        return copy.deepcopy(document)
         
     async def get_all(self):
 
@@ -74,24 +328,167 @@ class EmployeesDAL:
             AsyncGenerator[FilteredEmployee, None, None]: An asynchronous generator that yields FilteredEmployee instances.
         """
 
+        # Purchase orders are fetched once per batch, and once for the whole listing
+        purchase_orders = {}
+        batch = []
         async for doc in self._db_collection.find({},
-                                                    projection={
-                                                        "_id": 0,
-                                                        "user_credentials": 0,
-                                                        "birth_date": 0,
-                                                        "id_card_end_date": 0,
-                                                        "contract_type": 0,
-                                                        "visa_start_date": 0,
-                                                        "visa_end_date": 0,
-                                                        "profile_image_path": 0,
-                                                        "id_card_path": 0,
-                                                        "visa_path": 0,
-                                                        "unilav_path": 0
-                                                    },
-                                                    sort={"first_name": 1}):
-            
+                                                    projection={"_id": 0, **FILTERED_EMPLOYEE_PROJECTION},
+                                                    sort=EMPLOYEE_LISTING_SORT,
+                                                    batch_size=LISTING_BATCH_SIZE):
+            batch.append(doc)
+            if len(batch) == LISTING_BATCH_SIZE:
+                for doc in await self.resolve_purchase_orders(batch, purchase_orders):
+                    yield FilteredEmployee.from_doc(doc)
+                batch = []
+
+        for doc in await self.resolve_purchase_orders(batch, purchase_orders):
             yield FilteredEmployee.from_doc(doc)
+
+    async def get_page(self, limit: int,
+                       after: tuple[str, ObjectId] | None = None) -> tuple[list[FilteredEmployee], tuple[str, ObjectId] | None]:
+        """
+        Returns a page of employees sorted by first name, starting after a given
+        employee. The page is found through the (first_name, _id) index, so every
+        page costs the same wherever it is in the listing.
+        Args:
+            limit (int): The maximum number of employees in the page.
+            after (tuple[str, ObjectId] | None): The first name and ID of the last employee of the previous page.
+
+        Returns:
+            tuple[list[FilteredEmployee], tuple[str, ObjectId] | None]: The employees, and the
+            key to request the next page (None on the last page).
+        """
+        query = {}
+        if after:
+            first_name, _id = after
+            # The range on first_name is one index bound, the $or only filters its start
+            query = {"first_name": {"$gte": first_name},
+                     "$or": [{"first_name": {"$gt": first_name}}, {"_id": {"$gt": _id}}]}
+
+        # One extra employee tells whether there is a next page
+        docs = await self._db_collection.find(query,
+                                              projection=FILTERED_EMPLOYEE_PROJECTION,
+                                              sort=EMPLOYEE_LISTING_SORT,
+                                              limit=limit + 1).to_list(None)
+        next_key = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_key = (docs[-1]["first_name"], docs[-1]["_id"])
+
+        await self.resolve_purchase_orders(docs)
+        return [FilteredEmployee.from_doc(doc) for doc in docs], next_key
     
+    @staticmethod
+    def employee_filter(contract_type: str | None = None,
+                        valid_from: datetime | None = None,
+                        valid_to: datetime | None = None,
+                        po_number: str | None = None,
+                        plant: str | None = None,
+                        permission_status: str | None = None) -> dict:
+        """
+        Builds the Mongo filter of an employee query. Every filter is optional.
+        Args:
+            contract_type (str | None): The contract type.
+            valid_from (datetime | None): Start of the window the contract must be valid in (overlap).
+            valid_to (datetime | None): End of the window the contract must be valid in (overlap).
+            po_number (str | None): A purchase order of the employee.
+            plant (str | None): The plant of an access permission.
+            permission_status (str | None): The status of that same access permission.
+
+        Returns:
+            dict: The filter.
+        """
+        query = {}
+        if contract_type:
+            query["contract_type"] = contract_type
+        if valid_from:
+            query["contract_validity_end_date"] = {"$gte": valid_from}
+        if valid_to:
+            query["contract_validity_start_date"] = {"$lte": valid_to}
+
+        # Plant and status must belong to the same permission, inside the requested purchase order
+        permission = {key: value for key, value in (("plant", plant), ("status", permission_status)) if value}
+        purchase_order = {}
+        if po_number:
+            purchase_order["po_number"] = po_number
+        if permission:
+            purchase_order["access_permission"] = {"$elemMatch": permission}
+        if purchase_order:
+            query["purchase_order"] = {"$elemMatch": purchase_order}
+
+        return query
+
+    async def query_employees(self, query: dict, sort: str = "first_name", descending: bool = False,
+                              skip: int = 0, limit: int = 50) -> tuple[list[FilteredEmployee], int]:
+        """
+        Returns a page of the employees matching a filter, and how many match in total.
+        Both run at the same time and are served by the indexes of the filtered fields.
+        Args:
+            query (dict): The filter, see employee_filter.
+            sort (str): The field to sort by, one of QUERY_SORT_FIELDS.
+            descending (bool): Whether to sort in descending order.
+            skip (int): The number of matching employees to skip.
+            limit (int): The maximum number of employees returned.
+
+        Returns:
+            tuple[list[FilteredEmployee], int]: The employees of the page and the total count.
+        """
+        if sort not in QUERY_SORT_FIELDS:
+            raise HTTPException(status_code=400, detail=f"Employees can't be sorted by {sort}")
+
+        direction = -1 if descending else 1
+        # The ID makes the order stable across pages
+        docs = self._db_collection.find(query,
+                                        projection={"_id": 0, **FILTERED_EMPLOYEE_PROJECTION},
+                                        sort=[(sort, direction), ("_id", direction)],
+                                        skip=skip,
+                                        limit=limit).to_list(None)
+        # Without filters the count comes from the collection metadata
+        total = (self._db_collection.count_documents(query) if query
+                 else self._db_collection.estimated_document_count())
+
+        docs, total = await asyncio.gather(docs, total)
+        await self.resolve_purchase_orders(docs)
+        return [FilteredEmployee.from_doc(doc) for doc in docs], total
+
+    async def get_expiring(self, until: datetime, limit: int,
+                           after: tuple[datetime, ObjectId] | None = None) -> tuple[list[dict], tuple[datetime, ObjectId] | None]:
+        """
+        Returns a page of the employees with something expiring between today and a
+        date, soonest first. The page is a range of the (next_expiry.date, _id) index.
+        Employees whose next expiry passed since it was computed are refreshed first.
+        Args:
+            until (datetime): The last date of the window.
+            limit (int): The maximum number of employees in the page.
+            after (tuple[datetime, ObjectId] | None): The next expiry date and ID of the last employee of the previous page.
+
+        Returns:
+            tuple[list[dict], tuple[datetime, ObjectId] | None]: The employees (first_name, last_name,
+            fiscal_code and next_expiry), and the key to request the next page (None on the last page).
+        """
+        today = start_of_today()
+        await self.refresh_summaries({"next_expiry.date": {"$lt": today}})
+
+        query = {"next_expiry.date": {"$gte": today, "$lte": until}}
+        if after:
+            date, _id = after
+            # The range on the date is one index bound, the $or only filters its start
+            query = {"next_expiry.date": {"$gte": max(date, today), "$lte": until},
+                     "$or": [{"next_expiry.date": {"$gt": date}}, {"_id": {"$gt": _id}}]}
+
+        # One extra employee tells whether there is a next page
+        docs = await self._db_collection.find(query,
+                                              projection={"first_name": 1, "last_name": 1,
+                                                          "fiscal_code": 1, "next_expiry": 1},
+                                              sort=[("next_expiry.date", 1), ("_id", 1)],
+                                              limit=limit + 1).to_list(None)
+        next_key = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_key = (docs[-1]["next_expiry"]["date"], docs[-1]["_id"])
+
+        return docs, next_key
+
     async def find_user_name(self,user_name:str)-> Person:
         """
         Returns a Person instance from the database based on the user name.
@@ -101,9 +498,14 @@ class EmployeesDAL:
         Returns:
             Person: The Person instance.
         """
-        document = await self._db_collection.find_one({"user_credentials.user_name": user_name},)
-        if not document:
-            raise HTTPException(status_code=404, detail="User not found")
+        document = employee_cache.get_by_user_name(user_name)
+        if document is None:
+            version = employee_cache.version()
+            document = await self._db_collection.find_one({"user_credentials.user_name": user_name},)
+            if not document:
+                raise HTTPException(status_code=404, detail="User not found")
+            await self.resolve_purchase_orders([document])
+            employee_cache.put(document, version)
         return Person.from_doc(document)
 
     
@@ -140,7 +542,8 @@ class EmployeesDAL:
         Returns:
             bool: True if the typed password matches the hashed password, False otherwise.
         """
-        return pwd_context.verify(typed_password,hashed_password)
+        # bcrypt is CPU bound, keep it off the event loop
+        return await asyncio.to_thread(pwd_context.verify,typed_password,hashed_password)
     
     async def hash_password(self,password:str):
         """
@@ -151,8 +554,113 @@ class EmployeesDAL:
         Returns:
             str: The hashed password.
         """
-        return pwd_context.hash(password)
+        return await asyncio.to_thread(pwd_context.hash,password)
     
+    async def refresh_summaries(self, query: dict, totals: Counter | None = None) -> int:
+        """
+        Computes again the next_expiry and stats_keys of the employees matching a
+        filter, in batches. The employees are only written where they changed, and
+        the compliance counters are moved by the difference.
+        Args:
+            query (dict): The filter of the employees.
+            totals (Counter | None): Counts every stats key of the employees when given.
+
+        Returns:
+            int: The number of employees that changed.
+        """
+        today = start_of_today()
+        purchase_orders = {}
+        changed = 0
+
+        async def store(batch: list[dict]) -> int:
+            await self.resolve_purchase_orders(batch, purchase_orders)
+            updates = []
+            changed_fiscal_codes = []
+            removed, added = Counter(), Counter()
+            for doc in batch:
+                next_expiry = compute_next_expiry(doc, today)
+                stats_keys = compute_stats_keys(doc, today)
+                if totals is not None:
+                    totals.update(stats_key(key) for key in stats_keys)
+                if next_expiry != doc.get("next_expiry") or stats_keys != doc.get("stats_keys"):
+                    updates.append(UpdateOne({"_id": doc["_id"]},
+                                             {"$set": {"next_expiry": next_expiry, "stats_keys": stats_keys}}))
+                    changed_fiscal_codes.append(doc["fiscal_code"])
+                    removed.update(stats_key(key) for key in doc.get("stats_keys") or [])
+                    added.update(stats_key(key) for key in stats_keys)
+            if updates:
+                await self._db_collection.bulk_write(updates, ordered=False)
+                employee_cache.invalidate(*changed_fiscal_codes)
+                await self.update_stats(removed, added)
+            return len(updates)
+
+        batch = []
+        async for doc in self._db_collection.find(query, projection=SUMMARY_PROJECTION,
+                                                  batch_size=LISTING_BATCH_SIZE):
+            batch.append(doc)
+            if len(batch) == LISTING_BATCH_SIZE:
+                changed += await store(batch)
+                batch = []
+        if batch:
+            changed += await store(batch)
+        return changed
+
+    async def update_stats(self, removed: Counter, added: Counter):
+        """
+        Moves the compliance counters after employees changed.
+        Args:
+            removed (Counter): The stats keys the employees no longer have, see stats_key.
+            added (Counter): The stats keys the employees have now.
+        """
+        deltas = Counter(added)
+        deltas.subtract(removed)
+        updates = [UpdateOne({"_id": dict(key)}, {"$inc": {"count": delta}}, upsert=True)
+                   for key, delta in deltas.items() if delta]
+        if updates:
+            await self._stats.bulk_write(updates, ordered=False)
+
+    async def recompute_stats(self) -> int:
+        """
+        Recomputes the summaries of every employee and overwrites the compliance
+        counters with the totals, correcting any drift, e.g. dates that passed
+        or writes made outside the DAL. Writes made while it runs may be lost
+        from the counters until the next recompute.
+
+        Returns:
+            int: The number of employees whose summaries changed.
+        """
+        totals = Counter()
+        changed = await self.refresh_summaries({}, totals)
+
+        updates = [UpdateOne({"_id": dict(key)}, {"$set": {"count": count}}, upsert=True)
+                   for key, count in totals.items()]
+        updates.append(UpdateOne({"_id": "recomputed_at"}, {"$set": {"date": datetime.now(timezone.utc)}}, upsert=True))
+        await self._stats.bulk_write(updates, ordered=False)
+        # Counters no employee has anymore
+        await self._stats.delete_many({"_id": {"$nin": [dict(key) for key in totals] + ["recomputed_at"]}})
+        return changed
+
+    async def get_stats(self) -> dict:
+        """
+        Returns the compliance counters. They are read from the summary collection,
+        whose size doesn't depend on the number of employees.
+
+        Returns:
+            dict: The counters by name, permits by plant and status, and when they were last recomputed.
+        """
+        stats = {"permits": {}, "recomputed_at": None}
+        async for doc in self._stats.find({}):
+            key = doc["_id"]
+            if key == "recomputed_at":
+                stats["recomputed_at"] = doc["date"]
+            elif key["counter"] == "permits":
+                if doc["count"]:
+                    plant, permit_status = key.get("plant") or "unknown", key.get("status") or "unknown"
+                    stats["permits"].setdefault(plant, {})[permit_status] = doc["count"]
+            else:
+                stats[key["counter"]] = doc["count"]
+        return stats
+
     """
     INSERT methods
     """
@@ -176,7 +684,9 @@ class EmployeesDAL:
                               id_card_path:str,
                               visa_path:str,
                               unilav_path:str,
-                              user_type:str = 'user'
+                              user_type:str = 'user',
+                              hashed_password:str | None = None,
+                              document_hashes:dict[str,str] | None = None
                               ):
         """
         Creates a new employee in the database.
@@ -199,12 +709,22 @@ class EmployeesDAL:
             visa_path (str): The path of the employee's visa.
             unilav_path (str): The path of the employee's unilav.
             user_type (str): The type of user (default is 'user').
+            hashed_password (str | None): The password already hashed, skips hashing it again.
+            document_hashes (dict[str,str] | None): The SHA-256 of every uploaded document by name.
 
         Returns:        
             dict: A dictionary containing a message indicating the success or failure of the operation.
 
         """
 
+        today = start_of_today()
+        dates = {"id_card_end_date": id_card_end_date,
+                 "visa_end_date": visa_end_date,
+                 "contract_validity_start_date": contract_validity_start_date,
+                 "contract_validity_end_date": contract_validity_end_date,
+                 "purchase_order": purchase_order}
+        stats_keys = compute_stats_keys(dates, today)
+
         try: 
             new = await self._db_collection.insert_one(
                 {"first_name":first_name,
@@ -219,7 +739,7 @@ class EmployeesDAL:
                 "visa_end_date":visa_end_date,
                 "user_credentials" :{
                     "email":email,
-                    "password": await self.hash_password(password),
+                    "password": hashed_password or await self.hash_password(password),
                     "user_type": user_type,
                     "user_name": user_name 
                     },
@@ -228,12 +748,18 @@ class EmployeesDAL:
                 "profile_image_path":profile_image_path,
                 "id_card_path":id_card_path,
                 "visa_path":visa_path,
-                "unilav_path":unilav_path
+                "unilav_path":unilav_path,
+                **{f"{name}_sha256": file_hash for name, file_hash in (document_hashes or {}).items()},
+                "next_expiry": compute_next_expiry(dates, today),
+                "stats_keys": stats_keys
                 }
             )
             
             if not new:
                 raise HTTPException(status_code=400, detail="Error trying to insert employee")
+            employee_search.add(first_name, last_name, fiscal_code)
+            employee_cache.invalidate(fiscal_code)
+            await self.update_stats(Counter(), Counter(stats_key(key) for key in stats_keys))
             return new
     
         except DuplicateKeyError as e:
@@ -265,7 +791,9 @@ class EmployeesDAL:
                                     access_permission:list[AccessPermission],
                                     ):
         """
-        Creates a purchase order in the database.
+        Creates a purchase order in the database if it doesn't exist, and assigns
+        it to the employees that don't have it yet. An existing purchase order
+        must have the same details.
         Args:
             fiscal_codes (list[str]): The fiscal codes of the employees involved in the purchase order.
             po_number (str): The purchase order number.
@@ -290,30 +818,51 @@ class EmployeesDAL:
         else:
             access_permission_dicts = AccessPermission.list_to_dict(access_permission)
         
+        details = {
+            "description": description,
+            "issue_date": issue_date,
+            "validity_end_date": validity_end_date,
+            "duvri": duvri,
+            "requester": {
+                "first_name": requester_first_name,
+                "last_name": requester_last_name,
+                "email": requester_email
+            },
+            "locations": locations,
+            "subapalto": {
+                "subapalto_number": subapalto_number,
+                "subapalto_status": subapalto_status
+            }}
+
+        # The details are stored once, the employees only get the number and their access permissions.
+        # An existing purchase order is only assigned, its details are changed by update_purchase_order
+        existing = await self._purchase_orders.find_one_and_update(
+            {"po_number": po_number},
+            {"$setOnInsert": details},
+            upsert=True
+        )
+        if existing is not None and not same_details(existing, details):
+            raise HTTPException(status_code=409, detail=f"PO: {po_number} already exists with other details")
+
         purchase_order = await self._db_collection.update_many(
-            {"fiscal_code": {"$in": fiscal_codes}},
+            {"fiscal_code": {"$in": fiscal_codes},
+             "purchase_order.po_number": {"$ne": po_number}},
             {"$push": {
                 "purchase_order": {
                     "po_number": po_number,
-                    "description": description,
-                    "issue_date": issue_date,
-                    "validity_end_date": validity_end_date,
-                    "duvri": duvri,
-                    "requester": {
-                        "first_name": requester_first_name,
-                        "last_name": requester_last_name,
-                        "email": requester_email
-                    },
-                    "locations": locations,
-                    "subapalto": {
-                        "subapalto_number": subapalto_number,
-                        "subapalto_status": subapalto_status
-                    },
                     "access_permission": access_permission_dicts}}}
         )
+        employee_cache.invalidate(*fiscal_codes)
         
-        if purchase_order.raw_result["nModified"]  <= 0:
-            raise HTTPException(status_code=40, detail="Error trying to insert purchase order")
+        if purchase_order.modified_count <= 0:
+            # Nobody was assigned a purchase order created for them
+            if existing is None and not await self._db_collection.find_one({"purchase_order.po_number": po_number},
+                                                                           projection={"_id": 1}):
+                await self._purchase_orders.delete_one({"po_number": po_number})
+            raise HTTPException(status_code=400, detail="Error trying to insert purchase order")
+
+        await self.refresh_summaries({"fiscal_code": {"$in": fiscal_codes},
+                                      "purchase_order.po_number": po_number})
         
         return purchase_order
         
@@ -428,8 +977,10 @@ class EmployeesDAL:
                     "gates": gates
                 }
             }})
+        employee_cache.invalidate(fiscal_code)
 
         if create_access_permission.modified_count > 0:
+            await self.refresh_summaries({"fiscal_code": fiscal_code})
             return create_access_permission
         else:
             raise HTTPException(status_code=400, detail="Error trying to insert access permission")
@@ -456,6 +1007,14 @@ class EmployeesDAL:
             )
             
             if updated_employee:
+                # The fiscal code may have changed too
+                employee_cache.invalidate(fiscal_code, updated_employee["fiscal_code"])
+                employee_search.remove(fiscal_code)
+                employee_search.add(updated_employee["first_name"],
+                                    updated_employee["last_name"],
+                                    updated_employee["fiscal_code"])
+                if any(field in update_data for field in ("contract_validity_start_date", *EXPIRY_FIELDS.values())):
+                    await self.refresh_summaries({"fiscal_code": updated_employee["fiscal_code"]})
                 return updated_employee
             else:
                 raise HTTPException(status_code=400, detail="Error trying to update employee")
@@ -502,9 +1061,12 @@ class EmployeesDAL:
             array_filters=[{"po.po_number":po_number},
                            {"ap.protocol_number":old_protocol_number}],
         )
+        employee_cache.invalidate_purchase_order(po_number)
         
         if access_permission.modified_count <= 0:
             raise HTTPException(status_code=404, detail="Access Permission not inserted")
+
+        await self.refresh_summaries({"purchase_order.po_number": po_number})
     
         return access_permission
         
@@ -524,22 +1086,52 @@ class EmployeesDAL:
         Returns:
             dict: A dictionary containing a message indicating the success or failure of the operation.
         """
-        update_query = {"$set": {}}
+        # Details go to the purchase order, the number and access permissions to the employees too
+        purchase_order_update = {}
+        employee_update = {}
         for key, value in update_data.items():
+            if key in ("po_number", "access_permission"):
+                employee_update[f"purchase_order.$[po].{key}"] = value
+            if key == "access_permission":
+                continue
             if isinstance(value,dict):
                 for sub_key,sub_value in value.items():
-                    update_query["$set"][f"purchase_order.$[po].{key}.{sub_key}"] = sub_value
+                    purchase_order_update[f"{key}.{sub_key}"] = sub_value
             else:
-                update_query["$set"][f"purchase_order.$[po].{key}"] = value
+                purchase_order_update[key] = value
 
-        purchase_order = await self._db_collection.update_many(
-            {"purchase_order.po_number" :old_po_number},
-            update_query,
-            array_filters=[{"po.po_number":old_po_number}]
-        )
+        purchase_order = references = None
+        try:
+            if purchase_order_update:
+                purchase_order = await self._purchase_orders.update_one(
+                    {"po_number": old_po_number},
+                    {"$set": purchase_order_update}
+                )
+                if purchase_order.matched_count == 0:
+                    # Not migrated yet, the purchase order only exists inside the employees
+                    employee_update.update({f"purchase_order.$[po].{key}": value
+                                            for key, value in purchase_order_update.items()})
+                    purchase_order = None
 
-        if purchase_order.modified_count > 0:
-            return purchase_order
+            if employee_update:
+                references = await self._db_collection.update_many(
+                    {"purchase_order.po_number" :old_po_number},
+                    {"$set": employee_update},
+                    array_filters=[{"po.po_number":old_po_number}]
+                )
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail=f"PO: {update_data.get('po_number')} already exists")
+        finally:
+            # The purchase order may be renamed even if the employees failed
+            employee_cache.invalidate_purchase_order(old_po_number)
+
+        # Either write is enough, e.g. only the access permissions or only the details changed
+        if sum(result.modified_count for result in (purchase_order, references) if result is not None) > 0:
+            # The employees hold the summaries, they change with their references or with the end date
+            if (references is not None and references.modified_count > 0) or \
+               (purchase_order is not None and purchase_order.modified_count > 0 and "validity_end_date" in update_data):
+                await self.refresh_summaries({"purchase_order.po_number": update_data.get("po_number", old_po_number)})
+            return references if references is not None else purchase_order
         else:
             raise HTTPException(status_code=400, detail=f"Order trying to update PO: {old_po_number}")
         
@@ -554,20 +1146,23 @@ class EmployeesDAL:
             fiscal_code (str): The fiscal code of the employee.
 
         Returns:
-            dict: A dictionary containing a message indicating the success or failure of the operation.
+            dict: The Drive folder and profile image IDs of the deleted employee.
         """
 
-        find_first = await self._db_collection.find_one({"fiscal_code":fiscal_code})
+        deleted = await self._db_collection.find_one_and_delete({"fiscal_code":fiscal_code},
+                                                                projection={"_id":0,
+                                                                            "fiscal_code":1,
+                                                                            "parent_folder_id":1,
+                                                                            "profile_image_path":1,
+                                                                            "stats_keys":1})
 
-        if not find_first:
+        if not deleted:
             raise HTTPException(status_code=404, detail=f"Employee with {fiscal_code} not found")
 
-        delete = await self._db_collection.delete_one({"fiscal_code":fiscal_code})
-
-        if delete.deleted_count == 1:
-            return delete 
-        
-        raise HTTPException(status_code=400, detail=f"Failed to delete employee with {fiscal_code}")
+        employee_search.remove(fiscal_code)
+        employee_cache.invalidate(fiscal_code)
+        await self.update_stats(Counter(stats_key(key) for key in deleted.pop("stats_keys", None) or []), Counter())
+        return deleted
 
     async def delete_purchase_order(self,
                                     po_number:str):
@@ -581,12 +1176,16 @@ class EmployeesDAL:
             dict: A dictionary containing a message indicating the success or failure of the operation.
         """
         
+        fiscal_codes = await self._db_collection.distinct("fiscal_code", {"purchase_order.po_number": po_number})
+        deleted = await self._purchase_orders.delete_one({"po_number": po_number})
         delete_purchase_order = await self._db_collection.update_many(
                                     {"purchase_order.po_number":po_number},
                                     {"$pull": {"purchase_order": {"po_number": po_number}}})
+        employee_cache.invalidate(*fiscal_codes)
         
     
-        if delete_purchase_order.modified_count > 0:
+        if deleted.deleted_count > 0 or delete_purchase_order.modified_count > 0:
+            await self.refresh_summaries({"fiscal_code": {"$in": fiscal_codes}})
             return delete_purchase_order
             
         raise HTTPException(status_code=400, detail=f"Failed to delete purchase order with {po_number}")
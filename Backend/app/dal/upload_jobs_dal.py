@@ -0,0 +1,190 @@
+import uuid
+from fastapi import HTTPException
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+
+# A claimed job goes back to the queue if its worker doesn't renew the lease in time
+JOB_LEASE = timedelta(minutes=5)
+# Workers renew the lease of their running jobs this often, see UploadWorker
+LEASE_RENEWAL_INTERVAL = JOB_LEASE / 3
+
+class UploadJobsDAL:
+    """
+    Data Acces Layer of the upload outbox: Drive writes still pending for registered employees
+    """
+    def __init__(self, db):
+        # Collection selected "Upload jobs"
+        self._db_collection = db.upload_jobs
+    """
+    FIND methods
+    """
+    async def get_job(self, job_id: str) -> dict:
+        """
+        Returns an upload job.
+        Args:
+            job_id (str): The ID of the job.
+
+        Returns:
+            dict: The upload job.
+        """
+        job = await self._db_collection.find_one({"_id": job_id})
+        if not job:
+            raise HTTPException(status_code=404, detail=f"Upload job {job_id} not found")
+        return job
+
+    async def claim_next_job(self) -> dict | None:
+        """
+        Atomically takes the next job due, or one whose worker stopped renewing its lease.
+
+        Returns:
+            dict | None: The claimed job with the ID of its new lease (lease_id), None if there is nothing to do.
+        """
+        now = datetime.now(timezone.utc)
+        return await self._db_collection.find_one_and_update(
+            {"$or": [{"status": "pending", "next_attempt_at": {"$lte": now}},
+                     {"status": "running", "lease_expires_at": {"$lte": now}}]},
+            {"$set": {"status": "running",
+                      "lease_id": uuid.uuid4().hex,
+                      "lease_expires_at": now + JOB_LEASE,
+                      "updated_at": now}},
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+    """
+    INSERT methods
+    """
+    async def create_job(self, job_id: str, fiscal_code: str, files: list[dict]):
+        """
+        Queues the Drive writes of a new employee.
+        Args:
+            job_id (str): The ID of the job.
+            fiscal_code (str): The fiscal code of the employee.
+            files (list[dict]): The spooled files (name, file_name, path, content_type).
+
+        Returns:
+            InsertOneResult: The result of the insert.
+        """
+        now = datetime.now(timezone.utc)
+        return await self._db_collection.insert_one({
+            "_id": job_id,
+            "fiscal_code": fiscal_code,
+            "status": "pending",
+            "folder_id": None,
+            "attempts": 0,
+            "last_error": None,
+            "next_attempt_at": now,
+            "lease_expires_at": None,
+            "created_at": now,
+            "updated_at": now,
+            "files": [{**file, "status": "pending", "file_id": None, "error": None} for file in files]
+        })
+    """
+    UPDATE methods
+    """
+    async def renew_lease(self, job_id: str, lease_id: str) -> bool:
+        """
+        Extends the lease of a running job, unless another worker claimed it since.
+        Args:
+            job_id (str): The ID of the job.
+            lease_id (str): The ID of the lease returned by claim_next_job.
+
+        Returns:
+            bool: Whether the lease is still held.
+        """
+        now = datetime.now(timezone.utc)
+        result = await self._db_collection.update_one(
+            {"_id": job_id, "status": "running", "lease_id": lease_id},
+            {"$set": {"lease_expires_at": now + JOB_LEASE, "updated_at": now}}
+        )
+        return result.matched_count > 0
+
+    async def set_folder(self, job_id: str, lease_id: str, folder_id: str):
+        """
+        Records the Drive folder created for the job and renews its lease, if it is still held.
+        Args:
+            job_id (str): The ID of the job.
+            lease_id (str): The ID of the lease returned by claim_next_job.
+            folder_id (str): The ID of the Drive folder.
+        """
+        now = datetime.now(timezone.utc)
+        await self._db_collection.update_one(
+            {"_id": job_id, "status": "running", "lease_id": lease_id},
+            {"$set": {"folder_id": folder_id, "lease_expires_at": now + JOB_LEASE, "updated_at": now}}
+        )
+
+    async def set_file_uploaded(self, job_id: str, lease_id: str, name: str, file_id: str):
+        """
+        Records a file uploaded to Drive and renews the lease of the job, if it is still held.
+        Args:
+            job_id (str): The ID of the job.
+            lease_id (str): The ID of the lease returned by claim_next_job.
+            name (str): The document name of the file.
+            file_id (str): The Drive ID of the file.
+        """
+        now = datetime.now(timezone.utc)
+        await self._db_collection.update_one(
+            {"_id": job_id, "status": "running", "lease_id": lease_id, "files.name": name},
+            {"$set": {"files.$.status": "uploaded",
+                      "files.$.file_id": file_id,
+                      "files.$.error": None,
+                      "lease_expires_at": now + JOB_LEASE,
+                      "updated_at": now}}
+        )
+
+    async def set_file_failed(self, job_id: str, lease_id: str, name: str, error: str):
+        """
+        Records a failed upload of a file, if the lease of the job is still held.
+        Args:
+            job_id (str): The ID of the job.
+            lease_id (str): The ID of the lease returned by claim_next_job.
+            name (str): The document name of the file.
+            error (str): The error raised by the upload.
+        """
+        await self._db_collection.update_one(
+            {"_id": job_id, "status": "running", "lease_id": lease_id, "files.name": name},
+            {"$set": {"files.$.status": "failed",
+                      "files.$.error": error,
+                      "updated_at": datetime.now(timezone.utc)}}
+        )
+
+    async def complete_job(self, job_id: str, lease_id: str, status: str = "done") -> bool:
+        """
+        Marks a job as finished, unless another worker claimed it since.
+        Args:
+            job_id (str): The ID of the job.
+            lease_id (str): The ID of the lease returned by claim_next_job.
+            status (str): The final status (done or cancelled).
+
+        Returns:
+            bool: Whether the job was marked, False if the lease was lost.
+        """
+        result = await self._db_collection.update_one(
+            {"_id": job_id, "status": "running", "lease_id": lease_id},
+            {"$set": {"status": status, "lease_expires_at": None, "updated_at": datetime.now(timezone.utc)}}
+        )
+        return result.matched_count > 0
+
+    async def retry_job(self, job_id: str, lease_id: str, attempts: int, error: str, retry_at: datetime | None) -> bool:
+        """
+        Puts a failed job back in the queue, or marks it as failed when there are no retries left,
+        unless another worker claimed it since.
+        Args:
+            job_id (str): The ID of the job.
+            lease_id (str): The ID of the lease returned by claim_next_job.
+            attempts (int): The number of attempts made so far.
+            error (str): The error of the last attempt.
+            retry_at (datetime | None): When to try again, None to give up.
+
+        Returns:
+            bool: Whether the job was updated, False if the lease was lost.
+        """
+        result = await self._db_collection.update_one(
+            {"_id": job_id, "status": "running", "lease_id": lease_id},
+            {"$set": {"status": "pending" if retry_at else "failed",
+                      "attempts": attempts,
+                      "last_error": error,
+                      "next_attempt_at": retry_at,
+                      "lease_expires_at": None,
+                      "updated_at": datetime.now(timezone.utc)}}
+        )
+        return result.matched_count > 0
@@ -1,8 +1,12 @@
 from fastapi import HTTPException
 from app.dal.employees_dal import EmployeesDAL
+from app.dal.upload_jobs_dal import UploadJobsDAL
 from app.database.connection import database
+from app.database.storage import Storage, storage
 """ from dal.employees_dal import EmployeesDAL
-from database.connection import database """
+from dal.upload_jobs_dal import UploadJobsDAL
+from database.connection import database
+from database.storage import Storage, storage """
 
 async def get_employees_dal() -> EmployeesDAL:
     """
@@ -10,4 +14,20 @@ async def get_employees_dal() -> EmployeesDAL:
     """
     if database.db is None:
         raise HTTPException(status_code=500, detail="No connection to collection ")
-    return EmployeesDAL(database.db)
\ No newline at end of file
+    return EmployeesDAL(database.db)
+
+async def get_upload_jobs_dal() -> UploadJobsDAL:
+    """
+    Async function to access the upload outbox
+    """
+    if database.db is None:
+        raise HTTPException(status_code=500, detail="No connection to collection ")
+    return UploadJobsDAL(database.db)
+
+async def get_storage() -> Storage:
+    """
+    Async function to access the configured file storage
+    """
+    if not storage.connected:
+        raise HTTPException(status_code=500, detail="No connection to file storage")
+    return storage
\ No newline at end of file
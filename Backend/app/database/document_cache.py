@@ -0,0 +1,303 @@
+import os
+import uuid
+import asyncio
+from collections import OrderedDict
+from contextlib import suppress
+from typing import BinaryIO
+from collections.abc import AsyncIterator
+from urllib.parse import quote, unquote
+
+# Bytes read at once from a fetch in progress
+FOLLOW_CHUNK_SIZE = 1024 * 1024
+
+def _append(f: BinaryIO, chunk: bytes):
+    # Flushed at once, for the readers of the fetch to see it
+    f.write(chunk)
+    f.flush()
+
+class _Fetch:
+    """
+    A document being written to the cache, read by the misses meanwhile.
+    """
+    def __init__(self, temp_path: str, path: str):
+        self.temp_path = temp_path
+        self.path = path
+        self.task: asyncio.Task | None = None
+        self.written = 0
+        self.complete = False
+        self.error: BaseException | None = None
+        # Set and replaced whenever the fetch moves
+        self.progress = asyncio.Event()
+
+    def notify(self):
+        self.progress.set()
+        self.progress = asyncio.Event()
+
+    def open(self) -> BinaryIO:
+        # Renamed once complete, an open file keeps being readable
+        try:
+            return open(self.temp_path, "rb")
+        except FileNotFoundError:
+            return open(self.path, "rb")
+
+class DocumentCache:
+    """
+    Read-through cache of remote documents on the local disk, keyed by file ID.
+
+    Every entry remembers the version (checksum) of the content it holds, so a
+    document replaced in place is fetched again even if nobody invalidated it.
+    The cache is bounded by the total size of its files and evicts the least
+    recently used ones. Files are written to a temporary file and renamed, so
+    a crash never leaves a partial entry behind, and the entries found on disk
+    at startup are kept. Misses are sent while the cache is filled, and
+    concurrent misses of the same file share one fetch.
+    """
+    def __init__(self):
+        self.directory: str | None = None
+        self.max_size = 0
+        self.size = 0
+        # (version, size) by file ID, least recently used first
+        self._entries: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        self._fetches: dict[tuple[str, str], _Fetch] = {}
+        self.counters = {"hits": 0, "misses": 0, "collapsed_misses": 0,
+                         "hit_bytes": 0, "miss_bytes": 0,
+                         "evictions": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    async def connect(self):
+        """
+        Opens the cache directory and indexes the entries left by previous runs.
+        Gets the directory and the size limit in bytes via the Enviroment variables
+        DOCUMENT_CACHE_DIR and DOCUMENT_CACHE_BYTES (0 disables the cache).
+        """
+        self.max_size = int(os.getenv("DOCUMENT_CACHE_BYTES", str(1024 * 1024 * 1024)))
+        if self.max_size <= 0:
+            print("Document cache disabled.")
+            return
+
+        directory = os.getenv("DOCUMENT_CACHE_DIR") or os.path.join(os.getenv("UPLOAD_DIR") or "uploads", "cache")
+        for file_id, version, size in await asyncio.to_thread(self._scan, directory):
+            # Only the newest version of a document is kept
+            if file_id in self._entries:
+                old_version, old_size = self._entries.pop(file_id)
+                self.size -= old_size
+                await self._remove(directory, file_id, old_version)
+            self._entries[file_id] = (version, size)
+            self.size += size
+        self.directory = directory
+        await self._evict()
+        print(f"Document cache ready in {directory} ({len(self._entries)} entries, {self.size} bytes).")
+
+    async def close(self):
+        """
+        Cancels the fetches still in progress, their temporary files are removed.
+        """
+        tasks = [fetch.task for fetch in self._fetches.values()]
+        for task in tasks:
+            task.cancel()
+        with suppress(asyncio.CancelledError):
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def _scan(directory: str) -> list[tuple[str, str, int]]:
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(directory):
+            # Leftovers of fetches interrupted by a crash
+            if entry.name.endswith(".part"):
+                os.remove(entry.path)
+                continue
+            file_id, separator, version = entry.name.partition("@")
+            if separator:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, unquote(file_id), unquote(version), stat.st_size))
+        return [entry[1:] for entry in sorted(entries)]
+
+    @staticmethod
+    def _file_name(file_id: str, version: str) -> str:
+        return f"{quote(file_id, safe='')}@{quote(version, safe='')}"
+
+    """
+    Cache operations
+    """
+    async def open(self, file_id: str, version: str) -> BinaryIO | None:
+        """
+        Returns the cached copy of a document opened for reading, if the cache
+        holds its current version.
+
+        Args:
+            file_id (str): The ID of the document.
+            version (str): The current version of the document, such as its checksum.
+
+        Returns:
+            BinaryIO | None: The cached copy, None on a miss or if the cache is disabled.
+        """
+        if not self.enabled or self._entries.get(file_id, (None,))[0] != version:
+            return None
+
+        path = os.path.join(self.directory, self._file_name(file_id, version))
+        try:
+            f = await asyncio.to_thread(open, path, "rb")
+        except FileNotFoundError:
+            # Removed behind our back, fetched again by the next miss
+            self.size -= self._entries.pop(file_id)[1]
+            return None
+        self._entries.move_to_end(file_id)
+        self.counters["hits"] += 1
+        self.counters["hit_bytes"] += os.fstat(f.fileno()).st_size
+        return f
+
+    def stream(self, storage, file_id: str, version: str, size: int,
+               byte_range: tuple[int, int] | None = None) -> AsyncIterator[bytes]:
+        """
+        Serves a miss. The document is fetched into the cache in the background and
+        sent from the temporary file as it grows, so the first byte doesn't wait for
+        the whole file. Concurrent misses of a document read the same fetch, which
+        goes on if the clients disconnect. A range is sent from the fetch in progress
+        if it already reached it, else it is streamed from the storage on its own.
+
+        Args:
+            storage (Storage): The storage the document comes from.
+            file_id (str): The ID of the document.
+            version (str): The current version of the document, such as its checksum.
+            size (int): The size of the document in bytes.
+            byte_range (tuple[int, int] | None): First and last byte (inclusive) to be sent.
+
+        Returns:
+            AsyncIterator[bytes]: The content requested.
+        """
+        if not self.enabled or size > self.max_size:
+            return storage.stream(file_id, byte_range)
+
+        key = (file_id, version)
+        fetch = self._fetches.get(key)
+        if fetch is None:
+            self.counters["misses"] += 1
+            fetch = _Fetch(self._temp_path(file_id, version),
+                           os.path.join(self.directory, self._file_name(file_id, version)))
+            self._fetches[key] = fetch
+            fetch.task = asyncio.create_task(self._fetch(storage, file_id, version, fetch))
+            fetch.task.add_done_callback(lambda task: self._fetch_done(key, task))
+            if byte_range is not None:
+                return storage.stream(file_id, byte_range)
+        elif byte_range is not None and byte_range[0] >= fetch.written:
+            # Not fetched yet, it may be far from the start
+            self.counters["misses"] += 1
+            return storage.stream(file_id, byte_range)
+        else:
+            self.counters["collapsed_misses"] += 1
+        return self._follow(fetch, byte_range or (0, size - 1))
+
+    def _fetch_done(self, key: tuple[str, str], task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            print(f"Document cache can't fetch {key[0]}: {task.exception()}")
+
+    def _temp_path(self, file_id: str, version: str) -> str:
+        return os.path.join(self.directory, f"{self._file_name(file_id, version)}.{uuid.uuid4().hex}.part")
+
+    async def _fetch(self, storage, file_id: str, version: str, fetch: _Fetch):
+        try:
+            with await asyncio.to_thread(open, fetch.temp_path, "wb") as f:
+                async for chunk in storage.stream(file_id):
+                    await asyncio.to_thread(_append, f, chunk)
+                    fetch.written += len(chunk)
+                    fetch.notify()
+                await asyncio.to_thread(os.fsync, f.fileno())
+            await asyncio.to_thread(os.replace, fetch.temp_path, fetch.path)
+            fetch.complete = True
+            await self._store(file_id, version, fetch.written)
+        except BaseException as e:
+            fetch.error = e
+            if not fetch.complete:
+                with suppress(FileNotFoundError):
+                    await asyncio.to_thread(os.remove, fetch.temp_path)
+            raise
+        finally:
+            self._fetches.pop((file_id, version), None)
+            fetch.notify()
+
+    async def _follow(self, fetch: _Fetch, byte_range: tuple[int, int]) -> AsyncIterator[bytes]:
+        """
+        Yields a range of a document from the file of its fetch, waiting for the
+        bytes that weren't written yet.
+        """
+        position, last = byte_range
+        f = None
+        try:
+            while position <= last:
+                progress = fetch.progress
+                if fetch.error is not None:
+                    raise RuntimeError(f"Fetch of the document failed: {fetch.error!r}")
+                if position < fetch.written:
+                    if f is None:
+                        f = await asyncio.to_thread(fetch.open)
+                    chunk = await asyncio.to_thread(os.pread, f.fileno(),
+                                                    min(fetch.written - position, last + 1 - position, FOLLOW_CHUNK_SIZE),
+                                                    position)
+                    position += len(chunk)
+                    yield chunk
+                elif fetch.complete:
+                    raise RuntimeError(f"Document shorter than expected: {fetch.written} bytes")
+                else:
+                    await progress.wait()
+        finally:
+            if f is not None:
+                f.close()
+
+    async def _store(self, file_id: str, version: str, size: int):
+        """
+        Records a document just written to the cache directory.
+        """
+        self.counters["miss_bytes"] += size
+        if file_id in self._entries:
+            old_version, old_size = self._entries.pop(file_id)
+            self.size -= old_size
+            if old_version != version:
+                await self._remove(self.directory, file_id, old_version)
+        self._entries[file_id] = (version, size)
+        self.size += size
+        await self._evict()
+
+    async def invalidate(self, file_id: str):
+        """
+        Drops the cached copy of a document after it was replaced or deleted.
+
+        Args:
+            file_id (str): The ID of the document.
+        """
+        if file_id in self._entries:
+            version, size = self._entries.pop(file_id)
+            self.size -= size
+            self.counters["invalidations"] += 1
+            await self._remove(self.directory, file_id, version)
+
+    async def _evict(self):
+        while self.size > self.max_size and self._entries:
+            file_id, (version, size) = self._entries.popitem(last=False)
+            self.size -= size
+            self.counters["evictions"] += 1
+            await self._remove(self.directory, file_id, version)
+
+    async def _remove(self, directory: str, file_id: str, version: str):
+        # Files being sent keep their content until they are closed
+        with suppress(FileNotFoundError):
+            await asyncio.to_thread(os.remove, os.path.join(directory, self._file_name(file_id, version)))
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the cache, useful to size it.
+
+        Returns:
+            dict: Hits, misses, bytes served and fetched, evictions and current usage.
+        """
+        lookups = self.counters["hits"] + self.counters["misses"] + self.counters["collapsed_misses"]
+        return {**self.counters,
+                "hit_ratio": self.counters["hits"] / lookups if lookups else None,
+                "entries": len(self._entries),
+                "size": self.size,
+                "max_size": self.max_size if self.enabled else 0}
+
+document_cache = DocumentCache()
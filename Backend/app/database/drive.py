@@ -0,0 +1,404 @@
+import os
+import re
+import json
+import asyncio
+import uuid
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta, timezone
+import httpx
+import requests
+from fastapi import HTTPException, UploadFile
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+
+SCOPES = ["https://www.googleapis.com/auth/drive"]
+SERVICE_ACCOUNT_FILE = "/etc/secrets/accesspermissionstorage-3b70e75ecae3.json"
+DRIVE_API_URL = "https://www.googleapis.com"
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+# Credentials are refreshed this long before they actually expire
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+# Files bigger than this are sent with the resumable upload protocol
+RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+# Resumable chunks must be a multiple of 256 KiB
+CHUNK_SIZE = 8 * 256 * 1024
+# Drive accepts at most 100 calls in a batch request
+MAX_BATCH_SIZE = 100
+
+class Drive:
+    """
+    Async Google Drive v3 client over a pooled HTTP/2 connection (httpx).
+    """
+    def __init__(self):
+        self.credentials: service_account.Credentials | None = None
+        self.client: httpx.AsyncClient | None = None
+        self._session: requests.Session | None = None
+        self._refresh_lock = asyncio.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self.client is not None
+
+    async def connect(self):
+        """
+        Authenticates against Google Drive with the service account and opens
+        the connection pool used for the whole life of the app.
+        Gets the service account file and pool limits via Enviroment variables.
+        """
+        try:
+            self.credentials = service_account.Credentials.from_service_account_file(
+                os.getenv("SERVICE_ACCOUNT_FILE", SERVICE_ACCOUNT_FILE), scopes=SCOPES
+            )
+        except FileNotFoundError as e:
+            print(f"Connection to Google Drive failed: {e}")
+            return
+
+        # Session reused by every token refresh
+        self._session = requests.Session()
+        self.client = httpx.AsyncClient(
+            base_url=os.getenv("DRIVE_API_URL", DRIVE_API_URL),
+            http2=os.getenv("DRIVE_HTTP2", "true").lower() == "true",
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("DRIVE_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(os.getenv("DRIVE_MAX_KEEPALIVE_CONNECTIONS", "20")),
+                keepalive_expiry=float(os.getenv("DRIVE_KEEPALIVE_EXPIRY", "60")),
+            ),
+            timeout=httpx.Timeout(float(os.getenv("DRIVE_TIMEOUT", "60")), connect=10.0),
+        )
+        print("Connection to Google Drive succesfull.")
+
+    async def close(self):
+        """
+        Closes the connection pool of the Drive client.
+        """
+        if self.client:
+            await self.client.aclose()
+            self._session.close()
+            print("Connection to Google Drive Closed.")
+
+    """
+    Authentication
+    """
+    async def _auth_headers(self) -> dict:
+        """
+        Returns the authorization header, refreshing the access token if it is
+        missing or about to expire. Concurrent callers share a single refresh.
+        """
+        async with self._refresh_lock:
+            # google-auth stores the expiry as a naive UTC datetime
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            expiry = self.credentials.expiry
+            if not self.credentials.token or expiry is None or expiry - now < TOKEN_REFRESH_MARGIN:
+                await asyncio.to_thread(self.credentials.refresh, Request(session=self._session))
+        return {"Authorization": f"Bearer {self.credentials.token}"}
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Sends an authenticated request to the Drive API.
+        """
+        headers = {**kwargs.pop("headers", {}), **await self._auth_headers()}
+        response = await self.client.request(method, url, headers=headers, **kwargs)
+        self._raise_for_status(response)
+        return response
+
+    @staticmethod
+    def _raise_for_status(response: httpx.Response):
+        """
+        Translates Drive API errors into HTTP exceptions.
+        """
+        if response.status_code == 404:
+            raise HTTPException(status_code=404, detail="File not found in Google Drive")
+        if response.is_error:
+            raise HTTPException(status_code=502,
+                                detail=f"Google Drive error: {response.status_code}")
+
+    def local_path(self, file_id: str) -> None:
+        """
+        Drive files are remote, they have no local path.
+        """
+        return None
+
+    """
+    Drive operations
+    """
+    async def create_folder(self, folder_name: str, parent_folder_id: str) -> str:
+        """
+        Creates a folder inside a parent folder.
+
+        Args:
+            folder_name (str): The name of the folder.
+            parent_folder_id (str): The ID of the parent folder.
+
+        Returns:
+            str: The ID of the created folder.
+        """
+        response = await self._request("POST", "/drive/v3/files",
+                                       params={"fields": "id"},
+                                       json={"name": folder_name,
+                                             "mimeType": FOLDER_MIME_TYPE,
+                                             "parents": [parent_folder_id]})
+        return response.json()["id"]
+
+    async def upload(self, file: UploadFile, folder_id: str,
+                     resumable: bool | None = None) -> str:
+        """
+        Uploads a file to a folder, reading it CHUNK_SIZE bytes at a time. Files
+        bigger than RESUMABLE_THRESHOLD are sent with the resumable protocol
+        unless told otherwise.
+
+        Args:
+            file (UploadFile): The file to be uploaded.
+            folder_id (str): The ID of the destination folder.
+            resumable (bool | None): Forces the upload protocol.
+
+        Returns:
+            str: The ID of the uploaded file.
+        """
+        metadata = {"name": file.filename, "parents": [folder_id]}
+        return await self._send_file(file, metadata, "POST", "/upload/drive/v3/files", resumable)
+
+    async def update(self, file_id: str, file: UploadFile,
+                     resumable: bool | None = None) -> str:
+        """
+        Uploads a new revision of an existing file in a single call, keeping its ID.
+
+        Args:
+            file_id (str): The ID of the file to be replaced.
+            file (UploadFile): The new content, its filename becomes the file name.
+            resumable (bool | None): Forces the upload protocol.
+
+        Returns:
+            str: The ID of the file.
+        """
+        metadata = {"name": file.filename}
+        return await self._send_file(file, metadata, "PATCH", f"/upload/drive/v3/files/{file_id}", resumable)
+
+    async def _send_file(self, file: UploadFile, metadata: dict, method: str, path: str,
+                         resumable: bool | None) -> str:
+        """
+        Sends a file with the multipart or the resumable protocol depending on its size.
+        """
+        mime_type = file.content_type or "application/octet-stream"
+        size = await self._file_size(file)
+
+        if resumable is None:
+            resumable = size > RESUMABLE_THRESHOLD
+
+        if resumable:
+            return await self._resumable_upload(file, metadata, mime_type, size, method, path)
+        return await self._simple_upload(file, metadata, mime_type, size, method, path)
+
+    async def _simple_upload(self, file: UploadFile, metadata: dict, mime_type: str, size: int,
+                             method: str, path: str) -> str:
+        """
+        Sends metadata and content in a single multipart request, streaming the
+        content in CHUNK_SIZE pieces.
+        """
+        boundary = uuid.uuid4().hex
+        head = b"".join([
+            f"--{boundary}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n".encode(),
+            json.dumps(metadata).encode(),
+            f"\r\n--{boundary}\r\nContent-Type: {mime_type}\r\n\r\n".encode(),
+        ])
+        tail = f"\r\n--{boundary}--".encode()
+
+        async def body() -> AsyncIterator[bytes]:
+            yield head
+            while chunk := await file.read(CHUNK_SIZE):
+                yield chunk
+            yield tail
+
+        response = await self._request(method, path,
+                                       params={"uploadType": "multipart", "fields": "id"},
+                                       headers={"Content-Type": f"multipart/related; boundary={boundary}",
+                                                "Content-Length": str(len(head) + size + len(tail))},
+                                       content=body())
+        return response.json()["id"]
+
+    async def _resumable_upload(self, file: UploadFile, metadata: dict,
+                                mime_type: str, size: int, method: str, path: str) -> str:
+        """
+        Opens a resumable session and sends the content in CHUNK_SIZE pieces.
+        """
+        session = await self._request(method, path,
+                                      params={"uploadType": "resumable", "fields": "id"},
+                                      headers={"X-Upload-Content-Type": mime_type,
+                                               "X-Upload-Content-Length": str(size)},
+                                      json=metadata)
+        session_url = session.headers["Location"]
+
+        offset = 0
+        while True:
+            chunk = await file.read(CHUNK_SIZE)
+            end = offset + len(chunk) - 1
+            content_range = f"bytes {offset}-{end}/{size}" if chunk else f"bytes */{size}"
+            # Sent as a one-shot stream so the request doesn't keep the chunk alive
+            response = await self.client.put(session_url, content=self._single_chunk(chunk),
+                                             headers={**await self._auth_headers(),
+                                                      "Content-Length": str(len(chunk)),
+                                                      "Content-Range": content_range})
+            # 308 Resume Incomplete: Drive is waiting for the next chunk
+            if response.status_code != 308:
+                self._raise_for_status(response)
+                return response.json()["id"]
+
+            # Drive reports what it persisted, resend anything it dropped
+            received = response.headers.get("Range")
+            offset = int(received.rsplit("-", 1)[1]) + 1 if received else 0
+            if offset != end + 1:
+                await file.seek(offset)
+
+    @staticmethod
+    async def _single_chunk(chunk: bytes) -> AsyncIterator[bytes]:
+        """
+        Wraps a chunk in a stream that releases it once it has been sent.
+        """
+        yield chunk
+
+    @staticmethod
+    async def _file_size(file: UploadFile) -> int:
+        """
+        Returns the size of an UploadFile without reading it into memory.
+        """
+        if file.size is not None:
+            return file.size
+        position = file.file.tell()
+        size = file.file.seek(0, os.SEEK_END)
+        file.file.seek(position)
+        return size - position
+
+    async def get_metadata(self, file_id: str,
+                           fields: str = "id, name, mimeType, size, md5Checksum, version, modifiedTime") -> dict:
+        """
+        Returns the metadata of a file.
+
+        Args:
+            file_id (str): The ID of the file.
+            fields (str): The metadata fields to be returned.
+
+        Returns:
+            dict: The metadata of the file.
+        """
+        response = await self._request("GET", f"/drive/v3/files/{file_id}",
+                                       params={"fields": fields})
+        return response.json()
+
+    async def stream(self, file_id: str,
+                     byte_range: tuple[int, int] | None = None) -> AsyncIterator[bytes]:
+        """
+        Yields the content of a file as it arrives from Drive.
+
+        Args:
+            file_id (str): The ID of the file.
+            byte_range (tuple[int, int] | None): First and last byte (inclusive) to be read.
+
+        Returns:
+            AsyncIterator[bytes]: The chunks of the file.
+        """
+        headers = await self._auth_headers()
+        if byte_range is not None:
+            headers["Range"] = f"bytes={byte_range[0]}-{byte_range[1]}"
+
+        async with self.client.stream("GET", f"/drive/v3/files/{file_id}",
+                                      params={"alt": "media"}, headers=headers) as response:
+            self._raise_for_status(response)
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                yield chunk
+
+    async def download(self, file_id: str) -> bytes:
+        """
+        Returns the whole content of a file.
+
+        Args:
+            file_id (str): The ID of the file.
+
+        Returns:
+            bytes: The content of the file.
+        """
+        response = await self._request("GET", f"/drive/v3/files/{file_id}",
+                                       params={"alt": "media"})
+        return response.content
+
+    async def list_files(self, query: str, fields: str = "files(id, name)") -> list[dict]:
+        """
+        Lists every file matching a Drive search query, following pagination.
+
+        Args:
+            query (str): The Drive search query.
+            fields (str): The fields returned for each file.
+
+        Returns:
+            list[dict]: The matching files.
+        """
+        files = []
+        params = {"q": query, "fields": f"nextPageToken, {fields}", "pageSize": 1000}
+        while True:
+            response = (await self._request("GET", "/drive/v3/files", params=params)).json()
+            files.extend(response.get("files", []))
+            if "nextPageToken" not in response:
+                return files
+            params["pageToken"] = response["nextPageToken"]
+
+    async def list_folder(self, folder_id: str) -> list[dict]:
+        """
+        Lists the files of a folder, trashed files excluded.
+
+        Args:
+            folder_id (str): The ID of the folder.
+
+        Returns:
+            list[dict]: The files (id, name).
+        """
+        return await self.list_files(f"'{folder_id}' in parents and trashed=false")
+
+    async def delete(self, file_id: str):
+        """
+        Deletes a file or folder permanently.
+
+        Args:
+            file_id (str): The ID of the file.
+        """
+        await self._request("DELETE", f"/drive/v3/files/{file_id}")
+
+    async def batch_delete(self, file_ids: list[str]) -> list[str]:
+        """
+        Deletes up to MAX_BATCH_SIZE files or folders with a single batch request.
+        Files that no longer exist count as deleted.
+
+        Args:
+            file_ids (list[str]): The IDs of the files.
+
+        Returns:
+            list[str]: The IDs of the files that couldn't be deleted.
+        """
+        if len(file_ids) > MAX_BATCH_SIZE:
+            raise ValueError(f"At most {MAX_BATCH_SIZE} files can be deleted in a batch")
+        if not file_ids:
+            return []
+
+        boundary = uuid.uuid4().hex
+        body = "".join(
+            f"--{boundary}\r\n"
+            f"Content-Type: application/http\r\n"
+            f"Content-ID: <item{i}>\r\n\r\n"
+            f"DELETE /drive/v3/files/{file_id} HTTP/1.1\r\n\r\n"
+            for i, file_id in enumerate(file_ids)
+        ) + f"--{boundary}--"
+
+        response = await self._request("POST", "/batch/drive/v3",
+                                       headers={"Content-Type": f"multipart/mixed; boundary={boundary}"},
+                                       content=body.encode())
+
+        # Every part of the answer carries the status of one call, matched by Content-ID
+        statuses = {}
+        response_boundary = response.headers["Content-Type"].split("boundary=")[1].strip('"')
+        for part in response.text.split(f"--{response_boundary}"):
+            item = re.search(r"Content-ID: <response-item(\d+)>", part, re.IGNORECASE)
+            status = re.search(r"HTTP/1\.1 (\d{3})", part)
+            if item and status:
+                statuses[int(item.group(1))] = int(status.group(1))
+
+        return [file_id for i, file_id in enumerate(file_ids)
+                if not (200 <= statuses.get(i, 500) < 300 or statuses.get(i) == 404)]
+
+drive = Drive()
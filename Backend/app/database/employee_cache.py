@@ -0,0 +1,325 @@
+import os
+import time
+import asyncio
+from contextlib import suppress
+from datetime import datetime, timezone
+from cachetools import TTLCache
+from pymongo.errors import OperationFailure, PyMongoError
+
+# Error codes of a change stream that can't be opened or resumed
+CHANGE_STREAMS_UNSUPPORTED = 40573
+CHANGE_STREAM_HISTORY_LOST = (280, 286)
+
+# Seconds before the change stream is opened again after an error
+CHANGE_STREAM_RETRY_DELAY = 5
+
+class EmployeeCache:
+    """
+    Read cache of the employees used by EmployeesDAL, keyed by fiscal code, with
+    the user names as aliases. It holds the employees with their purchase orders
+    resolved (list_employees, find_user_name) and the file IDs read by get_file_id.
+
+    Entries expire after EMPLOYEE_CACHE_TTL seconds and the least recently used
+    ones are evicted past EMPLOYEE_CACHE_SIZE entries. The write methods of the
+    DAL invalidate the employees they change, and a change stream on the
+    employees and purchase_orders collections invalidates the ones changed by
+    other processes. Without a replica set there is no change stream, and those
+    writes are seen once the entries expire.
+
+    An invalidation discards the employees being read at the same time, so a
+    read that started before a write never stores what it read after the write.
+    """
+    def __init__(self):
+        self.max_size = 0
+        self.ttl = 0
+        # (document, loaded at) by fiscal code
+        self._employees: TTLCache | None = None
+        self._files: TTLCache | None = None
+        # Fiscal codes by user name and by document ID
+        self._user_names: TTLCache | None = None
+        self._ids: TTLCache | None = None
+        # Moves on every invalidation, see version and put
+        self._version = 0
+        self._watcher: asyncio.Task | None = None
+        self.change_stream = "disabled"
+        self.counters = {"hits": 0, "misses": 0, "fills": 0, "discarded_fills": 0,
+                         "invalidations": 0, "stream_invalidations": 0, "clears": 0}
+        self._served_age = 0.0
+        self._max_served_age = 0.0
+        self._stream_lag: float | None = None
+        self._max_stream_lag = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self._employees is not None
+
+    async def connect(self, db):
+        """
+        Creates the cache and starts listening to the changes of the employees.
+        Gets the size in entries and the time to live in seconds via the Enviroment
+        variables EMPLOYEE_CACHE_SIZE (0 disables the cache) and EMPLOYEE_CACHE_TTL.
+
+        Args:
+            db (AsyncIOMotorDatabase): The application database.
+        """
+        self.max_size = int(os.getenv("EMPLOYEE_CACHE_SIZE", "10000"))
+        self.ttl = float(os.getenv("EMPLOYEE_CACHE_TTL", "60"))
+        if self.max_size <= 0 or self.ttl <= 0:
+            print("Employee cache disabled.")
+            return
+
+        self._employees = TTLCache(self.max_size, self.ttl)
+        self._files = TTLCache(self.max_size, self.ttl)
+        self._user_names = TTLCache(self.max_size, self.ttl)
+        self._ids = TTLCache(self.max_size, self.ttl)
+        self._watcher = asyncio.create_task(self._watch(db))
+        print(f"Employee cache ready ({self.max_size} entries, {self.ttl:g} s).")
+
+    async def close(self):
+        """
+        Stops listening to the changes and empties the cache.
+        """
+        if self._watcher:
+            self._watcher.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._watcher
+            self._watcher = None
+        if self.enabled:
+            self.clear()
+        self._employees = self._files = self._user_names = self._ids = None
+        self.change_stream = "disabled"
+
+    """
+    Cache operations
+    """
+    def version(self) -> int:
+        """
+        Returns the version to pass to put for what is read from now on.
+        """
+        return self._version
+
+    def _hit(self, entry: tuple[dict, float]) -> dict:
+        age = time.monotonic() - entry[1]
+        self.counters["hits"] += 1
+        self._served_age += age
+        self._max_served_age = max(self._max_served_age, age)
+        return entry[0]
+
+    def get(self, fiscal_code: str) -> dict | None:
+        """
+        Returns a cached employee, with its purchase orders resolved. It is shared
+        with the other readers and must not be changed.
+
+        Args:
+            fiscal_code (str): The fiscal code of the employee.
+
+        Returns:
+            dict | None: The employee, None if it isn't cached.
+        """
+        if not self.enabled:
+            return None
+        entry = self._employees.get(fiscal_code)
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+        return self._hit(entry)
+
+    def get_by_user_name(self, user_name: str) -> dict | None:
+        """
+        Returns a cached employee by user name, see get.
+
+        Args:
+            user_name (str): The user name of the employee.
+
+        Returns:
+            dict | None: The employee, None if it isn't cached.
+        """
+        if not self.enabled:
+            return None
+        fiscal_code = self._user_names.get(user_name)
+        entry = self._employees.get(fiscal_code) if fiscal_code is not None else None
+        if entry is None or entry[0].get("user_credentials", {}).get("user_name") != user_name:
+            self.counters["misses"] += 1
+            return None
+        return self._hit(entry)
+
+    def get_files(self, fiscal_code: str) -> dict | None:
+        """
+        Returns the cached file and folder IDs of an employee, from the cached
+        employee if there is one.
+
+        Args:
+            fiscal_code (str): The fiscal code of the employee.
+
+        Returns:
+            dict | None: The parent_folder_id and the *_path fields, None if they aren't cached.
+        """
+        if not self.enabled:
+            return None
+        entry = self._employees.get(fiscal_code) or self._files.get(fiscal_code)
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+        return self._hit(entry)
+
+    def put(self, document: dict, version: int, files: bool = False):
+        """
+        Stores an employee read from the database, unless something was
+        invalidated since it was read.
+
+        Args:
+            document (dict): The employee, with _id and fiscal_code, no longer changed by the caller.
+            version (int): The version returned before reading it.
+            files (bool): Whether the document only holds the file IDs (get_file_id).
+        """
+        if not self.enabled:
+            return
+        if version != self._version:
+            self.counters["discarded_fills"] += 1
+            return
+
+        fiscal_code = document["fiscal_code"]
+        entry = (document, time.monotonic())
+        if files:
+            self._files[fiscal_code] = entry
+        else:
+            self._employees[fiscal_code] = entry
+            user_name = (document.get("user_credentials") or {}).get("user_name")
+            if user_name is not None:
+                self._user_names[user_name] = fiscal_code
+        self._ids[document["_id"]] = fiscal_code
+        self.counters["fills"] += 1
+
+    def invalidate(self, *fiscal_codes: str):
+        """
+        Drops employees after they were changed or deleted.
+
+        Args:
+            fiscal_codes (str): The fiscal codes of the employees.
+        """
+        self._version += 1
+        if not self.enabled:
+            return
+        for fiscal_code in fiscal_codes:
+            dropped = False
+            for entries in (self._employees, self._files):
+                entry = entries.pop(fiscal_code, None)
+                if entry is not None:
+                    dropped = True
+                    self._ids.pop(entry[0]["_id"], None)
+                    user_name = (entry[0].get("user_credentials") or {}).get("user_name")
+                    if self._user_names.get(user_name) == fiscal_code:
+                        del self._user_names[user_name]
+            self.counters["invalidations"] += dropped
+
+    def invalidate_purchase_order(self, po_number: str):
+        """
+        Drops the employees having a purchase order, after its details changed.
+
+        Args:
+            po_number (str): The purchase order number.
+        """
+        if not self.enabled:
+            self._version += 1
+            return
+        self.invalidate(*[fiscal_code for fiscal_code, (document, _) in list(self._employees.items())
+                          if any(purchase_order.get("po_number") == po_number
+                                 for purchase_order in document.get("purchase_order") or [])])
+
+    def clear(self):
+        """
+        Drops every employee, when changes may have been missed.
+        """
+        self._version += 1
+        if self.enabled:
+            for entries in (self._employees, self._files, self._user_names, self._ids):
+                entries.clear()
+            self.counters["clears"] += 1
+
+    """
+    Change stream
+    """
+    async def _watch(self, db):
+        pipeline = [{"$match": {"ns.coll": {"$in": ["employees", "purchase_orders"]}}}]
+        resume_token = None
+        while True:
+            try:
+                async with db.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                    self.change_stream = "running"
+                    async for change in stream:
+                        self._apply(change)
+                        resume_token = stream.resume_token
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    self.change_stream = "unsupported"
+                    print("Employee cache: change streams need a replica set, "
+                          "writes of other processes are seen when the entries expire.")
+                    return
+                if e.code in CHANGE_STREAM_HISTORY_LOST:
+                    resume_token = None
+                self._stream_failed(e)
+            except PyMongoError as e:
+                self._stream_failed(e)
+            except Exception as e:
+                self.change_stream = "failed"
+                print(f"Employee cache: can't watch the changes, writes of other processes "
+                      f"are seen when the entries expire: {e}")
+                return
+            await asyncio.sleep(CHANGE_STREAM_RETRY_DELAY)
+
+    def _stream_failed(self, error: Exception):
+        # Changes made until the stream is resumed may be lost
+        self.change_stream = "retrying"
+        self.clear()
+        print(f"Employee cache: change stream failed, the cache was emptied: {error}")
+
+    def _apply(self, change: dict):
+        """
+        Invalidates the employees changed by a change stream event.
+        """
+        operation = change["operationType"]
+        collection = change.get("ns", {}).get("coll")
+        document = change.get("fullDocument") or {}
+        invalidations = self.counters["invalidations"]
+        if operation in ("drop", "rename", "dropDatabase", "invalidate"):
+            self.clear()
+        elif collection == "employees":
+            fiscal_codes = {document.get("fiscal_code"),
+                            self._ids.get(change["documentKey"]["_id"]) if self.enabled else None}
+            self.invalidate(*(fiscal_code for fiscal_code in fiscal_codes if fiscal_code is not None))
+        elif collection == "purchase_orders":
+            if document.get("po_number") is not None:
+                self.invalidate_purchase_order(document["po_number"])
+            elif operation != "delete":
+                # Deleted since, the employees drop the reference in their own event
+                self.clear()
+        self.counters["stream_invalidations"] += self.counters["invalidations"] - invalidations
+
+        wall_time = change.get("wallTime")
+        if isinstance(wall_time, datetime):
+            lag = (datetime.now(timezone.utc) - wall_time.replace(tzinfo=timezone.utc)).total_seconds()
+            self._stream_lag = lag
+            self._max_stream_lag = max(self._max_stream_lag, lag)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the cache, useful to size it and to see how stale
+        its answers can be.
+
+        Returns:
+            dict: Hits, misses, invalidations, the age of the served entries and the
+            delay of the change stream in seconds, and the current usage.
+        """
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {**self.counters,
+                "hit_ratio": self.counters["hits"] / lookups if lookups else None,
+                "served_age_avg": self._served_age / self.counters["hits"] if self.counters["hits"] else None,
+                "served_age_max": self._max_served_age,
+                "change_stream": self.change_stream,
+                "change_stream_lag": self._stream_lag,
+                "change_stream_lag_max": self._max_stream_lag,
+                "entries": len(self._employees) + len(self._files) if self.enabled else 0,
+                "max_size": self.max_size if self.enabled else 0,
+                "ttl": self.ttl if self.enabled else 0}
+
+employee_cache = EmployeeCache()
@@ -0,0 +1,86 @@
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+# Indexes every collection needs, by collection name
+INDEXES: dict[str, list[IndexModel]] = {
+    "employees": [
+        # The DAL turns DuplicateKeyError on these into 400 responses
+        IndexModel([("fiscal_code", ASCENDING)], unique=True),
+        IndexModel([("user_credentials.user_name", ASCENDING)], unique=True),
+        IndexModel([("user_credentials.email", ASCENDING)], unique=True),
+        # Employee listings sort by first name, the ID makes the order unique for keyset pagination
+        IndexModel([("first_name", ASCENDING), ("_id", ASCENDING)]),
+        # Employee queries: contract type (equality) sorted by name, and the contract validity window
+        IndexModel([("contract_type", ASCENDING), ("first_name", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("contract_validity_end_date", ASCENDING), ("contract_validity_start_date", ASCENDING)]),
+        # Employee queries by plant and status of an access permission (multikey)
+        IndexModel([("purchase_order.access_permission.plant", ASCENDING),
+                    ("purchase_order.access_permission.status", ASCENDING)]),
+        # Expiring soon: a range of next expiry dates, the ID makes the order unique for keyset pagination
+        IndexModel([("next_expiry.date", ASCENDING), ("_id", ASCENDING)]),
+        # Multikey: purchase orders and access permissions are embedded arrays. The
+        # prefix serves the purchase order updates and deletes on its own.
+        IndexModel([("purchase_order.po_number", ASCENDING),
+                    ("purchase_order.access_permission.protocol_number", ASCENDING)]),
+    ],
+    "purchase_orders": [
+        # Employees reference purchase orders by number
+        IndexModel([("po_number", ASCENDING)], unique=True),
+    ],
+    "revoked_tokens": [
+        # Revocations are dropped once the token expired, the new ones are polled by revocation date
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+        IndexModel([("revoked_at", ASCENDING)]),
+    ],
+    "upload_jobs": [
+        # claim_next_job: due pending jobs, and running jobs with an expired lease
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)]),
+    ],
+}
+
+# Options that make two indexes on the same keys different
+INDEX_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds", "collation")
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    """
+    Creates the indexes declared in INDEXES that are missing, and rebuilds the
+    ones that exist with the same keys but different options (e.g. not unique).
+    Indexes nobody declared are reported but left alone. Errors are printed so a
+    bad index (such as duplicates blocking a unique one) doesn't stop the app.
+
+    Args:
+        db (AsyncIOMotorDatabase): The application database.
+    """
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        existing = {tuple(index["key"].items()): index async for index in collection.list_indexes()}
+        declared = set()
+        missing = []
+
+        for index in indexes:
+            spec = index.document
+            keys = tuple(spec["key"].items())
+            declared.add(keys)
+            current = existing.get(keys)
+            if current is None:
+                missing.append(index)
+            elif any(current.get(option) != spec.get(option) for option in INDEX_OPTIONS):
+                print(f"Rebuilding index {current['name']} of {collection_name} with new options")
+                try:
+                    await collection.drop_index(current["name"])
+                    missing.append(index)
+                except OperationFailure as e:
+                    print(f"Error dropping index {current['name']} of {collection_name}: {e}")
+
+        for index in missing:
+            try:
+                name = await collection.create_indexes([index])
+                print(f"Index {name[0]} created in {collection_name}")
+            except OperationFailure as e:
+                print(f"Error creating index {index.document['name']} in {collection_name}: {e}")
+
+        for keys, index in existing.items():
+            if keys not in declared and index["name"] != "_id_":
+                print(f"Index {index['name']} of {collection_name} is not declared in INDEXES")
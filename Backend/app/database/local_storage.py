@@ -0,0 +1,255 @@
+import os
+import uuid
+import shutil
+import asyncio
+import hashlib
+import mimetypes
+from collections.abc import AsyncIterator
+from datetime import datetime, timezone
+from fastapi import HTTPException, UploadFile
+from app.database.drive import CHUNK_SIZE
+#from database.drive import CHUNK_SIZE
+
+class LocalStorage:
+    """
+    File storage on the local filesystem, under UPLOAD_DIR.
+
+    Employee folders are sharded by a hash of the fiscal code
+    (UPLOAD_DIR/3f/<fiscal_code>/) so no directory grows too big, and the ID of
+    a file is its path relative to UPLOAD_DIR. Files are written to a temporary
+    file and renamed, so readers never see a partial document.
+    """
+    def __init__(self):
+        self.root: str | None = None
+
+    @property
+    def connected(self) -> bool:
+        return self.root is not None
+
+    async def connect(self):
+        """
+        Creates the storage directory, taken from the UPLOAD_DIR Enviroment variable.
+        """
+        root = os.path.abspath(os.getenv("UPLOAD_DIR") or "uploads")
+        await asyncio.to_thread(os.makedirs, root, exist_ok=True)
+        self.root = root
+        print(f"Local storage ready in {root}.")
+
+    async def close(self):
+        """
+        Nothing to release, kept for symmetry with the Drive client.
+        """
+        self.root = None
+
+    def local_path(self, file_id: str) -> str:
+        """
+        Returns the absolute path of a file, refusing IDs that point outside the storage.
+
+        Args:
+            file_id (str): The ID of the file.
+
+        Returns:
+            str: The path of the file.
+        """
+        path = os.path.realpath(os.path.join(self.root, file_id))
+        if os.path.commonpath([path, self.root]) != self.root or path == self.root:
+            raise HTTPException(status_code=404, detail="File not found in local storage")
+        return path
+
+    """
+    Storage operations
+    """
+    async def create_folder(self, folder_name: str, parent_folder_id: str | None = None) -> str:
+        """
+        Creates the folder of an employee. The parent folder only applies to Drive.
+
+        Args:
+            folder_name (str): The name of the folder, the fiscal code of the employee.
+            parent_folder_id (str | None): Ignored.
+
+        Returns:
+            str: The ID of the folder.
+        """
+        shard = hashlib.sha1(folder_name.encode()).hexdigest()[:2]
+        folder_id = f"{shard}/{folder_name}"
+        await asyncio.to_thread(os.makedirs, self.local_path(folder_id), exist_ok=True)
+        return folder_id
+
+    async def upload(self, file: UploadFile, folder_id: str,
+                     resumable: bool | None = None) -> str:
+        """
+        Writes a file to a folder, replacing any file with the same name.
+
+        Args:
+            file (UploadFile): The file to be written.
+            folder_id (str): The ID of the destination folder.
+            resumable (bool | None): Ignored, only applies to Drive.
+
+        Returns:
+            str: The ID of the written file.
+        """
+        file_id = f"{folder_id}/{os.path.basename(file.filename)}"
+        await asyncio.to_thread(self._write, file.file, self.local_path(file_id))
+        return file_id
+
+    async def update(self, file_id: str, file: UploadFile,
+                     resumable: bool | None = None) -> str:
+        """
+        Replaces the content of an existing file. The ID changes if the new
+        content comes with a different file name.
+
+        Args:
+            file_id (str): The ID of the file to be replaced.
+            file (UploadFile): The new content, its filename becomes the file name.
+            resumable (bool | None): Ignored, only applies to Drive.
+
+        Returns:
+            str: The ID of the file.
+        """
+        path = self.local_path(file_id)
+        if not os.path.isfile(path):
+            raise HTTPException(status_code=404, detail="File not found in local storage")
+
+        new_file_id = await self.upload(file, os.path.dirname(file_id))
+        if new_file_id != file_id:
+            await asyncio.to_thread(os.remove, path)
+        return new_file_id
+
+    @staticmethod
+    def _write(source, path: str):
+        temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.part")
+        try:
+            with open(temp_path, "wb") as f:
+                shutil.copyfileobj(source, f, CHUNK_SIZE)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    async def get_metadata(self, file_id: str, fields: str | None = None) -> dict:
+        """
+        Returns the metadata of a file, with the same keys as Drive. The version
+        changes every time the file is written.
+
+        Args:
+            file_id (str): The ID of the file.
+            fields (str | None): Ignored, every field is returned.
+
+        Returns:
+            dict: The metadata of the file.
+        """
+        try:
+            stat = await asyncio.to_thread(os.stat, self.local_path(file_id))
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found in local storage")
+
+        name = os.path.basename(file_id)
+        return {"id": file_id,
+                "name": name,
+                "mimeType": mimetypes.guess_type(name)[0] or "application/octet-stream",
+                "size": str(stat.st_size),
+                "version": f"{stat.st_mtime_ns:x}-{stat.st_size:x}",
+                "modifiedTime": datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat()}
+
+    async def stream(self, file_id: str,
+                     byte_range: tuple[int, int] | None = None) -> AsyncIterator[bytes]:
+        """
+        Yields the content of a file CHUNK_SIZE bytes at a time.
+
+        Args:
+            file_id (str): The ID of the file.
+            byte_range (tuple[int, int] | None): First and last byte (inclusive) to be read.
+
+        Returns:
+            AsyncIterator[bytes]: The chunks of the file.
+        """
+        try:
+            f = await asyncio.to_thread(open, self.local_path(file_id), "rb")
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found in local storage")
+
+        with f:
+            offset, last = byte_range if byte_range is not None else (0, None)
+            while last is None or offset <= last:
+                size = CHUNK_SIZE if last is None else min(CHUNK_SIZE, last - offset + 1)
+                chunk = await asyncio.to_thread(os.pread, f.fileno(), size, offset)
+                if not chunk:
+                    return
+                offset += len(chunk)
+                yield chunk
+
+    async def download(self, file_id: str) -> bytes:
+        """
+        Returns the whole content of a file.
+
+        Args:
+            file_id (str): The ID of the file.
+
+        Returns:
+            bytes: The content of the file.
+        """
+        def read() -> bytes:
+            with open(self.local_path(file_id), "rb") as f:
+                return f.read()
+        try:
+            return await asyncio.to_thread(read)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found in local storage")
+
+    async def list_folder(self, folder_id: str) -> list[dict]:
+        """
+        Lists the files of a folder.
+
+        Args:
+            folder_id (str): The ID of the folder.
+
+        Returns:
+            list[dict]: The files (id, name).
+        """
+        try:
+            names = await asyncio.to_thread(os.listdir, self.local_path(folder_id))
+        except FileNotFoundError:
+            return []
+        # Temporary files of writes in progress are hidden
+        return [{"id": f"{folder_id}/{name}", "name": name} for name in names if not name.startswith(".")]
+
+    async def delete(self, file_id: str):
+        """
+        Deletes a file, or a folder with its files, permanently.
+
+        Args:
+            file_id (str): The ID of the file.
+        """
+        if await self.batch_delete([file_id]):
+            raise HTTPException(status_code=500, detail=f"Could not delete {file_id}")
+
+    async def batch_delete(self, file_ids: list[str]) -> list[str]:
+        """
+        Deletes several files or folders. Files that no longer exist count as deleted.
+
+        Args:
+            file_ids (list[str]): The IDs of the files.
+
+        Returns:
+            list[str]: The IDs of the files that couldn't be deleted.
+        """
+        def remove(file_id: str) -> bool:
+            try:
+                path = self.local_path(file_id)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            except (OSError, HTTPException) as e:
+                print(f"Could not delete {file_id} from local storage: {e}")
+                return False
+            return True
+
+        return [file_id for file_id in file_ids if not await asyncio.to_thread(remove, file_id)]
+
+local_storage = LocalStorage()
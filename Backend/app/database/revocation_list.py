@@ -0,0 +1,102 @@
+import os
+import asyncio
+from contextlib import suppress
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import PyMongoError
+
+# Revocations read again on every poll, for the clocks of the processes to disagree a little
+POLL_OVERLAP = timedelta(seconds=60)
+
+class RevocationList:
+    """
+    Access tokens revoked before they expire, e.g. on logout, by token ID.
+
+    Revocations are stored in the revoked_tokens collection, which drops them
+    once the token expired (TTL index on expires_at), and kept in memory so a
+    request checks them without querying the database. A revocation made by
+    this process applies at once. The ones made by other processes are read
+    every REVOCATION_POLL_SECONDS seconds (5 by default).
+    """
+    def __init__(self):
+        self._collection = None
+        # Expiration of every revoked token by token ID
+        self._revoked: dict[str, datetime] = {}
+        self._last_poll: datetime | None = None
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    async def connect(self, db):
+        """
+        Reads the revocations of the tokens that didn't expire and starts polling for new ones.
+
+        Args:
+            db (AsyncIOMotorDatabase): The application database.
+        """
+        self._collection = db.revoked_tokens
+        await self._poll()
+        interval = float(os.getenv("REVOCATION_POLL_SECONDS", "5"))
+        if interval > 0:
+            self._task = asyncio.create_task(self._run(interval))
+        print(f"Revocation list loaded with {len(self._revoked)} tokens.")
+
+    async def close(self):
+        """
+        Stops polling for new revocations.
+        """
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def revoke(self, token_id: str, expires_at: datetime):
+        """
+        Revokes a token until it expires.
+
+        Args:
+            token_id (str): The ID of the token.
+            expires_at (datetime): When the token expires, the revocation is dropped after it.
+        """
+        now = datetime.now(timezone.utc)
+        self._revoked[token_id] = expires_at
+        await self._collection.update_one({"_id": token_id},
+                                          {"$set": {"expires_at": expires_at, "revoked_at": now}},
+                                          upsert=True)
+
+    def is_revoked(self, token_id: str) -> bool:
+        """
+        Returns whether a token was revoked, without querying the database.
+
+        Args:
+            token_id (str): The ID of the token.
+
+        Returns:
+            bool: True if the token was revoked.
+        """
+        return token_id in self._revoked
+
+    async def _run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._poll()
+            except PyMongoError as e:
+                print(f"Revocation list can't read the revoked tokens: {e}")
+
+    async def _poll(self):
+        now = datetime.now(timezone.utc)
+        query = {"expires_at": {"$gt": now}}
+        if self._last_poll is not None:
+            query["revoked_at"] = {"$gte": self._last_poll - POLL_OVERLAP}
+        async for doc in self._collection.find(query):
+            expires_at = doc["expires_at"]
+            self._revoked[doc["_id"]] = expires_at if expires_at.tzinfo else expires_at.replace(tzinfo=timezone.utc)
+        self._last_poll = now
+
+        # Expired tokens are rejected anyway
+        for token_id in [token_id for token_id, expires_at in self._revoked.items() if expires_at <= now]:
+            del self._revoked[token_id]
+
+revocation_list = RevocationList()
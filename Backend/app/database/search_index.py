@@ -0,0 +1,184 @@
+import bisect
+import heapq
+import unicodedata
+from collections import Counter
+from collections.abc import AsyncIterable
+
+# Matches sharing less than this fraction of the trigrams of the query are dropped
+MIN_SIMILARITY = 0.3
+
+def normalize(text: str) -> str:
+    """
+    Lowercases a text and strips its accents, so "Nicolò" is found typing "nicolo".
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        str: The normalized text.
+    """
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+def trigrams(word: str) -> set[str]:
+    """
+    Returns the trigrams of a word, padded at the start so the first two
+    characters form a trigram too. Words shorter than two characters have none.
+
+    Args:
+        word (str): A normalized word.
+
+    Returns:
+        set[str]: The trigrams of the word.
+    """
+    padded = f" {word}"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class EmployeeSearchIndex:
+    """
+    In-memory index over the first name, last name and fiscal code of every
+    employee, used for typeahead searches without querying the database.
+
+    Words are kept in a sorted vocabulary, so the employees having a word that
+    starts with what was typed are found by bisection, and in trigram postings,
+    so misspelled words still find similar ones. It is built at startup and kept
+    current by the write methods of EmployeesDAL. Every process of the app holds
+    its own copy, so writes made by other processes are only seen after a restart.
+    """
+    def __init__(self):
+        # (first_name, last_name, normalized words) by fiscal code
+        self._entries: dict[str, tuple[str, str, tuple[str, ...]]] = {}
+        # Fiscal codes having each word, and the words in order
+        self._words: dict[str, set[str]] = {}
+        self._vocabulary: list[str] = []
+        # Fiscal codes of the employees having each trigram
+        self._postings: dict[str, set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def build(self, employees: AsyncIterable):
+        """
+        Indexes every employee, replacing the current content once all of them are read.
+
+        Args:
+            employees (AsyncIterable): The employees, such as EmployeesDAL.get_all().
+        """
+        index = EmployeeSearchIndex()
+        async for employee in employees:
+            index.add(employee.first_name, employee.last_name, employee.fiscal_code)
+        self._entries, self._words, self._vocabulary, self._postings = (
+            index._entries, index._words, index._vocabulary, index._postings)
+        print(f"Search index built with {len(self._entries)} employees.")
+
+    def add(self, first_name: str, last_name: str, fiscal_code: str):
+        """
+        Indexes an employee, replacing the entry with the same fiscal code.
+
+        Args:
+            first_name (str): The first name of the employee.
+            last_name (str): The last name of the employee.
+            fiscal_code (str): The fiscal code of the employee.
+        """
+        self.remove(fiscal_code)
+        words = tuple(dict.fromkeys(normalize(f"{first_name} {last_name} {fiscal_code}").split()))
+        self._entries[fiscal_code] = (first_name, last_name, words)
+        for word in words:
+            if word not in self._words:
+                self._words[word] = set()
+                bisect.insort(self._vocabulary, word)
+            self._words[word].add(fiscal_code)
+            for gram in trigrams(word):
+                self._postings.setdefault(gram, set()).add(fiscal_code)
+
+    def remove(self, fiscal_code: str):
+        """
+        Removes an employee from the index, if indexed.
+
+        Args:
+            fiscal_code (str): The fiscal code of the employee.
+        """
+        entry = self._entries.pop(fiscal_code, None)
+        if entry is None:
+            return
+        for word in entry[2]:
+            self._discard(self._words, word, fiscal_code)
+            if word not in self._words:
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+            for gram in trigrams(word):
+                self._discard(self._postings, gram, fiscal_code)
+
+    @staticmethod
+    def _discard(index: dict[str, set[str]], key: str, fiscal_code: str):
+        codes = index.get(key)
+        if codes is not None:
+            codes.discard(fiscal_code)
+            if not codes:
+                del index[key]
+
+    def _has_prefixes(self, fiscal_code: str, prefixes: list[str]) -> bool:
+        words = self._entries[fiscal_code][2]
+        return all(any(word.startswith(prefix) for word in words) for prefix in prefixes)
+
+    def search(self, query: str, limit: int = 10) -> list[dict]:
+        """
+        Returns the employees most similar to a partial name or fiscal code.
+
+        Employees having, for every typed word, a word starting with it come first,
+        with score 1, ordered by the word matching the longest typed word. When
+        they are fewer than the limit, the others are scored by the fraction of
+        the trigrams of the typed words they have, so typos are forgiven. Typed
+        words shorter than three characters must always match as prefixes.
+
+        Args:
+            query (str): What the user typed, e.g. "mar ros" or "RSSMR".
+            limit (int): The maximum number of results.
+
+        Returns:
+            list[dict]: first_name, last_name, fiscal_code and score of the matches, best first.
+        """
+        words = sorted(set(normalize(query).split()), key=len, reverse=True)
+        if not words:
+            return []
+
+        # Prefix matches, in vocabulary order, stopping as soon as there are enough
+        matches = {}
+        longest, others = words[0], words[1:]
+        position = bisect.bisect_left(self._vocabulary, longest)
+        while position < len(self._vocabulary) and len(matches) < limit:
+            word = self._vocabulary[position]
+            if not word.startswith(longest):
+                break
+            for fiscal_code in sorted(self._words[word]):
+                if fiscal_code not in matches and self._has_prefixes(fiscal_code, others):
+                    matches[fiscal_code] = 1.0
+                    if len(matches) == limit:
+                        break
+            position += 1
+
+        fuzzy = [word for word in words if len(word) >= 3]
+        if len(matches) < limit and fuzzy:
+            short = [word for word in words if len(word) < 3]
+            scores: dict[str, float] = {}
+            for word in fuzzy:
+                grams = trigrams(word)
+                shared = Counter()
+                for gram in grams:
+                    shared.update(self._postings.get(gram, ()))
+                for fiscal_code, count in shared.items():
+                    scores[fiscal_code] = scores.get(fiscal_code, 0) + count / len(grams)
+
+            ranked = []
+            for fiscal_code, score in scores.items():
+                score /= len(fuzzy)
+                if score >= MIN_SIMILARITY and fiscal_code not in matches and self._has_prefixes(fiscal_code, short):
+                    ranked.append((-score, fiscal_code))
+            for score, fiscal_code in heapq.nsmallest(limit - len(matches), ranked):
+                matches[fiscal_code] = -score
+
+        return [{"first_name": self._entries[fiscal_code][0],
+                 "last_name": self._entries[fiscal_code][1],
+                 "fiscal_code": fiscal_code,
+                 "score": score} for fiscal_code, score in matches.items()]
+
+employee_search = EmployeeSearchIndex()
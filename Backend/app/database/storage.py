@@ -0,0 +1,59 @@
+import os
+from collections.abc import AsyncIterator
+from typing import Protocol
+from fastapi import UploadFile
+from dotenv import load_dotenv
+from app.database.drive import drive
+from app.database.local_storage import local_storage
+""" from database.drive import drive
+from database.local_storage import local_storage """
+
+#Load environment variables
+load_dotenv()
+
+class Storage(Protocol):
+    """
+    Operations every file storage backend provides. IDs are opaque strings
+    stored in the employee documents.
+    """
+    @property
+    def connected(self) -> bool: ...
+
+    async def connect(self): ...
+
+    async def close(self): ...
+
+    def local_path(self, file_id: str) -> str | None:
+        """Path of the file on this machine, None if the storage is remote."""
+
+    async def create_folder(self, folder_name: str, parent_folder_id: str) -> str: ...
+
+    async def upload(self, file: UploadFile, folder_id: str, resumable: bool | None = None) -> str: ...
+
+    async def update(self, file_id: str, file: UploadFile, resumable: bool | None = None) -> str: ...
+
+    async def get_metadata(self, file_id: str) -> dict: ...
+
+    def stream(self, file_id: str, byte_range: tuple[int, int] | None = None) -> AsyncIterator[bytes]: ...
+
+    async def download(self, file_id: str) -> bytes: ...
+
+    async def list_folder(self, folder_id: str) -> list[dict]: ...
+
+    async def delete(self, file_id: str): ...
+
+    async def batch_delete(self, file_ids: list[str]) -> list[str]: ...
+
+# Backends selectable with the STORAGE_BACKEND Enviroment variable
+STORAGE_BACKENDS = {"drive": drive, "local": local_storage}
+
+def get_configured_storage() -> Storage:
+    """
+    Returns the storage backend selected by STORAGE_BACKEND (drive by default).
+    """
+    backend = os.getenv("STORAGE_BACKEND", "drive").lower()
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND {backend}, expected one of {list(STORAGE_BACKENDS)}")
+    return STORAGE_BACKENDS[backend]
+
+storage: Storage = get_configured_storage()
@@ -8,9 +8,29 @@ load_dotenv()
 
 from app.routers import routes
 from app.database.connection import database
+from app.database.indexes import ensure_indexes
+from app.database.storage import storage
+from app.database.document_cache import document_cache
+from app.database.search_index import employee_search
+from app.database.employee_cache import employee_cache
+from app.database.revocation_list import revocation_list
+from app.dal.employees_dal import EmployeesDAL
+from app.workers.upload_worker import upload_worker
+from app.workers.media import media_pool
+from app.workers.stats_worker import stats_worker
 
 """ from routers import routes
-from database.connection import database """
+from database.connection import database
+from database.indexes import ensure_indexes
+from database.storage import storage
+from database.document_cache import document_cache
+from database.search_index import employee_search
+from database.employee_cache import employee_cache
+from database.revocation_list import revocation_list
+from dal.employees_dal import EmployeesDAL
+from workers.upload_worker import upload_worker
+from workers.media import media_pool
+from workers.stats_worker import stats_worker """
 
 # Application instance which creates the server
 app = FastAPI()
@@ -26,12 +46,30 @@ origins = [
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
-    Context to manage the database connection in the life cycle of the app.
+    Context to manage the database and file storage connections, the search index,
+    the employee cache, the revoked tokens, the media pool and the upload and stats
+    workers, in the life cycle of the app.
     """
     await database.connect()
+    await ensure_indexes(database.db)
+    await employee_search.build(EmployeesDAL(database.db).get_all())
+    await employee_cache.connect(database.db)
+    await revocation_list.connect(database.db)
+    await storage.connect()
+    await document_cache.connect()
+    await media_pool.start()
+    await upload_worker.start()
+    await stats_worker.start()
 
     yield
 
+    await stats_worker.stop()
+    await upload_worker.stop()
+    await media_pool.stop()
+    await document_cache.close()
+    await storage.close()
+    await employee_cache.close()
+    await revocation_list.close()
     await database.close()
 #Lifespan of application
 app = FastAPI(lifespan=lifespan)
@@ -0,0 +1,13 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Optional
+
+class ComplianceStats(BaseModel):
+    active_employees: int = 0
+    expired_id_cards: int = 0
+    visas_expiring_this_month: int = 0
+    # Purchase orders assigned to an employee without any access permission
+    purchase_orders_without_permits: int = 0
+    # Access permissions by plant and status
+    permits: dict[str, dict[str, int]] = Field(default_factory=dict)
+    recomputed_at: Optional[datetime] = None
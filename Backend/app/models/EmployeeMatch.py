@@ -0,0 +1,8 @@
+from pydantic import BaseModel
+
+class EmployeeMatch(BaseModel):
+    first_name: str
+    last_name: str
+    fiscal_code: str
+    # Fraction of the typed trigrams the employee has, 1 is a full match
+    score: float
@@ -0,0 +1,9 @@
+from pydantic import BaseModel
+from typing import Optional
+from app.models.FilteredEmployee import FilteredEmployee
+#from models.FilteredEmployee import FilteredEmployee
+
+class EmployeePage(BaseModel):
+    items: list[FilteredEmployee]
+    # Opaque token to request the following page, None on the last page
+    next_cursor: Optional[str] = None
@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+from app.models.FilteredEmployee import FilteredEmployee
+#from models.FilteredEmployee import FilteredEmployee
+
+class EmployeeQueryResult(BaseModel):
+    items: list[FilteredEmployee]
+    # Employees matching the filters, in every page
+    total: int
+    page: int
+    page_size: int
@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+
+class NextExpiry(BaseModel):
+    date: datetime
+    # id_card, visa, contract, purchase_order or access_permission
+    item: str
+    po_number: Optional[str] = None
+    protocol_number: Optional[str] = None
+
+class ExpiringEmployee(BaseModel):
+    first_name: str
+    last_name: str
+    fiscal_code: str
+    next_expiry: NextExpiry
+
+class ExpiringEmployeePage(BaseModel):
+    items: list[ExpiringEmployee]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,11 @@
+from pydantic import BaseModel
+
+class TokenClaims(BaseModel):
+    # User name, user type and fiscal code of the user the token was issued to
+    us: str
+    ut: str | None = None
+    fs: str | None = None
+    # The jti claim, or a digest of the token for tokens issued without one
+    token_id: str
+    # Expiration as a Unix timestamp
+    exp: int
@@ -1,6 +1,10 @@
 from typing import Annotated
 import jwt
 import os
+import time
+import uuid
+import hashlib
+from cachetools import TLRUCache
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.security import OAuth2PasswordRequestForm
@@ -8,13 +12,27 @@ from jwt.exceptions import InvalidTokenError
 from datetime import datetime, timedelta, timezone
 from app.dal.employees_dal import EmployeesDAL
 from app.database.dependencies import get_employees_dal
+from app.database.revocation_list import revocation_list
+from app.models.TokenClaims import TokenClaims
 
 """ from dal.employees_dal import EmployeesDAL
-from database.dependencies import get_employees_dal """
+from database.dependencies import get_employees_dal
+from database.revocation_list import revocation_list
+from models.TokenClaims import TokenClaims """
 
 #Create OAuth2PasswordBearer scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
+#Signing key and algorithm of the access tokens, read once when the app starts
+SECRET_KEY = os.getenv("SECRET_KEY")
+ALGORITHM = os.getenv("ALGORITHM")
+
+#Claims of the tokens already verified, by token, until the token expires. The
+#whole token is the key, so a forged token can't reuse the ID of a verified one.
+verified_tokens = TLRUCache(maxsize=int(os.getenv("VERIFIED_TOKENS_CACHE_SIZE", "10000")),
+                            ttu=lambda token, claims, now: claims.exp,
+                            timer=time.time)
+
 """
 Login & Authentication
 
@@ -36,36 +54,55 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=60)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, os.getenv("SECRET_KEY"), algorithm=os.getenv("ALGORITHM"))
+    # The token ID lets a single token be revoked
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token:Annotated[str,Depends(oauth2_scheme)],
-                         usr_dal: EmployeesDAL = Depends(get_employees_dal)):
+async def get_token_claims(token:Annotated[str,Depends(oauth2_scheme)]) -> TokenClaims:
     """
-    Retrieves the current user from the access token.
+    Verifies the access token and returns its claims, for the handlers that
+    only need the user name, type and fiscal code of the user. Nothing is read
+    from the database: the signature of a token is verified the first time it
+    is seen, and it is then only checked against the revoked tokens.
 
     Args:
         token (Annotated[str, Depends(oauth2_scheme)]): The access token.
-        usr_dal (EmployeesDAL): The employees DAL.
 
     Returns:
-        Person: The current user.
+        TokenClaims: The claims of the token.
     """
     credentials_exeception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                                detail="Could not valdidate credentials",
                                                headers={"WWW-Authenticate":"Bearer"})
-    try:
-        payload = jwt.decode(token,os.getenv("SECRET_KEY"),algorithms=[os.getenv("ALGORITHM")])
-        #print(f"Payload: {payload}")
-        user_name: str = payload.get('us')
-        user_type: str = payload.get('ut')
-        #print(f"User Name from validate_token: {user_name}")
-        #print(f"User Type from validate_token: {user_type}")
-        if user_name is None:
+    claims = verified_tokens.get(token)
+    if claims is None:
+        try:
+            payload = jwt.decode(token,SECRET_KEY,algorithms=[ALGORITHM])
+        except InvalidTokenError:
+            raise credentials_exeception
+        if payload.get('us') is None or not isinstance(payload.get('exp'), int):
             raise credentials_exeception
-        user = await usr_dal.find_user_name(user_name)
-        #print(f"User From Valid Token {user}")
-    except InvalidTokenError:
+        # Tokens issued before they had an ID are identified by their digest
+        token_id = payload.get('jti') or hashlib.sha256(token.encode()).hexdigest()
+        claims = TokenClaims(us=payload['us'], ut=payload.get('ut'), fs=payload.get('fs'),
+                             token_id=token_id, exp=payload['exp'])
+        verified_tokens[token] = claims
+
+    if revocation_list.is_revoked(claims.token_id):
         raise credentials_exeception
-    return user
\ No newline at end of file
+    return claims
+
+async def get_current_user(claims:Annotated[TokenClaims,Depends(get_token_claims)],
+                         usr_dal: EmployeesDAL = Depends(get_employees_dal)):
+    """
+    Retrieves the current user from the access token.
+
+    Args:
+        claims (Annotated[TokenClaims, Depends(get_token_claims)]): The claims of the access token.
+        usr_dal (EmployeesDAL): The employees DAL.
+
+    Returns:
+        Person: The current user.
+    """
+    return await usr_dal.find_user_name(claims.us)
\ No newline at end of file
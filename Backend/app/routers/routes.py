@@ -1,38 +1,69 @@
 import json
 import os
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile,status, Response
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
+import asyncio
+import shutil
+import uuid
+import mimetypes
+import time
+from fastapi import APIRouter, BackgroundTasks, Depends, File, Form, HTTPException, UploadFile,status, Response, Request, Query
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import EmailStr
-import tempfile
 
 
 from app.models.Person import Person
 from app.models.Token import Token
+from app.models.TokenClaims import TokenClaims
 from app.models.FilteredEmployee import FilteredEmployee
+from app.models.EmployeePage import EmployeePage
+from app.models.EmployeeQueryResult import EmployeeQueryResult
+from app.models.EmployeeMatch import EmployeeMatch
+from app.models.ExpiringEmployee import ExpiringEmployeePage
+from app.models.ComplianceStats import ComplianceStats
 from app.models.PurchaseOrder import PurchaseOrder
 from app.models.AccessPermission import AccessPermission
-from app.dal.employees_dal import EmployeesDAL
-from app.database.dependencies import get_employees_dal
+from app.dal.employees_dal import EmployeesDAL, start_of_today
+from app.dal.upload_jobs_dal import UploadJobsDAL
+from app.database.dependencies import get_employees_dal, get_storage, get_upload_jobs_dal
+from app.database.storage import Storage
+from app.database.document_cache import document_cache
+from app.database.employee_cache import employee_cache
+from app.database.search_index import employee_search
 from app.routers.auth import create_access_token
-from app.routers.utils import format_path,save_and_rename_files,create_folder,upload_file_to_drive, download_file_drive,replace_file_in_folder,get_file
-from app.routers.auth import get_current_user 
+from app.routers.utils import format_path,save_and_rename_files,spool_file,OUTBOX_DIR,parse_range_header,SendfileResponse,replace_document,get_profile_image,document_version,etag_matches,profile_image_cache,stream_profile_images,delete_employee_folder,sha256_file,stream_documents_zip,encode_cursor,decode_cursor,wants_ndjson,stream_json
+from app.routers.auth import get_current_user, get_token_claims
+from app.database.revocation_list import revocation_list
+from app.workers.upload_worker import upload_worker
+from app.workers.media import media_pool, thumbnail_name, pick_thumbnail_size, image_media_type
 
 
 """ from models.Person import Person
 from models.Token import Token
+from models.TokenClaims import TokenClaims
 from models.FilteredEmployee import FilteredEmployee
+from models.EmployeePage import EmployeePage
+from models.EmployeeQueryResult import EmployeeQueryResult
+from models.EmployeeMatch import EmployeeMatch
+from models.ExpiringEmployee import ExpiringEmployeePage
+from models.ComplianceStats import ComplianceStats
 from models.PurchaseOrder import PurchaseOrder
 from models.AccessPermission import AccessPermission
-from dal.employees_dal import EmployeesDAL
-from database.dependencies import get_employees_dal
+from dal.employees_dal import EmployeesDAL, start_of_today
+from dal.upload_jobs_dal import UploadJobsDAL
+from database.dependencies import get_employees_dal, get_storage, get_upload_jobs_dal
+from database.storage import Storage
+from database.document_cache import document_cache
+from database.employee_cache import employee_cache
+from database.search_index import employee_search
 from routers.auth import create_access_token
-from routers.utils import format_path,save_and_rename_files,create_folder,upload_file_to_drive, download_file_drive,replace_file_in_folder,get_file
-from routers.auth import get_current_user """
-
-from typing import Annotated, Any, Dict, Optional
-from datetime import datetime,timedelta
+from routers.utils import format_path,save_and_rename_files,spool_file,OUTBOX_DIR,parse_range_header,SendfileResponse,replace_document,get_profile_image,document_version,etag_matches,profile_image_cache,stream_profile_images,delete_employee_folder,sha256_file,stream_documents_zip,encode_cursor,decode_cursor,wants_ndjson,stream_json
+from routers.auth import get_current_user, get_token_claims
+from database.revocation_list import revocation_list
+from workers.upload_worker import upload_worker
+from workers.media import media_pool, thumbnail_name, pick_thumbnail_size, image_media_type """
+
+from typing import Annotated, Any, Dict, Literal, Optional
+from datetime import datetime,timedelta,timezone
 from dotenv import load_dotenv
 
 #Load environment variables
@@ -41,8 +72,20 @@ load_dotenv()
 #Create API Router
 router = APIRouter()
 
-#Mount Static Files for File Storage
-router.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+#Maximum number of profile images returned by a bulk request
+MAX_BULK_PROFILE_IMAGES = 500
+
+#Maximum number of employees exported in a single ZIP archive
+MAX_BULK_EXPORT = 1000
+
+#Maximum number of employees in a page of /all
+MAX_PAGE_SIZE = 200
+
+#Maximum number of results of a typeahead search
+MAX_SEARCH_RESULTS = 50
+
+#Maximum number of days looked ahead by /expiring
+MAX_EXPIRY_WINDOW_DAYS = 366
 
 """
 Application ENDPOINTS
@@ -89,79 +132,316 @@ async def my_info(current_user: Annotated[Person, Depends(get_current_user)]):
     return current_user
 
 @router.get("/all") 
-async def get_all_employees(employees_dal: EmployeesDAL = Depends(get_employees_dal)) -> list[FilteredEmployee]:
+async def get_all_employees(request: Request,
+                            limit: Optional[int] = Query(None, gt=0),
+                            cursor: Optional[str] = None,
+                            employees_dal: EmployeesDAL = Depends(get_employees_dal)) -> list[FilteredEmployee] | EmployeePage:
     """
-    Retrieves all employees.
+    Retrieves all employees, sorted by first name. The listing is streamed as
+    the documents arrive from the database, as a JSON array or as NDJSON when
+    the Accept header asks for application/x-ndjson. When a limit or a cursor
+    is given, a single page is returned instead, with a cursor for the next one.
 
     Args:
+        request (Request): The request, used to read the Accept header.
+        limit (Optional[int]): The size of the page, at most MAX_PAGE_SIZE.
+        cursor (Optional[str]): The next_cursor of the previous page.
         employees_dal (EmployeesDAL): The employees DAL.
 
     Returns:
-        list[FilteredEmployee]: Deserialized employee data.
+        list[FilteredEmployee] | EmployeePage: Deserialized employee data.
     
     """
-    return [employee async for employee in  employees_dal.get_all()]
+    if limit is None and cursor is None:
+        ndjson = wants_ndjson(request.headers.get("accept"))
+        return StreamingResponse(stream_json(employees_dal.get_all(), ndjson),
+                                 media_type="application/x-ndjson" if ndjson else "application/json")
+
+    after = decode_cursor(cursor) if cursor else None
+    employees, next_key = await employees_dal.get_page(min(limit or MAX_PAGE_SIZE, MAX_PAGE_SIZE), after)
+
+    return EmployeePage(items=employees, next_cursor=encode_cursor(next_key) if next_key else None)
+
+@router.get("/employees")
+async def query_employees(contract_type: Optional[str] = None,
+                          valid_from: Optional[datetime] = None,
+                          valid_to: Optional[datetime] = None,
+                          po_number: Optional[str] = None,
+                          plant: Optional[str] = None,
+                          permission_status: Optional[str] = None,
+                          sort: Literal["first_name", "last_name", "fiscal_code",
+                                        "contract_validity_start_date", "contract_validity_end_date"] = "first_name",
+                          order: Literal["asc", "desc"] = "asc",
+                          page: int = Query(1, gt=0),
+                          page_size: int = Query(50, gt=0, le=MAX_PAGE_SIZE),
+                          employees_dal: EmployeesDAL = Depends(get_employees_dal)) -> EmployeeQueryResult:
+    """
+    Retrieves a page of the employees matching the given filters, with the number
+    of matching employees. Filtering, sorting and paging run in the database, so
+    only the employees of the page are sent.
 
-@router.get("/retrieve_files/{fiscal_code}/")
-async def retrieve_files(fiscal_code: str,employees_dal: EmployeesDAL = Depends(get_employees_dal)) -> FileResponse:
+    Args:
+        contract_type (Optional[str]): The contract type.
+        valid_from (Optional[datetime]): The contract must be valid at some point after this date.
+        valid_to (Optional[datetime]): The contract must be valid at some point before this date.
+        po_number (Optional[str]): The number of a purchase order of the employee.
+        plant (Optional[str]): The plant of an access permission.
+        permission_status (Optional[str]): The status of an access permission, on the same plant if given.
+        sort (str): The field to sort by.
+        order (str): asc or desc.
+        page (int): The page, starting from 1.
+        page_size (int): The size of the page, at most MAX_PAGE_SIZE.
+        employees_dal (EmployeesDAL): The employees DAL.
+
+    Returns:
+        EmployeeQueryResult: The employees of the page and the total count.
     """
-    Retrieves the files of an employee.
+    if valid_from and valid_to and valid_from > valid_to:
+        raise HTTPException(status_code=400, detail="valid_from must not be after valid_to")
+
+    query = employees_dal.employee_filter(contract_type, valid_from, valid_to, po_number, plant, permission_status)
+    employees, total = await employees_dal.query_employees(query, sort, order == "desc",
+                                                           skip=(page - 1) * page_size, limit=page_size)
+
+    return EmployeeQueryResult(items=employees, total=total, page=page, page_size=page_size)
+
+@router.get("/expiring")
+async def get_expiring_employees(days: int = Query(30, gt=0, le=MAX_EXPIRY_WINDOW_DAYS),
+                                 limit: int = Query(50, gt=0, le=MAX_PAGE_SIZE),
+                                 cursor: Optional[str] = None,
+                                 employees_dal: EmployeesDAL = Depends(get_employees_dal)) -> ExpiringEmployeePage:
+    """
+    Retrieves the employees with an ID card, visa, contract, purchase order or
+    access permission expiring in the next days, soonest first. Only the first
+    expiry of every employee is returned, the page has a cursor for the next one.
 
     Args:
-        fiscal_code (str): The fiscal code of the employee.
+        days (int): The size of the window from today, at most MAX_EXPIRY_WINDOW_DAYS.
+        limit (int): The size of the page, at most MAX_PAGE_SIZE.
+        cursor (Optional[str]): The next_cursor of the previous page.
         employees_dal (EmployeesDAL): The employees DAL.
 
     Returns:
-        FileResponse: The file response of the file.
+        ExpiringEmployeePage: The employees and their next expiry.
+    """
+    after = None
+    if cursor:
+        date, _id = decode_cursor(cursor)
+        try:
+            after = (datetime.fromisoformat(date), _id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    until = start_of_today() + timedelta(days=days)
+    employees, next_key = await employees_dal.get_expiring(until, limit, after)
+
+    return ExpiringEmployeePage(items=employees,
+                                next_cursor=encode_cursor((next_key[0].isoformat(), next_key[1])) if next_key else None)
+
+@router.get("/stats")
+async def get_stats(employees_dal: EmployeesDAL = Depends(get_employees_dal)) -> ComplianceStats:
+    """
+    Retrieves the compliance counters of the admin dashboard. They are kept up to
+    date by the writes and recomputed every night, so no employee is read.
+
+    Args:
+        employees_dal (EmployeesDAL): The employees DAL.
 
+    Returns:
+        ComplianceStats: Active employees, expired ID cards, visas expiring this
+        month, purchase orders without permits and permits by plant and status.
+    """
+    return await employees_dal.get_stats()
+
+@router.get("/search")
+async def search_employees(response: Response,
+                           q: str = Query(..., min_length=1, max_length=100),
+                           limit: int = Query(10, gt=0, le=MAX_SEARCH_RESULTS)) -> list[EmployeeMatch]:
     """
-    profile_image_id,_ = await employees_dal.get_file_id(fiscal_code, "profile_image")
+    Typeahead search of employees by partial first name, last name or fiscal code,
+    ranked by similarity. It is served by the in-memory search index, the database
+    is not queried, so it can run on every keystroke. The time spent searching is
+    sent in the Server-Timing header.
 
-    file = await get_file(profile_image_id)
+    Args:
+        response (Response): The response, used to set the Server-Timing header.
+        q (str): What the user typed.
+        limit (int): The maximum number of results, at most MAX_SEARCH_RESULTS.
 
-    return Response(content=file, media_type="image/png", headers={
-        "Content-Disposition": "inline; filename=profile_image.png"
+    Returns:
+        list[EmployeeMatch]: The matching employees, best first.
+    """
+    start = time.perf_counter()
+    matches = employee_search.search(q, limit)
+    response.headers["Server-Timing"] = f"search;dur={(time.perf_counter() - start) * 1000:.3f}"
+
+    return matches
+
+@router.get("/retrieve_files/{fiscal_code}/")
+async def retrieve_files(fiscal_code: str, request: Request,
+                         size: Optional[int] = Query(None, gt=0),
+                         employees_dal: EmployeesDAL = Depends(get_employees_dal),
+                         storage: Storage = Depends(get_storage)) -> Response:
+    """
+    Retrieves the profile image of an employee. Images are cached in memory and
+    conditional requests with a matching ETag get a 304 Not Modified.
+
+    Args:
+        fiscal_code (str): The fiscal code of the employee.
+        request (Request): The request, used to read the If-None-Match header.
+        size (Optional[int]): Side in pixels of the thumbnail to serve instead of the full image.
+        employees_dal (EmployeesDAL): The employees DAL.
+        storage (Storage): The configured file storage.
+
+    Returns:
+        Response: The profile image.
+
+    """
+    profile_image_id = None
+    if size:
+        profile_image_id,_ = await employees_dal.get_file_id(fiscal_code, thumbnail_name("profile_image", pick_thumbnail_size(size)))
+    # Employees registered before thumbnails existed only have the full image
+    if not profile_image_id:
+        profile_image_id,_ = await employees_dal.get_file_id(fiscal_code, "profile_image")
+    if not profile_image_id:
+        raise HTTPException(status_code=404, detail="Profile image not available yet")
+
+    file, etag = await get_profile_image(storage, profile_image_id)
+
+    # Browsers keep the image but revalidate it on every use
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    media_type = image_media_type(file)
+    return Response(content=file, media_type=media_type, headers={
+        **headers,
+        "Content-Disposition": f"inline; filename=profile_image{mimetypes.guess_extension(media_type)}"
     })
 
+@router.post("/retrieve_files/")
+async def retrieve_files_bulk(fiscal_codes: list[str],
+                              size: Optional[int] = Query(None, gt=0),
+                              employees_dal: EmployeesDAL = Depends(get_employees_dal),
+                              storage: Storage = Depends(get_storage)) -> StreamingResponse:
+    """
+    Retrieves the profile images of several employees in a single response.
+    The body is multipart/form-data with one part per employee, named after its
+    fiscal code, so browsers can read it with Response.formData().
+
+    Args:
+        fiscal_codes (list[str]): The fiscal codes of the employees.
+        size (Optional[int]): Side in pixels of the thumbnails to serve instead of the full images.
+        employees_dal (EmployeesDAL): The employees DAL.
+        storage (Storage): The configured file storage.
 
+    Returns:
+        StreamingResponse: The profile images found.
+    """
+    if len(fiscal_codes) > MAX_BULK_PROFILE_IMAGES:
+        raise HTTPException(status_code=400,
+                            detail=f"At most {MAX_BULK_PROFILE_IMAGES} profile images can be requested at once")
 
+    file_ids = {}
+    if size:
+        file_ids = await employees_dal.get_file_ids(fiscal_codes, thumbnail_name("profile_image", pick_thumbnail_size(size)))
+    missing = [fiscal_code for fiscal_code in fiscal_codes if fiscal_code not in file_ids]
+    if missing:
+        file_ids.update(await employees_dal.get_file_ids(missing, "profile_image"))
 
+    boundary = uuid.uuid4().hex
+    return StreamingResponse(stream_profile_images(storage, file_ids, boundary),
+                             media_type=f"multipart/form-data; boundary={boundary}")
 
 @router.get("/download/{fiscalCode}/{name}")
-async def download_file(fiscalCode: str, name: str,employees_dal: EmployeesDAL = Depends(get_employees_dal)) -> FileResponse:
+async def download_file(fiscalCode: str, name: str, request: Request,
+                        employees_dal: EmployeesDAL = Depends(get_employees_dal),
+                        storage: Storage = Depends(get_storage)) -> Response:
     """
-    Downloads a file.
+    Downloads a file, streaming it from Google Drive as it arrives, or with
+    sendfile when the storage is local. Supports Range and If-Range requests so
+    viewers can seek.
 
     Args:
         fiscalCode (str): The fiscal code of the employee.
         name (str): The name of the file.
+        request (Request): The request, used to read the Range headers.
+        storage (Storage): The configured file storage.
 
     Returns:
-        FileResponse: The file response of the file.
+        Response: The streamed content of the file.
     
     """
     file_id,_ = await employees_dal.get_file_id(fiscalCode, name)
     if not file_id:
         return {"error": "No se encontró el ID del archivo."}
 
-    # Crear archivo temporal en el servidor
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{name}") as tmp_file:
-        file_path = tmp_file.name
+    metadata = await storage.get_metadata(file_id)
+    size = int(metadata["size"])
+    version = document_version(metadata)
+    etag = f'"{version}"'
+    last_modified = datetime.fromisoformat(metadata["modifiedTime"]).strftime("%a, %d %b %Y %H:%M:%S GMT")
+    media_type = metadata.get("mimeType", "application/octet-stream")
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Content-Disposition": f"attachment; filename={name}"
+    }
+
+    # A Range only applies if the client's copy is still the current one
+    if_range = request.headers.get("if-range")
+    byte_range = None
+    if if_range is None or if_range in (etag, last_modified):
+        byte_range = parse_range_header(request.headers.get("range"), size)
+
+    status_code = 200
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+    else:
+        first, last = byte_range
+        headers["Content-Length"] = str(last - first + 1)
+        headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+        status_code = 206
+
+    # Files on this machine go from the page cache to the socket without passing through Python
+    path = storage.local_path(file_id)
+    if path:
+        return SendfileResponse(path, byte_range or (0, size - 1), status_code=status_code,
+                                headers=headers, media_type=media_type)
+
+    # Remote documents are kept in the disk cache after the first download
+    cached = await document_cache.open(file_id, version)
+    if cached:
+        return SendfileResponse(cached, byte_range or (0, size - 1), status_code=status_code,
+                                headers=headers, media_type=media_type)
+
+    return StreamingResponse(document_cache.stream(storage, file_id, version, size, byte_range),
+                             status_code=status_code, headers=headers, media_type=media_type)
+
+@router.get("/download_zip/{fiscal_code}")
+async def download_zip(fiscal_code: str,
+                       employees_dal: EmployeesDAL = Depends(get_employees_dal),
+                       storage: Storage = Depends(get_storage)) -> StreamingResponse:
+    """
+    Downloads every document of an employee as a ZIP archive built on the fly.
 
-    # Descargar el archivo desde Google Drive
-    downloaded_file = await download_file_drive(real_file_id=file_id, file_path=file_path)
-    
-    if not downloaded_file or not os.path.exists(downloaded_file):
-        os.remove(file_path)
-        return {"error": "Error al descargar el archivo."}
-
-    # Retornar el archivo para descargar
-    return FileResponse(
-        path=downloaded_file,
-        filename=name,
-        media_type="application/octet-stream",
-        headers={"Content-Disposition": f"attachment; filename={name}"}
-    )
+    Args:
+        fiscal_code (str): The fiscal code of the employee.
+        employees_dal (EmployeesDAL): The employees DAL.
+        storage (Storage): The configured file storage.
+
+    Returns:
+        StreamingResponse: The ZIP archive.
+    """
+    documents = await employees_dal.get_documents([fiscal_code])
+    if not documents:
+        raise HTTPException(status_code=404, detail=f"Employee with {fiscal_code} not found")
+
+    return StreamingResponse(stream_documents_zip(storage, documents), media_type="application/zip",
+                             headers={"Content-Disposition": f"attachment; filename={fiscal_code}.zip"})
 
 """
 POST Methods
@@ -200,9 +480,23 @@ async def login_for_access_token(response: Response,form_data: Annotated[OAuth2P
                  us=user["user_credentials"]["user_name"],
                  fs=user["fiscal_code"],
                  ut=user["user_credentials"]["user_type"])
+
+@router.post("/logout")
+async def logout(claims: Annotated[TokenClaims, Depends(get_token_claims)]) -> dict:
+    """
+    Revokes the access token of the request, it is rejected from now on.
+
+    Args:
+        claims (Annotated[TokenClaims, Depends(get_token_claims)]): The claims of the access token.
+
+    Returns:
+        dict: A message indicating the success of the operation.
+    """
+    await revocation_list.revoke(claims.token_id, datetime.fromtimestamp(claims.exp, timezone.utc))
+    return {"message": "Logged out"}
                                              
 
-@router.post("/create")
+@router.post("/create", status_code=status.HTTP_202_ACCEPTED)
 async def create_employee(
     first_name: str = Form(...),
     last_name: str = Form(...),
@@ -222,10 +516,12 @@ async def create_employee(
     id_card: UploadFile = File(...),
     visa: Optional[UploadFile] = File(None),
     unilav: UploadFile = File(...),
-    employees_dal: EmployeesDAL = Depends(get_employees_dal)
+    employees_dal: EmployeesDAL = Depends(get_employees_dal),
+    upload_jobs_dal: UploadJobsDAL = Depends(get_upload_jobs_dal)
 ):      
     """
-    Creates a new employee.
+    Creates a new employee. The documents are stored locally and queued in the
+    upload outbox, the upload worker sends them to Google Drive afterwards.
 
     Args:
         first_name (str): The first name of the employee.
@@ -247,13 +543,12 @@ async def create_employee(
         visa (UploadFile): The visa of the employee.
         unilav (UploadFile): The unilav of the employee.
         employees_dal (EmployeesDAL): The employees DAL.
+        upload_jobs_dal (UploadJobsDAL): The upload outbox DAL.
 
     Returns:  
-        dict: A dictionary containing a message indicating the success or failure of the operation.
+        dict: A message and the ID of the upload job, to be followed at /upload_status/{job_id}.
     """
 
-    fiscal_code_dir_id = await create_folder(folder_name=fiscal_code, parent_folder_id=os.getenv("PARENT_FOLDER_ID"))
-
     files_to_save = [profile_image, id_card, unilav]
     file_names = ["profile_image", "id_card", "unilav"]
 
@@ -264,37 +559,135 @@ async def create_employee(
     files_to_save = await save_and_rename_files(files_to_save, file_names)
     #print(f"Files to save: {files_to_save}")
 
-    uploaded_file_ids = []
-    for file in files_to_save:
-        file_id = await upload_file_to_drive(file, folder_id=fiscal_code_dir_id)
-        uploaded_file_ids.append(file_id)
-    
-    #First Process images, save them and return the path
-    employee = await employees_dal.create_employee(
-            first_name= first_name,
-            last_name= last_name,
-            fiscal_code= fiscal_code,
-            birth_date= birth_date,
-            id_card_end_date=id_card_end_date,
-            contract_type=contract_type,
-            contract_validity_start_date= contract_validity_start_date,
-            contract_validity_end_date=contract_validity_end_date,
-            visa_start_date=visa_start_date,
-            visa_end_date=visa_end_date,
-            password = password,
-            email = email,
-            user_name= user_name,
-            purchase_order= purchase_order,
-            parent_folder_id = fiscal_code_dir_id,
-            profile_image_path= uploaded_file_ids[0],
-            id_card_path= uploaded_file_ids[1],
-            unilav_path= uploaded_file_ids[2],
-            visa_path= uploaded_file_ids[3] if len(uploaded_file_ids) > 3 else None
-            ) 
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(OUTBOX_DIR, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    file_paths = [os.path.join(job_dir, name) for name in file_names]
+
+    # bcrypt runs in a worker thread while the files are written to disk
+    hashed_password = asyncio.create_task(employees_dal.hash_password(password))
+    employee = None
+
+    try:
+        # The hashes are stored so later updates with the same content can skip the upload
+        file_hashes = await asyncio.gather(*(spool_file(file, path) for file, path in zip(files_to_save, file_paths)))
+
+        # Images are re-encoded and get their thumbnails in the media pool
+        documents = await asyncio.gather(*(
+            media_pool.ingest(path, name, file.filename, file.content_type or "application/octet-stream")
+            for name, file, path in zip(file_names, files_to_save, file_paths)
+        ))
+
+        #Documents are linked by the upload worker once they are in Google Drive
+        employee = await employees_dal.create_employee(
+                first_name= first_name,
+                last_name= last_name,
+                fiscal_code= fiscal_code,
+                birth_date= birth_date,
+                id_card_end_date=id_card_end_date,
+                contract_type=contract_type,
+                contract_validity_start_date= contract_validity_start_date,
+                contract_validity_end_date=contract_validity_end_date,
+                visa_start_date=visa_start_date,
+                visa_end_date=visa_end_date,
+                password = password,
+                hashed_password = await hashed_password,
+                email = email,
+                user_name= user_name,
+                purchase_order= purchase_order,
+                parent_folder_id = None,
+                profile_image_path= None,
+                id_card_path= None,
+                unilav_path= None,
+                visa_path= None,
+                document_hashes= dict(zip(file_names, file_hashes))
+                ) 
+
+        await upload_jobs_dal.create_job(job_id, fiscal_code,
+                                         [file for variants in documents for file in variants])
+    except Exception:
+        hashed_password.cancel()
+        shutil.rmtree(job_dir, ignore_errors=True)
+        if employee is not None:
+            await employees_dal.delete_employee(fiscal_code)
+        raise
+
+    upload_worker.notify()
                 
-    return {"message" : f"Employee {first_name} {last_name} created successfully"}
+    return {"message" : f"Employee {first_name} {last_name} created successfully",
+            "job_id": job_id}
+
+@router.get("/upload_status/{job_id}")
+async def upload_status(job_id: str,
+                        upload_jobs_dal: UploadJobsDAL = Depends(get_upload_jobs_dal)):
+    """
+    Reports the progress of the Google Drive uploads of a new employee.
+
+    Args:
+        job_id (str): The ID of the upload job returned by /create.
+        upload_jobs_dal (UploadJobsDAL): The upload outbox DAL.
+
+    Returns:
+        dict: The status of the job (pending, running, done, failed or cancelled) and of every file.
+    """
+    job = await upload_jobs_dal.get_job(job_id)
+
+    return {
+        "job_id": job["_id"],
+        "fiscal_code": job["fiscal_code"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "last_error": job["last_error"],
+        "files": [{"name": file["name"], "status": file["status"], "error": file["error"]}
+                  for file in job["files"]]
+    }
+
+@router.get("/document_cache/stats")
+async def document_cache_stats() -> dict:
+    """
+    Reports the hit, miss and byte counters of the disk cache of documents.
+
+    Returns:
+        dict: The counters and the current usage of the cache.
+    """
+    return document_cache.stats()
+
+@router.get("/employee_cache/stats")
+async def employee_cache_stats() -> dict:
+    """
+    Reports the hit ratio and staleness of the read cache of employees.
+
+    Returns:
+        dict: The counters, the age of the served entries and the current usage of the cache.
+    """
+    return employee_cache.stats()
         
 
+@router.post("/download_zip/")
+async def download_zip_bulk(fiscal_codes: list[str],
+                            employees_dal: EmployeesDAL = Depends(get_employees_dal),
+                            storage: Storage = Depends(get_storage)) -> StreamingResponse:
+    """
+    Downloads the documents of several employees as a single ZIP archive built
+    on the fly, with one folder per fiscal code.
+
+    Args:
+        fiscal_codes (list[str]): The fiscal codes of the employees.
+        employees_dal (EmployeesDAL): The employees DAL.
+        storage (Storage): The configured file storage.
+
+    Returns:
+        StreamingResponse: The ZIP archive.
+    """
+    if len(fiscal_codes) > MAX_BULK_EXPORT:
+        raise HTTPException(status_code=400,
+                            detail=f"At most {MAX_BULK_EXPORT} employees can be exported at once")
+
+    documents = await employees_dal.get_documents(fiscal_codes)
+
+    return StreamingResponse(stream_documents_zip(storage, documents), media_type="application/zip",
+                             headers={"Content-Disposition": "attachment; filename=documents.zip"})
+
 """
 PATCH Methods
 """     
@@ -429,6 +822,7 @@ async def update_employee(
     visa: Optional[UploadFile] = File(None),
     unilav: Optional[UploadFile] = File(None),
     employees_dal: EmployeesDAL = Depends(get_employees_dal),
+    storage: Storage = Depends(get_storage),
 ):
     """
     Updates an employee.
@@ -450,9 +844,11 @@ async def update_employee(
         visa (Optional[UploadFile]): The visa of the employee.
         unilav (Optional[UploadFile]): The unilav of the employee.
         employees_dal (EmployeesDAL): The employees DAL.
+        storage (Storage): The configured file storage.
 
     Returns:
-        dict: A dictionary containing a message indicating the success or failure of the operation.
+        dict: A message indicating the success or failure of the operation and, for every
+        document sent, whether it was "uploaded" or "unchanged" (same content as the stored one).
     """
     try:
         
@@ -479,42 +875,43 @@ async def update_employee(
                     status_code=400, detail="Invalid format for user_credentials"
                 )
 
-        if profile_image:
+        # Documents are replaced in place, Mongo only changes if Drive had to create a new file
+        parent_folder_id = existing_employee["parent_folder_id"]
+        if not parent_folder_id and any([profile_image, id_card, visa, unilav]):
+            raise HTTPException(status_code=409, detail="The documents of this employee are still being uploaded")
 
-            _,parent_folder_id = await employees_dal.get_file_id(fiscal_code, "profile_image")
-            
-            updated_file_id = await replace_file_in_folder(parent_folder_id, "profile_image.png", profile_image)
-           
-            update_data["profile_image_path"] = updated_file_id
-        
-        if id_card:
-
-            _,parent_folder_id = await employees_dal.get_file_id(fiscal_code, "id_card")
-            
-            updated_file_id = await replace_file_in_folder(parent_folder_id, "id_card.png", id_card)
-           
-            update_data["id_card_path"] = updated_file_id
-
-        if visa:
-            _,parent_folder_id = await employees_dal.get_file_id(fiscal_code, "visa")
-            
-            updated_file_id = await replace_file_in_folder(parent_folder_id, "visa.pdf", visa)
-           
-            update_data["visa_path"] = updated_file_id
-        
-        if unilav:
-            _,parent_folder_id = await employees_dal.get_file_id(fiscal_code, "unilav")
-            
-            updated_file_id = await replace_file_in_folder(parent_folder_id, "unilav.pdf", unilav)
-           
-            update_data["unilav_path"] = updated_file_id
+        documents = {
+            "profile_image": (profile_image, "profile_image.png"),
+            "id_card": (id_card, "id_card.png"),
+            "visa": (visa, "visa.pdf"),
+            "unilav": (unilav, "unilav.pdf")
+        }
+        uploads = {}
+
+        for name, (file, file_name) in documents.items():
+            if not file:
+                continue
+
+            old_file_id = existing_employee.get(f"{name}_path")
+            file_hash = await sha256_file(file)
+
+            # Same content as the stored document, nothing is transferred
+            if old_file_id and file_hash == existing_employee.get(f"{name}_sha256"):
+                uploads[name] = "unchanged"
+                continue
+
+            update_data.update(await replace_document(storage, existing_employee, parent_folder_id, name, file_name, file))
+            update_data[f"{name}_sha256"] = file_hash
+            uploads[name] = "uploaded"
 
        
         update_data = {key: value for key, value in update_data.items() if value is not None}
 
-        result = await employees_dal.update_employee(fiscal_code, update_data)
+        if update_data:
+            result = await employees_dal.update_employee(fiscal_code, update_data)
 
-        return {"message": f"Employee with fiscal code: {fiscal_code} updated successfully"}
+        return {"message": f"Employee with fiscal code: {fiscal_code} updated successfully",
+                "documents": uploads}
 
     except HTTPException as e:
         raise e
@@ -586,13 +983,18 @@ DELETE Methods
 
 @router.delete("/delete/{fiscal_code}")
 async def delete_employee(fiscal_code:str,
-                          employees_dal : EmployeesDAL = Depends(get_employees_dal)):
+                          background_tasks: BackgroundTasks,
+                          employees_dal : EmployeesDAL = Depends(get_employees_dal),
+                          storage: Storage = Depends(get_storage)):
     """
-    Deletes an employee.
+    Deletes an employee. Its Drive folder is removed in the background
+    after the response is sent.
 
     Args:
         fiscal_code (str): The fiscal code of the employee.
+        background_tasks (BackgroundTasks): The tasks run after the response.
         employees_dal (EmployeesDAL): The employees DAL.
+        storage (Storage): The configured file storage.
 
     Returns:
         dict: A dictionary containing a message indicating the success or failure of the operation.
@@ -601,6 +1003,10 @@ async def delete_employee(fiscal_code:str,
     try:
         result = await employees_dal.delete_employee(fiscal_code)
 
+        profile_image_cache.pop(result.get("profile_image_path"), None)
+        if result.get("parent_folder_id"):
+            background_tasks.add_task(delete_employee_folder, storage, result["parent_folder_id"])
+
         return {"message": f"Employee with {fiscal_code} deleted"}
 
     except HTTPException as e:
@@ -1,15 +1,57 @@
 import os
 import io
+import asyncio
+import json
+import base64
+import hashlib
+import zipfile
+import tempfile
+import mimetypes
+from typing import BinaryIO
+from collections.abc import AsyncIterator
+from bson import ObjectId
+from bson.errors import InvalidId
+from cachetools import TTLCache
+from pydantic import BaseModel
 from fastapi import UploadFile
-from fastapi import UploadFile
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
-from googleapiclient.http import MediaIoBaseDownload
-from googleapiclient.errors import HttpError
-
-SCOPES = ["https://www.googleapis.com/auth/drive"]
-SERVICE_ACCOUNT_FILE = "/etc/secrets/accesspermissionstorage-3b70e75ecae3.json"
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+from app.database.drive import MAX_BATCH_SIZE, CHUNK_SIZE
+from app.database.storage import Storage
+from app.database.document_cache import document_cache
+from app.workers.media import media_pool, image_media_type
+#from database.drive import MAX_BATCH_SIZE, CHUNK_SIZE
+#from database.storage import Storage
+#from database.document_cache import document_cache
+#from workers.media import media_pool, image_media_type
+
+# Maximum number of files uploaded at the same time by a single request
+MAX_CONCURRENT_UPLOADS = 4
+
+# Local copies of the files waiting in the upload outbox
+OUTBOX_DIR = os.path.join(os.getenv("UPLOAD_DIR") or "uploads", "outbox")
+# Local copies of updated documents while they are processed
+INGEST_DIR = os.path.join(os.getenv("UPLOAD_DIR") or "uploads", "ingest")
+
+# Streamed JSON is sent in chunks of about this size
+JSON_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Maximum number of files downloaded at the same time by a single request
+MAX_CONCURRENT_DOWNLOADS = 8
+
+# Pause after every Drive cleanup batch, keeps deletions within the API quota
+DRIVE_CLEANUP_INTERVAL = float(os.getenv("DRIVE_CLEANUP_INTERVAL", "1"))
+# Cleanup batches of every request run one after the other
+_cleanup_lock = asyncio.Lock()
+
+# Profile images (content, ETag) by Drive file ID, bounded by their total size in bytes.
+# Replaced images keep their ID and other processes can't invalidate them, so
+# they are read again after PROFILE_IMAGE_CACHE_TTL seconds.
+profile_image_cache = TTLCache(maxsize=int(os.getenv("PROFILE_IMAGE_CACHE_BYTES", str(32 * 1024 * 1024))),
+                               ttl=float(os.getenv("PROFILE_IMAGE_CACHE_TTL", "60")),
+                               getsizeof=lambda entry: len(entry[0]))
 
 def format_path(file_path: str) -> str:
     """
@@ -26,13 +68,12 @@ def format_path(file_path: str) -> str:
 
 async def save_and_rename_files(files: list[UploadFile], file_names: list[str]) -> list[UploadFile]:
     """
-    Renames the list of files based on the provided file_names, saves them to root_dir,
-    and returns the renamed files for uploading to Google Drive.
+    Renames the list of files based on the provided file_names and returns the
+    renamed files for uploading to Google Drive. The content is not copied.
 
     Args:
         files (list[UploadFile]): The files to be saved.
         file_names (list[str]): The custom names for the files.
-        root_dir (str): The root directory where the files will be saved.
 
     Returns:
         list[UploadFile]: The list of renamed files ready for upload.
@@ -52,171 +93,507 @@ async def save_and_rename_files(files: list[UploadFile], file_names: list[str])
         # Renombrar el archivo
         renamed_file_name = f"{new_name}{file_extension}"
 
-        # Leer el contenido del archivo
-        file_content = await file.read()
-
-        # Crear un nuevo UploadFile simulado con el nuevo nombre y contenido
+        # Only the name changes, the spooled content is shared and never read into memory
+        await file.seek(0)
         renamed_file = UploadFile(
             filename=renamed_file_name,
-            file=io.BytesIO(file_content),
+            file=file.file,
+            size=file.size,
             headers=file.headers
         )
         renamed_files.append(renamed_file)
 
     return renamed_files
 
-async def authenticate_google_drive(service_account_file: str, scopes: list[str]):
+def _sha256(file) -> str:
+    hasher = hashlib.sha256()
+    while chunk := file.read(CHUNK_SIZE):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+async def sha256_file(file: UploadFile) -> str:
     """
-    Authenticate with Google Drive using a service account file and scopes.
+    Computes the SHA-256 of an uploaded file in a worker thread, reading it
+    CHUNK_SIZE bytes at a time, and rewinds it for the upload.
 
     Args:
-        service_account_file (str): The path to the service account file.
-        scopes (list[str]): The scopes to be used for authentication.
+        file (UploadFile): The uploaded file.
 
     Returns:
-        service_account.Credentials: The authenticated credentials.
+        str: The hex digest of the content.
     """
-    credentials = service_account.Credentials.from_service_account_file(
-        service_account_file, scopes=scopes
-    )
-    return credentials
+    await file.seek(0)
+    digest = await asyncio.to_thread(_sha256, file.file)
+    await file.seek(0)
+    return digest
+
+def _spool(source, path: str) -> str:
+    hasher = hashlib.sha256()
+    partial_path = f"{path}.part"
+    with open(partial_path, "wb") as target:
+        while chunk := source.read(CHUNK_SIZE):
+            hasher.update(chunk)
+            target.write(chunk)
+        target.flush()
+        os.fsync(target.fileno())
+    # Only complete files ever appear under their final name
+    os.replace(partial_path, path)
+    return hasher.hexdigest()
+
+async def spool_file(file: UploadFile, path: str) -> str:
+    """
+    Copies an uploaded file to local disk in a worker thread, CHUNK_SIZE bytes
+    at a time, hashing it on the way.
 
-async def create_folder(folder_name:str, parent_folder_id:str):
-    credentials = await authenticate_google_drive(service_account_file=SERVICE_ACCOUNT_FILE, scopes=SCOPES) 
+    Args:
+        file (UploadFile): The uploaded file.
+        path (str): The destination path.
 
-    drive_service = build("drive", "v3", credentials=credentials)
+    Returns:
+        str: The SHA-256 hex digest of the content.
+    """
+    await file.seek(0)
+    return await asyncio.to_thread(_spool, file.file, path)
 
-    folder_metada = {
-        "name": folder_name,
-        "mimeType": "application/vnd.google-apps.folder",
-        "parents": [parent_folder_id]
-    }
+async def replace_file_in_folder(storage: Storage, file_id: str | None, folder_id: str, file_name: str, file: UploadFile) -> str:
+    """
+    Replaces a document with a new revision uploaded over its known Drive ID,
+    so the ID stays the same. A new file is uploaded to the folder when the
+    document doesn't exist yet or was removed from Drive.
 
-    create_folder = drive_service.files().create(
-        body=folder_metada, 
-        fields="id"
-        ).execute()
-    
-    #print(f"Folder {folder_name} created with id {create_folder['id']}")
-    return create_folder['id']
-
-async def upload_file_to_drive(file: UploadFile, folder_id: str):
-    credentials = await authenticate_google_drive(service_account_file=SERVICE_ACCOUNT_FILE, scopes=SCOPES) 
-
-    drive_service = build("drive", "v3", credentials=credentials)
-
-    """Subir archivo a Google Drive"""
-    file_metadata = {
-        "name": file.filename,
-        "parents": [folder_id],
-    }
-    #print(file)
-    file_content = await file.read()  # Leer el archivo asincrónicamente
-    media = MediaIoBaseUpload(io.BytesIO(file_content), mimetype=file.content_type)
-    
-    uploaded_file = drive_service.files().create(
-        body=file_metadata,
-        media_body=media,
-        fields="id"
-    ).execute()
+    Args:
+        storage (Storage): The configured file storage.
+        file_id (str | None): The stored Drive ID of the document.
+        folder_id (str): The ID of the employee folder.
+        file_name (str): The name of the document in Drive.
+        file (UploadFile): The new content.
+
+    Returns:
+        str: The Drive ID of the document.
+    """
+    file.filename = file_name
+
+    if file_id:
+        await document_cache.invalidate(file_id)
+        try:
+            return await storage.update(file_id, file)
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            print(f"No se encontró el archivo {file_name}. Subiendo uno nuevo...")
+            await file.seek(0)
+
+    return await storage.upload(file, folder_id)
+
+async def replace_document(storage: Storage, employee: dict, folder_id: str,
+                           name: str, file_name: str, file: UploadFile) -> dict[str, str]:
+    """
+    Normalizes an updated document in the media pool, then replaces it and its
+    thumbnails in the employee folder.
+
+    Args:
+        storage (Storage): The configured file storage.
+        employee (dict): The employee, with the IDs of its current files.
+        folder_id (str): The ID of the employee folder.
+        name (str): The document name (profile_image, id_card, visa or unilav).
+        file_name (str): The name of the document in the storage.
+        file (UploadFile): The new content.
+
+    Returns:
+        dict[str, str]: The <name>_path fields whose file ID changed.
+    """
+    os.makedirs(INGEST_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=INGEST_DIR) as directory:
+        path = os.path.join(directory, name)
+        await spool_file(file, path)
+        variants = await media_pool.ingest(path, name, file_name, file.content_type or "application/octet-stream")
+
+        changed = {}
+        for variant in variants:
+            old_file_id = employee.get(f"{variant['name']}_path")
+            with open(variant["path"], "rb") as f:
+                file_id = await replace_file_in_folder(storage, old_file_id, folder_id, variant["file_name"],
+                                                       UploadFile(f,
+                                                                  size=os.path.getsize(variant["path"]),
+                                                                  headers=Headers({"content-type": variant["content_type"]})))
+            profile_image_cache.pop(old_file_id, None)
+            if file_id != old_file_id:
+                changed[f"{variant['name']}_path"] = file_id
+    return changed
+
+def encode_cursor(key: tuple[str, ObjectId]) -> str:
+    """
+    Turns the key of the last employee of a page into an opaque continuation token.
 
-    return uploaded_file.get("id")
+    Args:
+        key (tuple[str, ObjectId]): The first name and ID of the employee.
 
-async def replace_file_in_folder(folder_id:str, file_name:str, file: UploadFile):
-    credentials = await authenticate_google_drive(service_account_file=SERVICE_ACCOUNT_FILE, scopes=SCOPES) 
+    Returns:
+        str: The continuation token.
+    """
+    first_name, _id = key
+    return base64.urlsafe_b64encode(json.dumps([first_name, str(_id)]).encode()).decode().rstrip("=")
 
-    drive_service = build("drive", "v3", credentials=credentials)
+def decode_cursor(cursor: str) -> tuple[str, ObjectId]:
+    """
+    Reads a continuation token made by encode_cursor.
 
+    Args:
+        cursor (str): The continuation token.
+
+    Returns:
+        tuple[str, ObjectId]: The first name and ID of the last employee of the previous page.
+    """
     try:
-        # 1. Buscar el archivo por nombre dentro de la carpeta
-        query = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
-        results = drive_service.files().list(q=query, fields="files(id, name)").execute()
-        files = results.get('files', [])
-
-        # 2. Si el archivo existe, eliminarlo
-        if files:
-            file_id = files[0]['id']
-            #print(f"Archivo encontrado: {file_name} (ID: {file_id}). Eliminando...")
-            drive_service.files().delete(fileId=file_id).execute()
-        else:
-            print(f"No se encontró el archivo {file_name}. Subiendo uno nuevo...")
+        first_name, _id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(first_name), ObjectId(_id)
+    except (ValueError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
-        # 3. Subir el nuevo archivo
-        file_metadata = {
-            'name': file_name,
-            'parents': [folder_id]
-        }
+def wants_ndjson(accept: str | None) -> bool:
+    """
+    Checks whether an Accept header asks for newline-delimited JSON.
 
-        file_content = await file.read()  # Leer el archivo asincrónicamente
-        media = MediaIoBaseUpload(io.BytesIO(file_content), mimetype=file.content_type)
+    Args:
+        accept (str | None): The value of the Accept header.
 
-        file = drive_service.files().create(
-            body=file_metadata, 
-            media_body=media, 
-            fields='id'
-        ).execute()
+    Returns:
+        bool: True for application/x-ndjson or application/ndjson.
+    """
+    media_types = {value.split(";")[0].strip().lower() for value in (accept or "").split(",")}
+    return bool(media_types & {"application/x-ndjson", "application/ndjson"})
 
-        #print(f"Archivo {file_name} subido con éxito. Nuevo ID: {file.get('id')}")
-        return file.get('id')
+async def stream_json(items: AsyncIterator[BaseModel], ndjson: bool = False) -> AsyncIterator[bytes]:
+    """
+    Encodes models as they arrive, as a JSON array or as NDJSON (one per line),
+    and yields them in chunks of about JSON_STREAM_CHUNK_SIZE bytes.
 
-    except Exception as e:
-        print(f"Error al reemplazar el archivo: {e}")
+    Args:
+        items (AsyncIterator[BaseModel]): The models to be sent.
+        ndjson (bool): Whether to send NDJSON instead of a JSON array.
+
+    Returns:
+        AsyncIterator[bytes]: The encoded body.
+    """
+    separator = b"\n" if ndjson else b","
+    chunk = bytearray() if ndjson else bytearray(b"[")
+    first = True
+    async for item in items:
+        if not first and not ndjson:
+            chunk += separator
+        chunk += item.__pydantic_serializer__.to_json(item)
+        if ndjson:
+            chunk += separator
+        first = False
+        if len(chunk) >= JSON_STREAM_CHUNK_SIZE:
+            yield bytes(chunk)
+            chunk.clear()
+    if not ndjson:
+        chunk += b"]"
+    if chunk:
+        yield bytes(chunk)
+
+def parse_range_header(range_header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    Parses a single-range HTTP Range header against the size of a file.
 
-async def download_file_drive(real_file_id, file_path):
-    credentials = await authenticate_google_drive(service_account_file=SERVICE_ACCOUNT_FILE, scopes=SCOPES) 
+    Args:
+        range_header (str | None): The value of the Range header.
+        size (int): The size of the file in bytes.
 
-    drive_service = build("drive", "v3", credentials=credentials)
+    Returns:
+        tuple[int, int] | None: First and last byte (inclusive) requested,
+        None when the whole file must be sent.
+    """
+    if not range_header or not range_header.startswith("bytes="):
+        return None
 
-    file_id = real_file_id
+    ranges = range_header[len("bytes="):].split(",")
+    # Multiple ranges are allowed to be answered with the whole file
+    if len(ranges) != 1:
+        return None
 
-    # pylint: disable=maybe-no-member
-    
+    start, _, end = ranges[0].strip().partition("-")
     try:
-        request = drive_service.files().get_media(fileId=file_id)
-        file = io.BytesIO()
-        downloader = MediaIoBaseDownload(file, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        
-        with open(file_path, "wb") as f:
-            f.write(file.getvalue())
-        print(f"Archivo guardado como: {file_path}")
+        if start:
+            first, last = int(start), int(end) if end else size - 1
+        else:
+            # Suffix range: the last N bytes
+            first, last = max(size - int(end), 0), size - 1
+    except ValueError:
+        return None
 
-    except HttpError as error:
-        print(f"An error occurred: {error}")
-        file = None
+    if first > last or first >= size:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
 
-    return file_path
+    return first, min(last, size - 1)
 
-async def get_file(file_id: str) -> UploadFile:
-    """Retrieves a file from Google Drive.
+class SendfileResponse(Response):
+    """
+    Sends a byte range of a local file, given by path or already open. When the
+    ASGI server supports the zero-copy send extension the kernel copies the file
+    straight to the socket (sendfile), otherwise it is read CHUNK_SIZE bytes at
+    a time in a thread.
+    """
+    def __init__(self, file: str | BinaryIO, byte_range: tuple[int, int], status_code: int = 200,
+                 headers: dict | None = None, media_type: str | None = None):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.file = file
+        self.offset = byte_range[0]
+        self.count = byte_range[1] - byte_range[0] + 1
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        f = self.file
+        if isinstance(f, str):
+            f = await asyncio.to_thread(open, f, "rb")
+
+        with f:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope["method"] == "HEAD" or self.count <= 0:
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": f,
+                            "offset": self.offset, "count": self.count})
+                return
+
+            offset, remaining = self.offset, self.count
+            while remaining > 0:
+                chunk = await asyncio.to_thread(os.pread, f.fileno(), min(CHUNK_SIZE, remaining), offset)
+                if not chunk:
+                    raise RuntimeError(f"{f.name} was truncated while it was being sent")
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+
+async def get_profile_image(storage: Storage, file_id: str) -> tuple[bytes, str]:
+    """
+    Retrieves a profile image and its strong ETag, from the cache when possible.
 
     Args:
-        file_id (str): The ID of the file to retrieve.
+        storage (Storage): The configured file storage.
+        file_id (str): The Drive ID of the profile image.
 
     Returns:
-        UploadFile: The file object.
+        tuple[bytes, str]: The content of the image and its ETag.
     """
-    credentials = await authenticate_google_drive(service_account_file=SERVICE_ACCOUNT_FILE, scopes=SCOPES) 
+    cached = profile_image_cache.get(file_id)
+    if cached is None:
+        content = await storage.download(file_id)
+        cached = (content, f'"{hashlib.sha256(content).hexdigest()}"')
+        # Images bigger than the whole cache are served without being cached
+        if len(content) <= profile_image_cache.maxsize:
+            profile_image_cache[file_id] = cached
+    return cached
+
+def document_version(metadata: dict) -> str:
+    """
+    Returns a value that changes whenever the content of a document changes, even
+    if it was replaced in place and kept its ID. Drive files have an MD5 checksum
+    unless they are Google Docs, which have a version number instead.
 
-    drive_service = build("drive", "v3", credentials=credentials)
+    Args:
+        metadata (dict): The metadata of the document, see Storage.get_metadata.
 
-    request = drive_service.files().get_media(fileId=file_id)
-    file_io = io.BytesIO()
-    downloader = MediaIoBaseDownload(file_io, request)
+    Returns:
+        str: The version of the document.
+    """
+    return (metadata.get("md5Checksum") or metadata.get("version")
+            or f"{metadata['modifiedTime']}-{metadata.get('size')}")
 
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Checks an If-None-Match header against an ETag (weak comparison).
 
-    # Retornar el contenido en bytes
-    file_io.seek(0)
-    return file_io.read()
+    Args:
+        if_none_match (str | None): The value of the If-None-Match header.
+        etag (str): The current ETag of the resource.
 
+    Returns:
+        bool: True if the client's copy is still valid.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
 
+async def stream_profile_images(storage: Storage, file_ids: dict[str, str], boundary: str) -> AsyncIterator[bytes]:
+    """
+    Downloads several profile images concurrently, at most MAX_CONCURRENT_DOWNLOADS
+    at a time, and yields them as multipart/form-data parts named after the fiscal
+    code as soon as each one is ready. Images that can't be retrieved are left out.
 
-   
-    
-        
-        
\ No newline at end of file
+    Args:
+        storage (Storage): The configured file storage.
+        file_ids (dict[str, str]): The Drive IDs of the images by fiscal code.
+        boundary (str): The multipart boundary.
+
+    Returns:
+        AsyncIterator[bytes]: The multipart body.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+    async def fetch(fiscal_code: str, file_id: str) -> tuple[str, bytes | None]:
+        async with semaphore:
+            try:
+                content, _ = await get_profile_image(storage, file_id)
+            except Exception as e:
+                # Missing image or Drive error, the other images are still sent
+                print(f"Profile image of {fiscal_code} left out: {e!r}")
+                content = None
+        return fiscal_code, content
+
+    tasks = [asyncio.create_task(fetch(fiscal_code, file_id)) for fiscal_code, file_id in file_ids.items()]
+    try:
+        for task in asyncio.as_completed(tasks):
+            fiscal_code, content = await task
+            if content is None:
+                continue
+            media_type = image_media_type(content)
+            yield (f"--{boundary}\r\n"
+                   f'Content-Disposition: form-data; name="{fiscal_code}"; filename="profile_image{mimetypes.guess_extension(media_type)}"\r\n'
+                   f"Content-Type: {media_type}\r\n"
+                   f"Content-Length: {len(content)}\r\n\r\n").encode()
+            yield content
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
+    finally:
+        # The client may disconnect before every image was sent
+        for task in tasks:
+            task.cancel()
+
+async def batch_delete_files(storage: Storage, file_ids: list[str]) -> list[str]:
+    """
+    Deletes files or folders with Drive batch requests of MAX_BATCH_SIZE calls,
+    throttled to one batch every DRIVE_CLEANUP_INTERVAL seconds process-wide.
+
+    Args:
+        storage (Storage): The configured file storage.
+        file_ids (list[str]): The IDs of the files.
+
+    Returns:
+        list[str]: The IDs of the files that couldn't be deleted.
+    """
+    failed = []
+    for start in range(0, len(file_ids), MAX_BATCH_SIZE):
+        async with _cleanup_lock:
+            failed += await storage.batch_delete(file_ids[start:start + MAX_BATCH_SIZE])
+            await asyncio.sleep(DRIVE_CLEANUP_INTERVAL)
+    return failed
+
+async def delete_employee_folder(storage: Storage, folder_id: str):
+    """
+    Background job that removes the Drive folder of a deleted employee and its files.
+
+    Args:
+        storage (Storage): The configured file storage.
+        folder_id (str): The ID of the employee folder.
+    """
+    try:
+        files = await storage.list_folder(folder_id)
+        for file in files:
+            await document_cache.invalidate(file["id"])
+        failed = await batch_delete_files(storage, [file["id"] for file in files])
+        failed += await batch_delete_files(storage, [folder_id])
+        if failed:
+            print(f"Could not delete Drive files {failed} of folder {folder_id}")
+    except Exception as e:
+        print(f"Error deleting Drive folder {folder_id}: {e}")
+
+class DownloadError(Exception):
+    """
+    A download of stream_documents_zip that failed after its entry was started.
+    """
+
+class _ZipSink(io.RawIOBase):
+    """
+    Unseekable file that keeps what zipfile writes until it is drained.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+async def stream_documents_zip(storage: Storage, documents: dict[str, dict[str, str]]) -> AsyncIterator[bytes]:
+    """
+    Streams a ZIP archive with the documents of several employees, one folder per
+    fiscal code. Up to MAX_CONCURRENT_DOWNLOADS files are downloaded at the same
+    time and each one is written to the archive as soon as it starts arriving.
+    Every download only buffers one chunk ahead, so memory doesn't depend on the
+    size or the number of files.
+
+    Documents that can't be downloaded are left out. A download that fails once
+    its entry was started can't be taken back, the entry keeps what arrived. Both
+    are listed in an errors.txt entry at the end, and the archive is always complete.
+
+    Args:
+        storage (Storage): The configured file storage.
+        documents (dict[str, dict[str, str]]): The file IDs by document name, by fiscal code.
+
+    Returns:
+        AsyncIterator[bytes]: The ZIP archive.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    # Downloads that have data or failed, in that order: (entry name, chunks) or (None, error)
+    ready: asyncio.Queue = asyncio.Queue()
+
+    async def fetch(fiscal_code: str, name: str, file_id: str):
+        chunks = asyncio.Queue(maxsize=1)
+        announced = False
+        async with semaphore:
+            try:
+                metadata = await storage.get_metadata(file_id, fields="name")
+                ready.put_nowait((f"{fiscal_code}/{metadata['name']}", chunks))
+                announced = True
+                async for chunk in storage.stream(file_id):
+                    await chunks.put(chunk)
+                await chunks.put(None)
+            except Exception as e:
+                # Drive errors, timeouts and failed token refreshes alike, the archive goes on
+                error = e.detail if isinstance(e, HTTPException) else f"{type(e).__name__}: {e}"
+                if announced:
+                    await chunks.put(DownloadError(error))
+                else:
+                    ready.put_nowait((None, f"{fiscal_code}/{name}: left out, {error}"))
+
+    tasks = [asyncio.create_task(fetch(fiscal_code, name, file_id))
+             for fiscal_code, files in documents.items()
+             for name, file_id in files.items()]
+
+    sink = _ZipSink()
+    errors = []
+    try:
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+            for _ in tasks:
+                name, chunks = await ready.get()
+                if name is None:
+                    errors.append(chunks)
+                    continue
+                with archive.open(name, mode="w", force_zip64=True) as entry:
+                    while (chunk := await chunks.get()) is not None:
+                        if isinstance(chunk, DownloadError):
+                            errors.append(f"{name}: incomplete, {chunk}")
+                            break
+                        entry.write(chunk)
+                        yield sink.drain()
+                yield sink.drain()
+            if errors:
+                archive.writestr("errors.txt", "\n".join(errors) + "\n")
+        yield sink.drain()
+    finally:
+        # The client may disconnect before the archive is complete
+        for task in tasks:
+            task.cancel()
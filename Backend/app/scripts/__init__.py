@@ -0,0 +1,3 @@
+"""
+Init file for scripts module.
+"""
\ No newline at end of file
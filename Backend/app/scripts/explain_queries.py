@@ -0,0 +1,180 @@
+"""
+Explains every query shape of the DALs and fails if any of them scans a whole collection.
+
+The declared indexes (app/database/indexes.py) are created first unless --no-create
+is given, so the check can run against an empty database. Every shape is explained
+with the queryPlanner verbosity, nothing is read or written.
+
+Usage (from the Backend directory):
+    python -m app.scripts.explain_queries [--no-create]
+"""
+import sys
+import asyncio
+import argparse
+from datetime import datetime, timezone
+from bson import ObjectId
+from dotenv import load_dotenv
+#Load environment variables
+load_dotenv()
+
+from app.database.connection import database
+from app.database.indexes import ensure_indexes
+from app.scripts.migrate_purchase_orders import EMBEDDED_FILTER
+
+NOW = datetime.now(timezone.utc)
+
+# Query shapes of EmployeesDAL, UploadJobsDAL and RevocationList as explain commands, by the methods that use them
+QUERY_SHAPES: dict[str, dict] = {
+    "get_file_id, list_employees": {
+        "find": "employees", "filter": {"fiscal_code": "FC"}, "limit": 1},
+    "get_file_ids, get_documents, refresh_summaries": {
+        "find": "employees", "filter": {"fiscal_code": {"$in": ["FC1", "FC2"]}}},
+    "get_all": {
+        "find": "employees", "filter": {}, "sort": {"first_name": 1, "_id": 1}},
+    "get_page": {
+        "find": "employees",
+        "filter": {"first_name": {"$gte": "A"},
+                   "$or": [{"first_name": {"$gt": "A"}}, {"_id": {"$gt": ObjectId()}}]},
+        "sort": {"first_name": 1, "_id": 1}, "limit": 51},
+    "query_employees (contract type)": {
+        "find": "employees", "filter": {"contract_type": "T"}, "sort": {"first_name": 1, "_id": 1}, "limit": 50},
+    "query_employees (validity window)": {
+        "find": "employees",
+        "filter": {"contract_validity_end_date": {"$gte": NOW}, "contract_validity_start_date": {"$lte": NOW}},
+        "sort": {"contract_validity_end_date": 1, "_id": 1}, "limit": 50},
+    "query_employees (purchase order)": {
+        "find": "employees", "filter": {"purchase_order": {"$elemMatch": {"po_number": "PO"}}},
+        "sort": {"first_name": 1, "_id": 1}, "limit": 50},
+    "query_employees (plant and status)": {
+        "find": "employees",
+        "filter": {"purchase_order": {"$elemMatch": {"access_permission": {"$elemMatch": {"plant": "P", "status": "S"}}}}},
+        "sort": {"first_name": 1, "_id": 1}, "limit": 50},
+    "query_employees (count)": {
+        "count": "employees", "query": {"contract_type": "T"}},
+    "get_expiring": {
+        "find": "employees",
+        "filter": {"next_expiry.date": {"$gte": NOW, "$lte": NOW},
+                   "$or": [{"next_expiry.date": {"$gt": NOW}}, {"_id": {"$gt": ObjectId()}}]},
+        "sort": {"next_expiry.date": 1, "_id": 1}, "limit": 51},
+    "get_expiring (refresh_summaries of past dates)": {
+        "find": "employees", "filter": {"next_expiry.date": {"$lt": NOW}}},
+    "find_user_name, email_password_verification": {
+        "find": "employees", "filter": {"user_credentials.user_name": "user"}, "limit": 1},
+    "create_purchase_order": {
+        "update": "employees", "updates": [{"q": {"fiscal_code": {"$in": ["FC1", "FC2"]},
+                                                  "purchase_order.po_number": {"$ne": "PO"}},
+                                            "u": {"$push": {"purchase_order": {"po_number": "PO"}}},
+                                            "multi": True}]},
+    "create_purchase_order (purchase_orders)": {
+        "findAndModify": "purchase_orders", "query": {"po_number": "PO"},
+        "update": {"$setOnInsert": {"description": "D"}}, "upsert": True},
+    "update_purchase_order (purchase_orders)": {
+        "update": "purchase_orders", "updates": [{"q": {"po_number": "PO"},
+                                                  "u": {"$set": {"description": "D"}}}]},
+    "resolve_purchase_orders": {
+        "find": "purchase_orders", "filter": {"po_number": {"$in": ["PO1", "PO2"]}}},
+    "delete_purchase_order (purchase_orders)": {
+        "delete": "purchase_orders", "deletes": [{"q": {"po_number": "PO"}, "limit": 1}]},
+    "insert_access_permission": {
+        "update": "employees", "updates": [{"q": {"fiscal_code": "FC", "purchase_order.po_number": {"$in": ["PO"]}},
+                                            "u": {"$push": {"purchase_order.$[].access_permission": {"protocol_number": "P"}}},
+                                            "multi": True}]},
+    "update_employee": {
+        "findAndModify": "employees", "query": {"fiscal_code": "FC"}, "update": {"$set": {"first_name": "A"}}},
+    "update_access_permission": {
+        "update": "employees", "updates": [{"q": {"purchase_order.po_number": "PO",
+                                                  "purchase_order.access_permission.protocol_number": "P"},
+                                            "u": {"$set": {"purchase_order.$[po].access_permission.$[ap].status": "S"}},
+                                            "arrayFilters": [{"po.po_number": "PO"}, {"ap.protocol_number": "P"}],
+                                            "multi": True}]},
+    "update_purchase_order": {
+        "update": "employees", "updates": [{"q": {"purchase_order.po_number": "PO"},
+                                            "u": {"$set": {"purchase_order.$[po].po_number": "PO2"}},
+                                            "arrayFilters": [{"po.po_number": "PO"}],
+                                            "multi": True}]},
+    "delete_employee": {
+        "findAndModify": "employees", "query": {"fiscal_code": "FC"}, "remove": True},
+    "delete_purchase_order": {
+        "update": "employees", "updates": [{"q": {"purchase_order.po_number": "PO"},
+                                            "u": {"$pull": {"purchase_order": {"po_number": "PO"}}},
+                                            "multi": True}]},
+    "RevocationList (load)": {
+        "find": "revoked_tokens", "filter": {"expires_at": {"$gt": NOW}}},
+    "RevocationList (poll)": {
+        "find": "revoked_tokens", "filter": {"expires_at": {"$gt": NOW}, "revoked_at": {"$gte": NOW}}},
+    "UploadJobsDAL.get_job": {
+        "find": "upload_jobs", "filter": {"_id": "job"}, "limit": 1},
+    "UploadJobsDAL.claim_next_job": {
+        "findAndModify": "upload_jobs",
+        "query": {"$or": [{"status": "pending", "next_attempt_at": {"$lte": NOW}},
+                          {"status": "running", "lease_expires_at": {"$lte": NOW}}]},
+        "sort": {"next_attempt_at": 1},
+        "update": {"$set": {"status": "running"}}},
+}
+
+# Shapes that read every employee on purpose, reported but never a failure
+FULL_SCANS: dict[str, dict] = {
+    "migrate_purchase_orders": {
+        "find": "employees", "filter": EMBEDDED_FILTER, "sort": {"_id": 1}, "limit": 500},
+    "recompute_stats": {
+        "find": "employees", "filter": {}, "projection": {"fiscal_code": 1, "next_expiry": 1, "stats_keys": 1}},
+    "get_stats (a few documents)": {
+        "find": "stats", "filter": {}},
+    "get_folder_ids (reconcile_drive)": {
+        "find": "employees", "filter": {}, "projection": {"_id": 0, "fiscal_code": 1, "parent_folder_id": 1}},
+}
+
+def plan_stages(plan) -> list[str]:
+    """
+    Returns every stage of an explained plan, nested stages included.
+
+    Args:
+        plan (dict | list): The winning plan, or any part of it.
+
+    Returns:
+        list[str]: The names of the stages.
+    """
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages += plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages += plan_stages(value)
+    return stages
+
+async def explain(command: dict) -> list[str]:
+    explained = await database.db.command({"explain": command, "verbosity": "queryPlanner"})
+    return plan_stages(explained["queryPlanner"]["winningPlan"])
+
+async def check(create: bool) -> bool:
+    await database.connect()
+    try:
+        if create:
+            await ensure_indexes(database.db)
+
+        ok = True
+        for name, command in QUERY_SHAPES.items():
+            stages = await explain(command)
+            scan = "COLLSCAN" in stages
+            ok = ok and not scan
+            print(f"{'FAIL' if scan else 'ok  '} {name}: {' <- '.join(stages)}")
+
+        for name, command in FULL_SCANS.items():
+            print(f"full {name}: {' <- '.join(await explain(command))}")
+        return ok
+    finally:
+        await database.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--no-create", action="store_true", help="Check the existing indexes without creating the declared ones")
+    args = parser.parse_args()
+    if not asyncio.run(check(not args.no_create)):
+        print("Some queries scan a whole collection.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Moves the purchase orders embedded in the employees to the purchase_orders collection.
+
+Every purchase order is stored once, and the employees keep only its number and
+their own access permissions. Employees are migrated in batches. The purchase
+orders of a batch are written before its employees are rewritten, and an
+employee is only rewritten if it didn't change since it was read, so the
+migration can be stopped at any time and run again to resume it.
+
+When the copies of a purchase order differ between employees, the first one
+stored wins and the differences are printed.
+
+Usage (from the Backend directory):
+    python -m app.scripts.migrate_purchase_orders [--dry-run] [--batch-size 500]
+"""
+import asyncio
+import argparse
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+#Load environment variables
+load_dotenv()
+
+from app.dal.employees_dal import PURCHASE_ORDER_FIELDS
+from app.database.connection import database
+from app.database.indexes import ensure_indexes
+
+# Employees with at least one purchase order still embedded
+EMBEDDED_FILTER = {"purchase_order": {"$elemMatch": {"$or": [{field: {"$exists": True}}
+                                                              for field in PURCHASE_ORDER_FIELDS]}}}
+
+def split_purchase_order(embedded: dict) -> tuple[dict, dict]:
+    """
+    Splits an embedded purchase order into its details and the reference kept by the employee.
+
+    Args:
+        embedded (dict): The purchase order as stored in the employee.
+
+    Returns:
+        tuple[dict, dict]: The details, and the reference (po_number, access_permission).
+    """
+    details = {field: embedded[field] for field in PURCHASE_ORDER_FIELDS if field in embedded}
+    reference = {"po_number": embedded.get("po_number"),
+                 "access_permission": embedded.get("access_permission") or []}
+    return details, reference
+
+async def migrate_batch(db, employees: list[dict], known: dict[str, dict], dry_run: bool) -> tuple[int, int]:
+    """
+    Migrates a batch of employees.
+
+    Args:
+        db (AsyncIOMotorDatabase): The application database.
+        employees (list[dict]): The employees, with _id, fiscal_code and purchase_order.
+        known (dict[str, dict]): Purchase orders stored by the previous batches, filled with the new ones.
+        dry_run (bool): Only report what would change.
+
+    Returns:
+        tuple[int, int]: The purchase orders created and the employees rewritten.
+    """
+    details = {}
+    for employee in employees:
+        for embedded in employee["purchase_order"]:
+            number = embedded.get("po_number")
+            if number is not None:
+                details.setdefault(number, split_purchase_order(embedded)[0])
+
+    unknown = [number for number in details if number not in known]
+    if unknown:
+        async for purchase_order in db.purchase_orders.find({"po_number": {"$in": unknown}}, projection={"_id": 0}):
+            known[purchase_order["po_number"]] = purchase_order
+    missing = [number for number in details if number not in known]
+    for number in missing:
+        known[number] = details[number]
+
+    for employee in employees:
+        for embedded in employee["purchase_order"]:
+            current = known.get(embedded.get("po_number"))
+            copy = split_purchase_order(embedded)[0]
+            if current is not None and any(current.get(field) != value for field, value in copy.items()):
+                print(f"PO {embedded.get('po_number')} of {employee['fiscal_code']} differs from the stored one, "
+                      f"the stored one is kept: {copy}")
+
+    if dry_run:
+        return len(missing), len(employees)
+
+    created = 0
+    if missing:
+        # Another run may have stored them in the meantime, its copy is kept
+        result = await db.purchase_orders.bulk_write(
+            [UpdateOne({"po_number": number}, {"$setOnInsert": details[number]}, upsert=True) for number in missing],
+            ordered=False)
+        created = result.upserted_count
+
+    # Employees changed since they were read are left for the next run
+    result = await db.employees.bulk_write(
+        [UpdateOne({"_id": employee["_id"], "purchase_order": employee["purchase_order"]},
+                   {"$set": {"purchase_order": [split_purchase_order(embedded)[1]
+                                                for embedded in employee["purchase_order"]]}})
+         for employee in employees],
+        ordered=False)
+    return created, result.modified_count
+
+async def migrate(dry_run: bool, batch_size: int):
+    await database.connect()
+    try:
+        await ensure_indexes(database.db)
+
+        created = rewritten = read = 0
+        known = {}
+        last_id = None
+        while True:
+            query = dict(EMBEDDED_FILTER)
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            employees = await database.db.employees.find(query,
+                                                         projection={"fiscal_code": 1, "purchase_order": 1},
+                                                         sort=[("_id", 1)],
+                                                         limit=batch_size).to_list(None)
+            if not employees:
+                break
+
+            batch_created, batch_rewritten = await migrate_batch(database.db, employees, known, dry_run)
+            created += batch_created
+            rewritten += batch_rewritten
+            read += len(employees)
+            last_id = employees[-1]["_id"]
+            print(f"{read} employee(s) read, {rewritten} migrated, {created} purchase order(s) created.")
+
+        skipped = read - rewritten
+        print(f"{'Dry run: ' if dry_run else ''}{rewritten} employee(s) migrated, "
+              f"{created} purchase order(s) created"
+              f"{f', {skipped} changed while migrating (run again)' if skipped and not dry_run else ''}.")
+    finally:
+        await database.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be migrated")
+    parser.add_argument("--batch-size", type=int, default=500, help="Employees migrated per batch")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.dry_run, args.batch_size))
+
+if __name__ == "__main__":
+    main()
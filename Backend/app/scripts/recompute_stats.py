@@ -0,0 +1,34 @@
+"""
+Recomputes the next_expiry and stats_keys of every employee and the compliance
+counters served by /stats.
+
+The stats worker of the app does it every night, this runs it on demand, e.g.
+to fill the summaries of employees stored before they existed.
+
+Usage (from the Backend directory):
+    python -m app.scripts.recompute_stats
+"""
+import asyncio
+import argparse
+from dotenv import load_dotenv
+#Load environment variables
+load_dotenv()
+
+from app.dal.employees_dal import EmployeesDAL
+from app.database.connection import database
+
+async def recompute():
+    await database.connect()
+    try:
+        changed = await EmployeesDAL(database.db).recompute_stats()
+        print(f"Compliance counters recomputed, {changed} employee(s) changed.")
+    finally:
+        await database.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+    asyncio.run(recompute())
+
+if __name__ == "__main__":
+    main()
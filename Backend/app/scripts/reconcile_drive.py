@@ -0,0 +1,83 @@
+"""
+Deletes the Google Drive folders under PARENT_FOLDER_ID that don't belong to any employee.
+
+A folder is kept when its name is the fiscal code of an employee or its ID is the
+parent_folder_id of one. POST /create stores the employee and queues an upload job,
+then the upload worker creates the folder, named after the fiscal code, and records
+it in the employee once the files are uploaded. Folders created after the employees
+were read would look orphaned, so recently created folders are kept too.
+
+Orphans are the folders of deleted employees whose background cleanup failed
+(after DELETE, or when an employee was deleted while its upload job was running)
+and folders created by hand.
+
+Usage (from the Backend directory):
+    python -m app.scripts.reconcile_drive [--dry-run] [--min-age-minutes 60]
+"""
+import os
+import asyncio
+import argparse
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+#Load environment variables
+load_dotenv()
+
+from app.dal.employees_dal import EmployeesDAL
+from app.database.connection import database
+from app.database.drive import drive, FOLDER_MIME_TYPE
+from app.routers.utils import batch_delete_files
+
+async def find_orphaned_folders(employees_dal: EmployeesDAL, min_age: timedelta) -> list[dict]:
+    """
+    Returns the employee folders in Drive without a matching employee.
+
+    Args:
+        employees_dal (EmployeesDAL): The employees DAL.
+        min_age (timedelta): Folders younger than this are never returned.
+
+    Returns:
+        list[dict]: The orphaned folders (id, name, createdTime).
+    """
+    folders = await drive.list_files(
+        f"'{os.getenv('PARENT_FOLDER_ID')}' in parents and mimeType='{FOLDER_MIME_TYPE}' and trashed=false",
+        fields="files(id, name, createdTime)"
+    )
+    folder_ids = await employees_dal.get_folder_ids()
+    known_ids = set(folder_ids.values())
+    created_before = datetime.now(timezone.utc) - min_age
+
+    return [folder for folder in folders
+            if folder["name"] not in folder_ids
+            and folder["id"] not in known_ids
+            and datetime.fromisoformat(folder["createdTime"]) < created_before]
+
+async def reconcile(dry_run: bool, min_age: timedelta):
+    await database.connect()
+    await drive.connect()
+    try:
+        orphaned = await find_orphaned_folders(EmployeesDAL(database.db), min_age)
+        for folder in orphaned:
+            print(f"Orphaned folder {folder['name']} ({folder['id']})")
+
+        if dry_run or not orphaned:
+            print(f"{len(orphaned)} orphaned folder(s) found.")
+            return
+
+        failed = await batch_delete_files(drive, [folder["id"] for folder in orphaned])
+        print(f"{len(orphaned) - len(failed)} orphaned folder(s) deleted.")
+        if failed:
+            print(f"Could not delete: {failed}")
+    finally:
+        await drive.close()
+        await database.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="Only list the orphaned folders")
+    parser.add_argument("--min-age-minutes", type=int, default=60,
+                        help="Keep folders created less than this many minutes ago")
+    args = parser.parse_args()
+    asyncio.run(reconcile(args.dry_run, timedelta(minutes=args.min_age_minutes)))
+
+if __name__ == "__main__":
+    main()
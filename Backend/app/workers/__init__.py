@@ -0,0 +1,3 @@
+"""
+Init file for workers module.
+"""
\ No newline at end of file
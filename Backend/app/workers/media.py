@@ -0,0 +1,170 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Longest side of the stored images, bigger photos are scaled down
+MAX_IMAGE_SIDE = 2048
+JPEG_QUALITY = 85
+# Sides of the square thumbnails generated for the documents below, in pixels
+THUMBNAIL_SIZES = (64, 256)
+THUMBNAIL_DOCUMENTS = ("profile_image",)
+THUMBNAIL_QUALITY = 80
+
+def thumbnail_name(name: str, size: int) -> str:
+    """
+    Returns the document name of a thumbnail, its ID is kept in the employee as <name>_path.
+
+    Args:
+        name (str): The name of the original document.
+        size (int): The side of the thumbnail in pixels.
+
+    Returns:
+        str: The name of the thumbnail.
+    """
+    return f"{name}_thumbnail_{size}"
+
+def pick_thumbnail_size(size: int) -> int:
+    """
+    Returns the smallest thumbnail at least as big as the requested size, or the biggest one.
+
+    Args:
+        size (int): The side requested in pixels.
+
+    Returns:
+        int: The side of the thumbnail to serve.
+    """
+    return min((side for side in THUMBNAIL_SIZES if side >= size), default=max(THUMBNAIL_SIZES))
+
+def image_media_type(content: bytes) -> str:
+    """
+    Returns the media type of an image from its first bytes.
+
+    Args:
+        content (bytes): The image, or at least its first bytes.
+
+    Returns:
+        str: The media type, image/png when it can't be told.
+    """
+    if content.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    if content[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "image/png"
+
+def _save(image: Image.Image, path: str, format: str, **options):
+    temp_path = f"{path}.part"
+    image.save(temp_path, format, **options)
+    os.replace(temp_path, path)
+
+def process_document(path: str, name: str, file_name: str, content_type: str) -> list[dict]:
+    """
+    Normalizes a document in place and writes its thumbnails next to it. Runs in
+    the media process pool.
+
+    Images are rotated as their EXIF says, scaled down to MAX_IMAGE_SIDE and
+    re-encoded without metadata, as JPEG or as PNG when they have transparency.
+    The re-encoded image is only kept when it is smaller than the upload. Other
+    documents (PDFs) are kept as they are.
+
+    Args:
+        path (str): The path of the document.
+        name (str): The document name (profile_image, id_card, visa or unilav).
+        file_name (str): The file name of the document.
+        content_type (str): The media type of the document.
+
+    Returns:
+        list[dict]: The files to store (name, file_name, path, content_type), the document first.
+    """
+    document = {"name": name, "file_name": file_name, "path": path, "content_type": content_type}
+    try:
+        image = Image.open(path)
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        return [document]
+
+    with image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+        transparent = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+
+        directory = os.path.dirname(path)
+        extension, format, media_type = (".png", "PNG", "image/png") if transparent else (".jpg", "JPEG", "image/jpeg")
+        encoded_path = os.path.join(directory, f"{name}.encoded{extension}")
+        if transparent:
+            _save(image, encoded_path, format, optimize=True)
+        else:
+            _save(image.convert("RGB"), encoded_path, format, quality=JPEG_QUALITY, optimize=True, progressive=True)
+
+        if os.path.getsize(encoded_path) < os.path.getsize(path):
+            os.remove(path)
+            path = os.path.join(directory, f"{name}{extension}")
+            os.replace(encoded_path, path)
+            document.update(file_name=f"{name}{extension}", path=path, content_type=media_type)
+        else:
+            os.remove(encoded_path)
+
+        files = [document]
+        if name in THUMBNAIL_DOCUMENTS:
+            # Transparent areas are drawn over white, JPEG has no alpha
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.convert("RGBA"))
+            for size in THUMBNAIL_SIZES:
+                thumbnail_path = os.path.join(directory, f"{thumbnail_name(name, size)}.jpg")
+                _save(ImageOps.fit(background, (size, size), Image.Resampling.LANCZOS),
+                      thumbnail_path, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+                files.append({"name": thumbnail_name(name, size),
+                              "file_name": os.path.basename(thumbnail_path),
+                              "path": thumbnail_path,
+                              "content_type": "image/jpeg"})
+        return files
+
+class MediaPool:
+    """
+    Process pool that re-encodes uploaded documents and generates their thumbnails
+    away from the event loop.
+    """
+    def __init__(self):
+        self._executor: ProcessPoolExecutor | None = None
+
+    async def start(self):
+        """
+        Creates the pool, with MEDIA_WORKERS processes (one per CPU by default).
+        Processes are spawned so they don't inherit the threads of the app.
+        """
+        workers = int(os.getenv("MEDIA_WORKERS", "0")) or os.cpu_count()
+        self._executor = ProcessPoolExecutor(max_workers=workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        print(f"Media pool started with {workers} processes.")
+
+    async def stop(self):
+        """
+        Waits for the documents being processed and shuts the pool down.
+        """
+        if self._executor:
+            await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+            self._executor = None
+            print("Media pool stopped.")
+
+    async def ingest(self, path: str, name: str, file_name: str, content_type: str) -> list[dict]:
+        """
+        Normalizes a spooled document and generates its thumbnails, see process_document.
+
+        Args:
+            path (str): The path of the document.
+            name (str): The document name (profile_image, id_card, visa or unilav).
+            file_name (str): The file name of the document.
+            content_type (str): The media type of the document.
+
+        Returns:
+            list[dict]: The files to store (name, file_name, path, content_type), the document first.
+        """
+        if self._executor is None:
+            raise RuntimeError("The media pool is not running")
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, process_document, path, name, file_name, content_type)
+
+media_pool = MediaPool()
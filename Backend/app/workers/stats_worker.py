@@ -0,0 +1,65 @@
+import os
+import asyncio
+from contextlib import suppress
+from datetime import datetime, timedelta, timezone
+from app.dal.employees_dal import EmployeesDAL
+from app.database.connection import database
+
+""" from dal.employees_dal import EmployeesDAL
+from database.connection import database """
+
+class StatsWorker:
+    """
+    Background worker that recomputes the compliance counters every night, to
+    correct the drift of the incremental updates and count the dates that passed.
+    """
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        """
+        Schedules the recompute at STATS_RECOMPUTE_HOUR (UTC, 2 by default, -1
+        disables it). The counters are computed right away if they never were.
+        """
+        hour = int(os.getenv("STATS_RECOMPUTE_HOUR", "2"))
+        if hour < 0:
+            print("Stats worker disabled.")
+            return
+        self._task = asyncio.create_task(self._run(hour))
+        print("Stats worker started.")
+
+    async def stop(self):
+        """
+        Stops the worker, a recompute in progress is abandoned.
+        """
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+            print("Stats worker stopped.")
+
+    async def _run(self, hour: int):
+        employees_dal = EmployeesDAL(database.db)
+        try:
+            if (await employees_dal.get_stats())["recomputed_at"] is None:
+                await self._recompute(employees_dal)
+        except Exception as e:
+            print(f"Stats worker can't read the counters: {e}")
+
+        while True:
+            now = datetime.now(timezone.utc)
+            next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+            await asyncio.sleep((next_run - now).total_seconds())
+            await self._recompute(employees_dal)
+
+    async def _recompute(self, employees_dal: EmployeesDAL):
+        try:
+            changed = await employees_dal.recompute_stats()
+            print(f"Compliance counters recomputed, {changed} employee(s) changed.")
+        except Exception as e:
+            print(f"Stats worker can't recompute the counters: {e}")
+
+stats_worker = StatsWorker()
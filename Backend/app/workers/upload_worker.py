@@ -0,0 +1,176 @@
+import os
+import shutil
+import asyncio
+from contextlib import suppress
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException, UploadFile
+from starlette.datastructures import Headers
+from app.dal.employees_dal import EmployeesDAL
+from app.dal.upload_jobs_dal import UploadJobsDAL, LEASE_RENEWAL_INTERVAL
+from app.database.connection import database
+from app.database.storage import storage
+from app.routers.utils import MAX_CONCURRENT_UPLOADS, delete_employee_folder
+
+""" from dal.employees_dal import EmployeesDAL
+from dal.upload_jobs_dal import UploadJobsDAL, LEASE_RENEWAL_INTERVAL
+from database.connection import database
+from database.storage import storage
+from routers.utils import MAX_CONCURRENT_UPLOADS, delete_employee_folder """
+
+# Jobs processed at the same time by the worker
+MAX_CONCURRENT_JOBS = 4
+# Attempts before a job is marked as failed
+MAX_ATTEMPTS = 8
+# Delay before the first retry, doubled on every attempt
+RETRY_BASE_DELAY = timedelta(seconds=5)
+# How often the queue is checked when nobody wakes the worker up
+POLL_INTERVAL = 5
+
+class UploadWorker:
+    """
+    Background worker that performs the Drive writes queued in the upload outbox.
+    """
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self._jobs: set[asyncio.Task] = set()
+        self._wake = asyncio.Event()
+
+    async def start(self):
+        """
+        Starts consuming the outbox. Jobs left pending or running by a previous
+        run are picked up again.
+        """
+        self._task = asyncio.create_task(self._run())
+        print("Upload worker started.")
+
+    async def stop(self):
+        """
+        Stops the worker. Interrupted jobs are resumed when their lease expires.
+        """
+        if self._task:
+            for task in [self._task, *self._jobs]:
+                task.cancel()
+            with suppress(asyncio.CancelledError):
+                await asyncio.gather(self._task, *self._jobs, return_exceptions=True)
+            print("Upload worker stopped.")
+
+    def notify(self):
+        """
+        Wakes the worker up after a job was queued.
+        """
+        self._wake.set()
+
+    async def _run(self):
+        jobs_dal = UploadJobsDAL(database.db)
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_JOBS)
+
+        while True:
+            await semaphore.acquire()
+            self._wake.clear()
+            try:
+                job = await jobs_dal.claim_next_job()
+            except Exception as e:
+                print(f"Upload worker can't read the outbox: {e}")
+                job = None
+
+            if job is None:
+                semaphore.release()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL)
+                continue
+
+            task = asyncio.create_task(self._process(jobs_dal, job))
+            self._jobs.add(task)
+            task.add_done_callback(self._jobs.discard)
+            task.add_done_callback(lambda _: semaphore.release())
+
+    async def _heartbeat(self, jobs_dal: UploadJobsDAL, job: dict, process: asyncio.Task):
+        """
+        Renews the lease of a job while it runs, however long a single upload takes.
+        The job is stopped if the lease was lost, e.g. the worker was paused past
+        its expiry and another one claimed the job.
+        """
+        while True:
+            await asyncio.sleep(LEASE_RENEWAL_INTERVAL.total_seconds())
+            try:
+                renewed = await jobs_dal.renew_lease(job["_id"], job["lease_id"])
+            except Exception as e:
+                # Tried again at the next interval, the lease is still valid until then
+                print(f"Upload worker can't renew the lease of job {job['_id']}: {e}")
+                continue
+            if not renewed:
+                print(f"Upload job {job['_id']} was claimed by another worker, it is stopped here.")
+                process.cancel()
+                return
+
+    async def _process(self, jobs_dal: UploadJobsDAL, job: dict):
+        """
+        Creates the employee folder, uploads the pending files and stores their IDs
+        in the employee. Failed jobs are retried with exponential backoff.
+        """
+        job_id = job["_id"]
+        lease_id = job["lease_id"]
+        heartbeat = asyncio.create_task(self._heartbeat(jobs_dal, job, asyncio.current_task()))
+        try:
+            folder_id = job["folder_id"]
+            if not folder_id:
+                folder_id = await storage.create_folder(job["fiscal_code"], os.getenv("PARENT_FOLDER_ID"))
+                await jobs_dal.set_folder(job_id, lease_id, folder_id)
+
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+
+            async def upload(file: dict) -> str:
+                async with semaphore:
+                    try:
+                        with open(file["path"], "rb") as f:
+                            file_id = await storage.upload(UploadFile(f,
+                                                                    size=os.path.getsize(file["path"]),
+                                                                    filename=file["file_name"],
+                                                                    headers=Headers({"content-type": file["content_type"]})),
+                                                         folder_id)
+                    except Exception as e:
+                        await jobs_dal.set_file_failed(job_id, lease_id, file["name"], str(e))
+                        raise
+                    await jobs_dal.set_file_uploaded(job_id, lease_id, file["name"], file_id)
+                    return file_id
+
+            pending = [file for file in job["files"] if file["status"] != "uploaded"]
+            results = await asyncio.gather(*(upload(file) for file in pending), return_exceptions=True)
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                raise errors[0]
+
+            file_ids = {file["name"]: file["file_id"] for file in job["files"] if file["status"] == "uploaded"}
+            file_ids.update({file["name"]: file_id for file, file_id in zip(pending, results)})
+
+            try:
+                await EmployeesDAL(database.db).update_employee(job["fiscal_code"], {
+                    "parent_folder_id": folder_id,
+                    **{f"{name}_path": file_id for name, file_id in file_ids.items()}
+                })
+                status = "done"
+            except HTTPException:
+                # The employee was deleted while its files were uploading
+                await delete_employee_folder(storage, folder_id)
+                status = "cancelled"
+
+            # The worker that claimed the job since still needs the spooled files
+            if await jobs_dal.complete_job(job_id, lease_id, status):
+                shutil.rmtree(os.path.dirname(job["files"][0]["path"]), ignore_errors=True)
+            else:
+                print(f"Upload job {job_id} was claimed by another worker before it completed here.")
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            attempts = job["attempts"] + 1
+            retry_at = None
+            if attempts < MAX_ATTEMPTS:
+                retry_at = datetime.now(timezone.utc) + RETRY_BASE_DELAY * 2 ** (attempts - 1)
+            print(f"Upload job {job_id} failed (attempt {attempts}): {e}")
+            with suppress(Exception):
+                await jobs_dal.retry_job(job_id, lease_id, attempts, str(e), retry_at)
+        finally:
+            heartbeat.cancel()
+
+upload_worker = UploadWorker()
@@ -0,0 +1,192 @@
+"""
+Benchmark of the write cost of a purchase order assigned to many employees, with
+the purchase orders embedded in every employee (the old layout) and stored once
+in the purchase_orders collection (EmployeesDAL).
+
+Every layout creates, updates and deletes a purchase order assigned to all the
+employees. The time is the median of the rounds. The bytes are the size of the
+documents the write modifies, which MongoDB rewrites as a whole.
+
+Needs a MongoDB server, the benchmark uses and then drops its own database.
+
+Usage (from the Backend directory):
+    python -m benchmarks.purchase_order_writes --employees 500 --rounds 5
+"""
+import os
+import time
+import asyncio
+import argparse
+import statistics
+from datetime import datetime
+import bson
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+#Load environment variables
+load_dotenv()
+
+from app.dal.employees_dal import EmployeesDAL
+from app.database.indexes import ensure_indexes
+from app.models.AccessPermission import AccessPermission
+
+DATABASE = "benchmark_purchase_orders"
+
+def purchase_order(number: str) -> dict:
+    """
+    Returns a purchase order as the frontend sends it, with one access permission.
+    """
+    return {"po_number": number,
+            "description": "Maintenance of the cooling towers, second floor " * 4,
+            "issue_date": datetime(2024, 1, 1),
+            "validity_end_date": datetime(2025, 1, 1),
+            "duvri": True,
+            "requester": {"first_name": "Mario", "last_name": "Rossi", "email": "mario.rossi@example.com"},
+            "locations": ["Building A", "Building B", "Warehouse"],
+            "subapalto": {"subapalto_number": "S-1", "subapalto_status": "approved"},
+            "access_permission": [AccessPermission(protocol_number=f"{number}-AP", plant="North", status="valid",
+                                                   validity_end_date=datetime(2025, 1, 1), address="Via Roma 1",
+                                                   gates=[1, 2, 3]).model_dump()]}
+
+def reference(order: dict) -> dict:
+    return {"po_number": order["po_number"], "access_permission": order["access_permission"]}
+
+class Embedded:
+    """
+    The old layout: create_purchase_order, update_purchase_order and
+    delete_purchase_order as they were before the purchase_orders collection.
+    """
+    def __init__(self, db):
+        self.db = db
+
+    async def seed_order(self, order: dict) -> list[dict]:
+        return [order]
+
+    async def create(self, fiscal_codes: list[str], order: dict):
+        await self.db.employees.update_many({"fiscal_code": {"$in": fiscal_codes}},
+                                            {"$push": {"purchase_order": order}})
+
+    async def update(self, number: str, update_data: dict):
+        update_query = {"$set": {}}
+        for key, value in update_data.items():
+            if isinstance(value, dict):
+                for sub_key, sub_value in value.items():
+                    update_query["$set"][f"purchase_order.$[po].{key}.{sub_key}"] = sub_value
+            else:
+                update_query["$set"][f"purchase_order.$[po].{key}"] = value
+        await self.db.employees.update_many({"purchase_order.po_number": number}, update_query,
+                                            array_filters=[{"po.po_number": number}])
+
+    async def delete(self, number: str):
+        await self.db.employees.update_many({"purchase_order.po_number": number},
+                                            {"$pull": {"purchase_order": {"po_number": number}}})
+
+class Normalized:
+    """
+    The current layout, through EmployeesDAL.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.dal = EmployeesDAL(db)
+
+    async def seed_order(self, order: dict) -> list[dict]:
+        await self.db.purchase_orders.insert_one({key: value for key, value in order.items()
+                                                  if key != "access_permission"})
+        return [reference(order)]
+
+    async def create(self, fiscal_codes: list[str], order: dict):
+        await self.dal.create_purchase_order(
+            fiscal_codes=fiscal_codes,
+            po_number=order["po_number"],
+            description=order["description"],
+            issue_date=order["issue_date"],
+            validity_end_date=order["validity_end_date"],
+            duvri=order["duvri"],
+            requester_first_name=order["requester"]["first_name"],
+            requester_last_name=order["requester"]["last_name"],
+            requester_email=order["requester"]["email"],
+            locations=order["locations"],
+            subapalto_number=order["subapalto"]["subapalto_number"],
+            subapalto_status=order["subapalto"]["subapalto_status"],
+            access_permission=[AccessPermission(**permission) for permission in order["access_permission"]])
+
+    async def update(self, number: str, update_data: dict):
+        await self.dal.update_purchase_order(number, update_data)
+
+    async def delete(self, number: str):
+        await self.dal.delete_purchase_order(number)
+
+async def modified_bytes(db, number: str) -> tuple[int, int]:
+    """
+    Returns how many documents hold or reference a purchase order, and their total size.
+    """
+    documents = [doc async for doc in db.employees.find({"purchase_order.po_number": number})]
+    documents += [doc async for doc in db.purchase_orders.find({"po_number": number})]
+    return len(documents), sum(len(bson.encode(doc)) for doc in documents)
+
+async def seed(db, layout, employees: int, existing_orders: int) -> list[str]:
+    await db.employees.delete_many({})
+    await db.purchase_orders.delete_many({})
+    orders = []
+    for i in range(existing_orders):
+        orders += await layout.seed_order(purchase_order(f"EXISTING-{i}"))
+    fiscal_codes = [f"FC{i:05}" for i in range(employees)]
+    await db.employees.insert_many([{"first_name": f"Name{i}", "last_name": f"Surname{i}", "fiscal_code": fiscal_code,
+                                     "contract_type": "full time",
+                                     "contract_validity_start_date": datetime(2024, 1, 1),
+                                     "contract_validity_end_date": datetime(2025, 1, 1),
+                                     "user_credentials": {"user_name": fiscal_code, "email": f"{fiscal_code}@example.com"},
+                                     "purchase_order": orders}
+                                    for i, fiscal_code in enumerate(fiscal_codes)])
+    return fiscal_codes
+
+async def measure(db, layout, fiscal_codes: list[str], rounds: int) -> dict[str, tuple[float, int, int]]:
+    timings = {"create": [], "update": [], "delete": []}
+    sizes = {}
+    for round in range(rounds):
+        number = f"BENCH-{round}"
+        start = time.perf_counter()
+        await layout.create(fiscal_codes, purchase_order(number))
+        timings["create"].append(time.perf_counter() - start)
+        sizes["create"] = await modified_bytes(db, number)
+
+        start = time.perf_counter()
+        await layout.update(number, {"description": f"Updated {round}", "requester": {"email": "new@example.com"}})
+        timings["update"].append(time.perf_counter() - start)
+        if isinstance(layout, Embedded):
+            sizes["update"] = sizes["create"]
+        else:
+            # Only the purchase order changes
+            sizes["update"] = (1, len(bson.encode(await db.purchase_orders.find_one({"po_number": number}))))
+
+        sizes["delete"] = sizes["create"]
+        start = time.perf_counter()
+        await layout.delete(number)
+        timings["delete"].append(time.perf_counter() - start)
+
+    return {operation: (statistics.median(timings[operation]), *sizes[operation]) for operation in timings}
+
+async def run(employees: int, existing_orders: int, rounds: int):
+    client = AsyncIOMotorClient(os.getenv("MONGODB_URI"))
+    db = client[DATABASE]
+    try:
+        await ensure_indexes(db)
+        for name, layout in (("embedded", Embedded(db)), ("normalized", Normalized(db))):
+            fiscal_codes = await seed(db, layout, employees, existing_orders)
+            results = await measure(db, layout, fiscal_codes, rounds)
+            employee_size = len(bson.encode(await db.employees.find_one({})))
+            print(f"{name}: employee document {employee_size} bytes with {existing_orders} purchase order(s)")
+            for operation, (elapsed, documents, size) in results.items():
+                print(f"  {operation:<6} {elapsed * 1000:8.1f} ms  {documents:5} document(s)  {size / 1024:9.1f} KiB")
+    finally:
+        await client.drop_database(DATABASE)
+        client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--employees", type=int, default=500, help="Employees the purchase order is assigned to")
+    parser.add_argument("--existing-orders", type=int, default=5, help="Purchase orders every employee already has")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.employees, args.existing_orders, args.rounds))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark of concurrent /retrieve_files throughput against a local fake Google Drive.
+
+The fake server answers the OAuth token exchange and the Drive media downloads
+with a fixed latency, so the numbers only measure how well the backend overlaps
+Drive round trips. MongoDB is replaced by a stub DAL.
+
+Usage (from the Backend directory):
+    python -m benchmarks.retrieve_files --requests 500 --concurrency 50
+"""
+import os
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import rsa
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+IMAGE = os.urandom(64 * 1024)
+
+def fake_drive(latency: float) -> Starlette:
+    """
+    Builds a fake Drive API that serves IMAGE for every file ID.
+    """
+    async def token(request):
+        return JSONResponse({"access_token": "fake-token", "expires_in": 3600})
+
+    async def media(request):
+        await asyncio.sleep(latency)
+        return Response(IMAGE, media_type="image/png")
+
+    return Starlette(routes=[Route("/token", token, methods=["POST"]),
+                             Route("/drive/v3/files/{file_id}", media)])
+
+def start_server(app: Starlette) -> str:
+    """
+    Runs the fake server in a background thread and returns its URL.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+def write_service_account(token_uri: str) -> str:
+    """
+    Writes a throwaway service account file pointing at the fake token endpoint.
+    """
+    _, private_key = rsa.newkeys(1024)
+    info = {"type": "service_account",
+            "client_email": "benchmark@fake.iam.gserviceaccount.com",
+            "client_id": "0",
+            "private_key_id": "0",
+            "private_key": private_key.save_pkcs1().decode(),
+            "token_uri": token_uri}
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(info, f)
+    return f.name
+
+class StubEmployeesDAL:
+    async def get_file_id(self, fiscal_code: str, name: str):
+        return f"{fiscal_code}-{name}", "folder"
+
+async def run(total: int, concurrency: int):
+    from app.main import app
+    from app.database.dependencies import get_employees_dal
+    from app.database.drive import drive
+
+    app.dependency_overrides[get_employees_dal] = StubEmployeesDAL
+    await drive.connect()
+
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://backend") as client:
+        async def fetch(i: int):
+            async with semaphore:
+                response = await client.get(f"/retrieve_files/EMP{i % 100}/")
+                assert response.status_code == 200 and len(response.content) == len(IMAGE)
+
+        # Warm up the token and the connection pool
+        await fetch(0)
+        start = time.perf_counter()
+        await asyncio.gather(*(fetch(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    await drive.close()
+    print(f"{total} requests, concurrency {concurrency}: "
+          f"{elapsed:.2f}s, {total / elapsed:.1f} req/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake Drive latency in seconds")
+    args = parser.parse_args()
+
+    url = start_server(fake_drive(args.latency))
+    os.environ["DRIVE_API_URL"] = url
+    # The fake server speaks plain HTTP/1.1
+    os.environ["DRIVE_HTTP2"] = "false"
+    os.environ["SERVICE_ACCOUNT_FILE"] = write_service_account(f"{url}/token")
+    try:
+        asyncio.run(run(args.requests, args.concurrency))
+    finally:
+        os.remove(os.environ["SERVICE_ACCOUNT_FILE"])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import asyncio
+from app.database.document_cache import DocumentCache
+
+CONTENT = bytes(range(256)) * 64
+
+class FakeStorage:
+    """
+    Remote storage sending a document in chunks. After the first chunk it waits
+    for the test to release the rest.
+    """
+    def __init__(self):
+        self.ranges = []
+        self.chunks_sent = 0
+        self.release = asyncio.Event()
+
+    async def stream(self, file_id: str, byte_range=None):
+        self.ranges.append(byte_range)
+        first, last = byte_range or (0, len(CONTENT) - 1)
+        for start in range(first, last + 1, 1024):
+            if self.chunks_sent and byte_range is None:
+                await self.release.wait()
+            await asyncio.sleep(0)
+            self.chunks_sent += 1
+            yield CONTENT[start:min(start + 1024, last + 1)]
+
+async def connected_cache(tmp_path, monkeypatch) -> DocumentCache:
+    monkeypatch.setenv("DOCUMENT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("DOCUMENT_CACHE_BYTES", str(1024 * 1024))
+    cache = DocumentCache()
+    await cache.connect()
+    return cache
+
+async def read_cached(cache: DocumentCache) -> bytes | None:
+    f = await cache.open("doc", "v1")
+    if f is None:
+        return None
+    with f:
+        return f.read()
+
+async def read_all(chunks) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
+
+def test_concurrent_misses_share_one_fetch(tmp_path, monkeypatch):
+    async def run():
+        cache = await connected_cache(tmp_path, monkeypatch)
+        storage = FakeStorage()
+        assert await cache.open("doc", "v1") is None
+
+        first_client = cache.stream(storage, "doc", "v1", len(CONTENT))
+        second_client = cache.stream(storage, "doc", "v1", len(CONTENT))
+        # The clients get the first chunk before the rest was downloaded
+        assert await anext(first_client) == CONTENT[:1024]
+        assert await anext(second_client) == CONTENT[:1024]
+        assert storage.chunks_sent == 1
+        assert await read_cached(cache) is None
+
+        storage.release.set()
+        first, second = await asyncio.gather(read_all(first_client), read_all(second_client))
+        assert CONTENT[:1024] + first == CONTENT
+        assert CONTENT[:1024] + second == CONTENT
+        assert storage.ranges == [None]
+
+        await asyncio.gather(*[fetch.task for fetch in cache._fetches.values()])
+        assert await read_cached(cache) == CONTENT
+        assert list(tmp_path.glob("*.part")) == []
+        return cache.stats()
+
+    stats = asyncio.run(run())
+    assert stats["misses"] == 1
+    assert stats["collapsed_misses"] == 1
+    assert stats["hits"] == 1
+
+def test_ranged_miss_sends_only_the_range_and_fills_in_the_background(tmp_path, monkeypatch):
+    async def run():
+        cache = await connected_cache(tmp_path, monkeypatch)
+        storage = FakeStorage()
+        storage.release.set()
+
+        assert await read_all(cache.stream(storage, "doc", "v1", len(CONTENT), (100, 199))) == CONTENT[100:200]
+        assert (100, 199) in storage.ranges
+
+        await asyncio.gather(*[fetch.task for fetch in cache._fetches.values()])
+        assert await read_cached(cache) == CONTENT
+        assert storage.ranges.count(None) == 1
+
+    asyncio.run(run())
+
+def test_client_disconnecting_doesnt_stop_the_fetch(tmp_path, monkeypatch):
+    async def run():
+        cache = await connected_cache(tmp_path, monkeypatch)
+        storage = FakeStorage()
+        chunks = cache.stream(storage, "doc", "v1", len(CONTENT))
+        await anext(chunks)
+        await chunks.aclose()
+
+        storage.release.set()
+        await asyncio.gather(*[fetch.task for fetch in cache._fetches.values()])
+        assert await read_cached(cache) == CONTENT
+        assert cache._fetches == {}
+
+    asyncio.run(run())
+
+def test_failed_fetch_leaves_nothing_in_the_cache(tmp_path, monkeypatch):
+    class FailingStorage(FakeStorage):
+        async def stream(self, file_id: str, byte_range=None):
+            yield CONTENT[:1024]
+            raise ConnectionError("connection lost")
+
+    async def run():
+        cache = await connected_cache(tmp_path, monkeypatch)
+        try:
+            await read_all(cache.stream(FailingStorage(), "doc", "v1", len(CONTENT)))
+        except RuntimeError as e:
+            assert "connection lost" in str(e)
+        else:
+            raise AssertionError("the client got a truncated document")
+
+        await asyncio.gather(*[fetch.task for fetch in cache._fetches.values()], return_exceptions=True)
+        assert await read_cached(cache) is None
+        assert list(tmp_path.iterdir()) == []
+        assert cache._fetches == {}
+
+    asyncio.run(run())
@@ -0,0 +1,13 @@
+from app.routers.utils import document_version
+
+def test_checksum_is_the_version():
+    assert document_version({"md5Checksum": "abc", "version": "7", "modifiedTime": "t", "size": "1"}) == "abc"
+
+def test_drive_version_without_checksum():
+    assert document_version({"version": "7", "modifiedTime": "t", "size": "1"}) == "7"
+
+def test_replaced_file_changes_version_without_checksum_nor_version():
+    before = document_version({"id": "f1", "modifiedTime": "2024-05-01T10:00:00.000Z", "size": "10"})
+    after = document_version({"id": "f1", "modifiedTime": "2024-05-02T10:00:00.000Z", "size": "10"})
+    assert before != after
+    assert "f1" not in before
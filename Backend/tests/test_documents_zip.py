@@ -0,0 +1,54 @@
+import io
+import asyncio
+import zipfile
+import httpx
+from fastapi import HTTPException
+from app.routers.utils import stream_documents_zip
+
+class FakeStorage:
+    """
+    Drive with one good document and one failure of every kind.
+    """
+    files = {"good": b"good content" * 1000,
+             "timeout_before": None,
+             "timeout_midway": b"first chunk",
+             "missing": None}
+
+    async def get_metadata(self, file_id: str, fields: str | None = None) -> dict:
+        if file_id == "timeout_before":
+            raise httpx.ReadTimeout("Drive didn't answer")
+        if file_id == "missing":
+            raise HTTPException(status_code=404, detail="File not found in Google Drive")
+        return {"name": f"{file_id}.pdf"}
+
+    async def stream(self, file_id: str, byte_range=None):
+        content = self.files[file_id]
+        for start in range(0, len(content), 1024):
+            yield content[start:start + 1024]
+        if file_id == "timeout_midway":
+            raise httpx.ReadTimeout("connection lost")
+
+async def build_archive(documents: dict) -> bytes:
+    return b"".join([chunk async for chunk in stream_documents_zip(FakeStorage(), documents)])
+
+def read_archive(documents: dict) -> zipfile.ZipFile:
+    # A hanging consumer fails the test instead of blocking it
+    content = asyncio.run(asyncio.wait_for(build_archive(documents), timeout=5))
+    archive = zipfile.ZipFile(io.BytesIO(content))
+    assert archive.testzip() is None
+    return archive
+
+def test_failed_downloads_dont_hang_nor_cut_the_archive():
+    archive = read_archive({"FC1": {"id_card": "timeout_before", "visa": "timeout_midway"},
+                            "FC2": {"unilav": "missing", "id_card": "good"}})
+
+    assert archive.read("FC2/good.pdf") == FakeStorage.files["good"]
+    assert archive.read("FC1/timeout_midway.pdf") == b"first chunk"
+    errors = archive.read("errors.txt").decode()
+    assert "FC1/id_card: left out, ReadTimeout" in errors
+    assert "FC1/timeout_midway.pdf: incomplete, ReadTimeout" in errors
+    assert "FC2/unilav: left out, File not found" in errors
+
+def test_archive_without_errors_has_no_error_list():
+    archive = read_archive({"FC2": {"id_card": "good"}})
+    assert archive.namelist() == ["FC2/good.pdf"]
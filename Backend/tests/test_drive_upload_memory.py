@@ -0,0 +1,92 @@
+import io
+import asyncio
+import tracemalloc
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+import httpx
+import pytest
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+from app.database.drive import Drive, CHUNK_SIZE
+
+FILE_SIZE = 200 * 1024 * 1024
+# Memory an upload may use, whatever the size of the file
+MEMORY_CEILING = 8 * CHUNK_SIZE
+
+class GeneratedFile(io.RawIOBase):
+    """
+    File of FILE_SIZE bytes produced as it is read, so the test itself doesn't hold it.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, n: int = -1) -> bytes:
+        n = self.size - self.position if n < 0 else min(n, self.size - self.position)
+        self.position += n
+        return bytes(n)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self.position = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence] + offset
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+class FakeDrive(httpx.AsyncBaseTransport):
+    """
+    Drive upload endpoints that count what they receive without keeping it.
+    httpx.MockTransport reads the whole request first, so it can't be used.
+    """
+    def __init__(self):
+        self.received = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        params = request.url.params
+        if request.method == "POST" and params.get("uploadType") == "resumable":
+            return httpx.Response(200, headers={"Location": "https://drive.test/upload/session"})
+        if request.method == "PUT":
+            async for chunk in request.stream:
+                self.received += len(chunk)
+            if self.received < FILE_SIZE:
+                return httpx.Response(308, headers={"Range": f"bytes=0-{self.received - 1}"})
+            return httpx.Response(200, json={"id": "uploaded"})
+        if request.method == "POST" and params.get("uploadType") == "multipart":
+            async for chunk in request.stream:
+                self.received += len(chunk)
+            return httpx.Response(200, json={"id": "uploaded"})
+        return httpx.Response(404)
+
+def connected_drive(fake: FakeDrive) -> Drive:
+    drive = Drive()
+    drive.credentials = SimpleNamespace(token="token",
+                                        expiry=datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=1))
+    drive.client = httpx.AsyncClient(base_url="https://drive.test", transport=fake)
+    return drive
+
+async def upload(resumable: bool) -> tuple[str, int, int]:
+    fake = FakeDrive()
+    drive = connected_drive(fake)
+    file = UploadFile(GeneratedFile(FILE_SIZE), size=FILE_SIZE, filename="big.pdf",
+                      headers=Headers({"content-type": "application/pdf"}))
+    tracemalloc.start()
+    try:
+        file_id = await drive.upload(file, "folder", resumable=resumable)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        await drive.client.aclose()
+    return file_id, fake.received, peak
+
+@pytest.mark.parametrize("resumable", [True, False], ids=["resumable", "multipart"])
+def test_200_mb_upload_stays_under_the_memory_ceiling(resumable):
+    file_id, received, peak = asyncio.run(upload(resumable))
+    assert file_id == "uploaded"
+    assert received >= FILE_SIZE
+    assert peak < MEMORY_CEILING, f"peak {peak / 1024 / 1024:.1f} MiB"
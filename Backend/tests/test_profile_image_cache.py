@@ -0,0 +1,46 @@
+import asyncio
+from cachetools import TTLCache
+from app.routers import utils
+
+class FakeStorage:
+    """
+    Storage whose profile image is replaced in place, keeping its ID.
+    """
+    def __init__(self):
+        self.content = b"old image"
+        self.downloads = 0
+
+    async def download(self, file_id: str) -> bytes:
+        self.downloads += 1
+        return self.content
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def test_image_replaced_by_another_process_is_served_after_the_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(utils, "profile_image_cache",
+                        TTLCache(maxsize=1024, ttl=60, timer=clock, getsizeof=lambda entry: len(entry[0])))
+    storage = FakeStorage()
+
+    content, etag = asyncio.run(utils.get_profile_image(storage, "image"))
+    assert content == b"old image"
+
+    # Another process replaces the image, this one isn't told
+    storage.content = b"new image"
+    clock.now = 30
+    assert asyncio.run(utils.get_profile_image(storage, "image")) == (content, etag)
+    assert storage.downloads == 1
+
+    clock.now = 61
+    new_content, new_etag = asyncio.run(utils.get_profile_image(storage, "image"))
+    assert new_content == b"new image"
+    assert new_etag != etag
+
+def test_configured_cache_expires_entries():
+    assert isinstance(utils.profile_image_cache, TTLCache)
+    assert utils.profile_image_cache.ttl > 0
@@ -0,0 +1,28 @@
+import asyncio
+import httpx
+from fastapi import HTTPException
+from app.routers.utils import stream_profile_images
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+
+class FakeStorage:
+    """
+    Drive with one image, one missing and one timing out.
+    """
+    async def download(self, file_id: str) -> bytes:
+        if file_id == "timeout":
+            raise httpx.ReadTimeout("Drive didn't answer")
+        if file_id == "missing":
+            raise HTTPException(status_code=404, detail="File not found in Google Drive")
+        return PNG
+
+async def read_body(file_ids: dict[str, str]) -> bytes:
+    return b"".join([chunk async for chunk in stream_profile_images(FakeStorage(), file_ids, "boundary")])
+
+def test_failed_downloads_are_left_out():
+    body = asyncio.run(asyncio.wait_for(read_body({"A": "image", "B": "timeout", "C": "missing"}), timeout=5))
+
+    assert body.count(b"--boundary\r\n") == 1
+    assert b'name="A"' in body
+    assert PNG in body
+    assert body.endswith(b"--boundary--\r\n")
@@ -0,0 +1,156 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+from pymongo.results import UpdateResult
+from app.dal.employees_dal import EmployeesDAL
+
+def update_result(matched: int, modified: int) -> UpdateResult:
+    return UpdateResult({"n": matched, "nModified": modified, "ok": 1}, True)
+
+class FakeCollection:
+    """
+    Collection answering every update with the same result and recording the calls.
+    """
+    def __init__(self, result: UpdateResult | None = None):
+        self.result = result
+        self.calls = []
+
+    async def update_one(self, query: dict, update: dict, **kwargs) -> UpdateResult:
+        self.calls.append(("update_one", query, update))
+        return self.result
+
+    async def update_many(self, query: dict, update: dict, **kwargs) -> UpdateResult:
+        self.calls.append(("update_many", query, update))
+        return self.result
+
+    async def find_one(self, query: dict, **kwargs) -> dict | None:
+        return None
+
+class FakePurchaseOrders:
+    """
+    purchase_orders collection holding documents by po_number.
+    """
+    def __init__(self, *documents: dict):
+        self.documents = {document["po_number"]: document for document in documents}
+
+    async def find_one_and_update(self, query: dict, update: dict, upsert: bool = False, **kwargs) -> dict | None:
+        existing = self.documents.get(query["po_number"])
+        if existing is None and upsert:
+            self.documents[query["po_number"]] = {**query, **update.get("$setOnInsert", {})}
+        elif existing is not None:
+            existing.update(update.get("$set", {}))
+        return existing
+
+    async def delete_one(self, query: dict):
+        self.documents.pop(query["po_number"], None)
+
+def employees_dal(purchase_orders: FakeCollection, employees: FakeCollection) -> tuple[EmployeesDAL, list]:
+    dal = EmployeesDAL(SimpleNamespace(employees=employees, purchase_orders=purchase_orders, stats=None))
+    refreshed = []
+
+    async def refresh_summaries(query: dict, totals=None) -> int:
+        refreshed.append(query)
+        return 0
+
+    dal.refresh_summaries = refresh_summaries
+    return dal, refreshed
+
+def test_update_of_the_access_permissions_only_succeeds():
+    # The details are the same, only the employees change
+    purchase_orders = FakeCollection(update_result(1, 0))
+    employees = FakeCollection(update_result(3, 3))
+    dal, refreshed = employees_dal(purchase_orders, employees)
+
+    result = asyncio.run(dal.update_purchase_order("PO1", {"description": "same", "access_permission": []}))
+
+    assert result.modified_count == 3
+    assert refreshed == [{"purchase_order.po_number": "PO1"}]
+
+def test_update_of_the_details_only_refreshes_for_a_new_end_date():
+    dal, refreshed = employees_dal(FakeCollection(update_result(1, 1)), FakeCollection())
+
+    assert asyncio.run(dal.update_purchase_order("PO1", {"description": "new"})).modified_count == 1
+    assert refreshed == []
+
+    assert asyncio.run(dal.update_purchase_order("PO1", {"validity_end_date": "2030-01-01"})).modified_count == 1
+    assert refreshed == [{"purchase_order.po_number": "PO1"}]
+
+def test_renamed_purchase_order_refreshes_the_employees_under_the_new_number():
+    dal, refreshed = employees_dal(FakeCollection(update_result(1, 1)), FakeCollection(update_result(2, 2)))
+
+    assert asyncio.run(dal.update_purchase_order("PO1", {"po_number": "PO2"})).modified_count == 2
+    assert refreshed == [{"purchase_order.po_number": "PO2"}]
+
+def test_update_changing_nothing_fails():
+    dal, refreshed = employees_dal(FakeCollection(update_result(1, 0)), FakeCollection(update_result(2, 0)))
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(dal.update_purchase_order("PO1", {"po_number": "PO1", "description": "same"}))
+    assert error.value.status_code == 400
+    assert refreshed == []
+
+DETAILS = {"description": "Maintenance",
+           "issue_date": datetime(2025, 1, 1, tzinfo=timezone.utc),
+           "validity_end_date": datetime(2026, 1, 1, 12, 0, 0, 123456),
+           "duvri": True,
+           "requester": {"first_name": "Ada", "last_name": "Rossi", "email": "ada@example.com"},
+           "locations": ["Milan"],
+           "subapalto": {"subapalto_number": "S1", "subapalto_status": "open"}}
+
+def create(dal: EmployeesDAL, description: str = DETAILS["description"]) -> UpdateResult:
+    return asyncio.run(dal.create_purchase_order(
+        fiscal_codes=["FC1", "FC2"],
+        po_number="PO1",
+        description=description,
+        issue_date=DETAILS["issue_date"],
+        validity_end_date=DETAILS["validity_end_date"],
+        duvri=DETAILS["duvri"],
+        requester_first_name="Ada",
+        requester_last_name="Rossi",
+        requester_email="ada@example.com",
+        locations=["Milan"],
+        subapalto_number="S1",
+        subapalto_status="open",
+        access_permission=[]))
+
+def test_created_purchase_order_is_assigned():
+    purchase_orders = FakePurchaseOrders()
+    dal, refreshed = employees_dal(purchase_orders, FakeCollection(update_result(2, 2)))
+
+    assert create(dal).modified_count == 2
+    assert purchase_orders.documents["PO1"]["description"] == "Maintenance"
+    assert refreshed == [{"fiscal_code": {"$in": ["FC1", "FC2"]}, "purchase_order.po_number": "PO1"}]
+
+def test_existing_purchase_order_with_the_same_details_is_assigned():
+    # As read back from Mongo: naive UTC dates in milliseconds
+    stored = {**DETAILS, "po_number": "PO1",
+              "issue_date": datetime(2025, 1, 1),
+              "validity_end_date": datetime(2026, 1, 1, 12, 0, 0, 123000)}
+    dal, refreshed = employees_dal(FakePurchaseOrders(stored), FakeCollection(update_result(1, 1)))
+
+    assert create(dal).modified_count == 1
+    assert len(refreshed) == 1
+
+def test_existing_purchase_order_with_other_details_is_neither_changed_nor_assigned():
+    purchase_orders = FakePurchaseOrders({**DETAILS, "po_number": "PO1"})
+    employees = FakeCollection(update_result(2, 2))
+    dal, refreshed = employees_dal(purchase_orders, employees)
+
+    with pytest.raises(HTTPException) as error:
+        create(dal, description="Something else")
+    assert error.value.status_code == 409
+    assert purchase_orders.documents["PO1"]["description"] == "Maintenance"
+    assert employees.calls == []
+    assert refreshed == []
+
+def test_purchase_order_assigned_to_nobody_is_not_left_behind():
+    purchase_orders = FakePurchaseOrders()
+    dal, refreshed = employees_dal(purchase_orders, FakeCollection(update_result(0, 0)))
+
+    with pytest.raises(HTTPException) as error:
+        create(dal)
+    assert error.value.status_code == 400
+    assert purchase_orders.documents == {}
+    assert refreshed == []
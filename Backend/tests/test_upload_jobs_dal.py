@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from app.dal import upload_jobs_dal as jobs_module
+from app.dal.upload_jobs_dal import UploadJobsDAL
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+FILES = [{"name": "id_card", "file_name": "id.pdf", "path": "/spool/job/id.pdf", "content_type": "application/pdf"}]
+
+async def stale_and_current_leases(monkeypatch) -> tuple[UploadJobsDAL, dict, dict]:
+    """
+    Returns a job claimed by a worker whose lease expired, then claimed by another one.
+    """
+    jobs_dal = UploadJobsDAL(mongomock_motor.AsyncMongoMockClient().db)
+    await jobs_dal.create_job("job", "FC", FILES)
+    monkeypatch.setattr(jobs_module, "JOB_LEASE", timedelta(seconds=-1))
+    stale = await jobs_dal.claim_next_job()
+    monkeypatch.setattr(jobs_module, "JOB_LEASE", timedelta(minutes=5))
+    current = await jobs_dal.claim_next_job()
+    assert stale["lease_id"] != current["lease_id"]
+    return jobs_dal, stale, current
+
+def test_stale_lease_doesnt_write_the_job(monkeypatch):
+    async def run():
+        jobs_dal, stale, current = await stale_and_current_leases(monkeypatch)
+
+        await jobs_dal.set_folder("job", stale["lease_id"], "stale folder")
+        await jobs_dal.set_file_uploaded("job", stale["lease_id"], "id_card", "stale file")
+        assert not await jobs_dal.complete_job("job", stale["lease_id"])
+        assert not await jobs_dal.retry_job("job", stale["lease_id"], 1, "error", datetime.now(timezone.utc))
+
+        job = await jobs_dal.get_job("job")
+        assert job["status"] == "running"
+        assert job["lease_id"] == current["lease_id"]
+        assert job["lease_expires_at"] is not None
+        assert job["folder_id"] is None
+        assert job["files"][0]["status"] == "pending"
+
+        # Once done, the stale worker can't put the job back in the queue either
+        assert await jobs_dal.complete_job("job", current["lease_id"])
+        assert not await jobs_dal.retry_job("job", stale["lease_id"], 1, "error", datetime.now(timezone.utc))
+        assert (await jobs_dal.get_job("job"))["status"] == "done"
+
+    asyncio.run(run())
+
+def test_current_lease_writes_the_job(monkeypatch):
+    async def run():
+        jobs_dal, _, current = await stale_and_current_leases(monkeypatch)
+
+        await jobs_dal.set_folder("job", current["lease_id"], "folder")
+        await jobs_dal.set_file_uploaded("job", current["lease_id"], "id_card", "file")
+        job = await jobs_dal.get_job("job")
+        assert job["folder_id"] == "folder"
+        assert job["files"][0]["file_id"] == "file"
+
+        assert await jobs_dal.retry_job("job", current["lease_id"], 1, "error", datetime.now(timezone.utc))
+        assert (await jobs_dal.get_job("job"))["status"] == "pending"
+
+    asyncio.run(run())
@@ -0,0 +1,46 @@
+import asyncio
+from datetime import timedelta
+import pytest
+from app.workers import upload_worker as worker_module
+from app.workers.upload_worker import UploadWorker
+
+class FakeJobsDAL:
+    def __init__(self, held: bool = True):
+        self.held = held
+        self.renewals = []
+
+    async def renew_lease(self, job_id: str, lease_id: str) -> bool:
+        self.renewals.append((job_id, lease_id))
+        return self.held
+
+@pytest.fixture(autouse=True)
+def short_lease(monkeypatch):
+    monkeypatch.setattr(worker_module, "LEASE_RENEWAL_INTERVAL", timedelta(milliseconds=20))
+
+async def run_job(jobs_dal: FakeJobsDAL, duration: float) -> bool:
+    """
+    Runs a job as long as a slow upload, with its heartbeat. Returns whether it finished.
+    """
+    async def slow_upload():
+        await asyncio.sleep(duration)
+
+    process = asyncio.create_task(slow_upload())
+    heartbeat = asyncio.create_task(UploadWorker()._heartbeat(jobs_dal, {"_id": "job", "lease_id": "lease"}, process))
+    try:
+        await process
+        return True
+    except asyncio.CancelledError:
+        return False
+    finally:
+        heartbeat.cancel()
+
+def test_lease_is_renewed_while_a_single_upload_runs():
+    jobs_dal = FakeJobsDAL()
+    assert asyncio.run(run_job(jobs_dal, 0.3))
+    assert len(jobs_dal.renewals) >= 5
+    assert set(jobs_dal.renewals) == {("job", "lease")}
+
+def test_job_stops_when_another_worker_claimed_it():
+    jobs_dal = FakeJobsDAL(held=False)
+    assert not asyncio.run(run_job(jobs_dal, 5))
+    assert len(jobs_dal.renewals) == 1